@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+from slack_archive import attachments, client, index, storage
+
+
+def run_archive(options):
+    """ downloads everything new from slack into the archive
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    from slack_archive import archive
+    from slack_archive.config import load_crypter, settings
+    archive.main(load_crypter().decrypt(settings['api_token']))
+
+
+def run_fetch_attachments(options):
+    """ downloads every file referenced by the archive that isn't in its attachment store yet
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    from slack_archive.config import load_crypter, settings
+    token = load_crypter().decrypt(settings['api_token'])
+    session = client.SlackSession(token, pool_size=options.workers)
+    attachments.download_attachments(options.archive, session, options.workers)
+
+
+def run_benchmark(options):
+    """ times each stage of archiving a synthetic workspace served by a local fake slack, writing the report as
+        json and comparing it to a baseline report if one is given
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    from slack_archive import benchmark
+    report = benchmark.run_benchmark(options.channels, options.messages_per_day, options.thread_depth,
+                                     options.years, options.repeat, options.format, options.merge_workers,
+                                     options.seed)
+    comparison = None
+    if options.baseline:
+        with open(options.baseline) as read_file:
+            comparison = benchmark.compare_reports(json.load(read_file), report, options.threshold)
+    print(benchmark.format_report(report, comparison))
+    if options.output:
+        with open(options.output, 'w') as write_file:
+            json.dump(report, write_file, indent=4, sort_keys=True)
+    if comparison and any(result['regressed'] for result in comparison.values()):
+        raise SystemExit(1)
+
+
+def run_migrate_format(options):
+    """ rewrites every day file of an archive in another storage format, or moves them to another layout
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    if options.format is None and options.layout is None:
+        raise SystemExit('migrate-format needs a --format, a --layout or both')
+    migrated = storage.migrate(options.archive, options.format, options.layout)
+    print("Migrated {0} day files to {1}".format(migrated, ' '.join(filter(None, (options.format, options.layout)))))
+    if migrated and os.path.exists(index.index_path(options.archive)):
+        # the index points at the day files by path
+        run_reindex(options)
+
+
+def run_migrate_layout(options):
+    """ moves the channel folders of an archive saved before folders were named by channel id over to their ids,
+        building the message index again if the archive has one
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    from slack_archive import archive, state
+    aliases = state.ChannelAliases(os.path.join(options.archive, state.ALIASES_FILE))
+    migrated = archive.migrate_layout(options.archive, aliases)
+    print("Moved {0} channel folders".format(migrated))
+    if migrated and os.path.exists(index.index_path(options.archive)):
+        run_reindex(options)
+
+
+def run_export(options):
+    """ writes the chosen channels and days of the archive to a zip in the layout of slack's own exports
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    from slack_archive import export
+    exported = export.export_archive(options.archive, options.output, options.channel, options.start, options.end,
+                                     options.workers, options.level)
+    print("Exported {0} day files to {1}".format(exported, options.output))
+
+
+def run_verify(options):
+    """ checks every day file of the archive against the checksums recorded when it was written, printing the files
+        that don't match or have gone missing and exiting 1 if there are any
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    report = storage.verify_archive(options.archive, options.workers, options.record)
+    for path in report['mismatched']:
+        print('mismatched\t{}'.format(path))
+    for path in report['missing']:
+        print('missing\t{}'.format(path))
+    print("Verified {0} day files: {1} mismatched, {2} missing, {3} {4}".format(
+        report['checked'], len(report['mismatched']), len(report['missing']), len(report['unrecorded']),
+        'newly recorded' if options.record else 'unrecorded'))
+    if report['mismatched'] or (report['missing'] and not options.record):
+        raise SystemExit(1)
+
+
+def run_reindex(options):
+    """ builds the archive's message index again from its day files
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    with index.MessageIndex(index.index_path(options.archive)) as message_index:
+        indexed = message_index.rebuild(options.archive)
+    print("Indexed {0} messages".format(indexed))
+
+
+def _open_index(options):
+    """ opens the message index of the archive on the command line, stopping if it has never been built
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: the index
+    :rtype: index.MessageIndex
+    """
+    path = index.index_path(options.archive)
+    if not os.path.exists(path):
+        raise SystemExit('{} has no message index, build it with the reindex command'.format(options.archive))
+    return index.MessageIndex(path)
+
+
+def _channel_id(options):
+    """ gets the id of the channel on the command line, which can be given by name or id
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: slack channel id, None if no channel was given
+    :rtype: str
+    """
+    if options.channel is None:
+        return None
+    return index.channel_ids(options.archive).get(options.channel, options.channel)
+
+
+def run_query(options):
+    """ looks messages up in the archive's message index, printing a line for each match
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    channel_id = _channel_id(options)
+    with _open_index(options) as message_index:
+        rows = message_index.query(channel_id, options.user, options.start, options.end, options.thread,
+                                   options.limit)
+        if options.messages:
+            for message in message_index.load_messages(rows):
+                print(json.dumps(message, sort_keys=True))
+        else:
+            for row in rows:
+                print(index.format_row(row))
+
+
+def run_search(options):
+    """ searches the text of the archived messages, printing the channel, date and ts of each hit
+    :param options: parsed command line options
+    :type options: argparse.Namespace
+    :return: None
+    """
+    channel_id = _channel_id(options)
+    with _open_index(options) as message_index:
+        for hit in message_index.search(' '.join(options.terms), channel_id, options.start, options.end,
+                                        options.limit):
+            print('\t'.join([hit['channel_id'], hit['date'], hit['ts']]))
+
+
+def parse_args(args=None):
+    """ parses the command line
+    :param args: arguments to parse, defaults to sys.argv
+    :type args: list(str)
+    :return: parsed options
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog='slack_archive', description='Archives a slack workspace by day')
+    parser.set_defaults(func=run_archive)
+    commands = parser.add_subparsers(title='commands')
+
+    archive_parser = commands.add_parser('archive', help='download everything new into the archive (default)')
+    archive_parser.set_defaults(func=run_archive)
+
+    migrate_parser = commands.add_parser('migrate-format',
+                                         help='rewrite the day files in another storage format or layout')
+    migrate_parser.add_argument('archive', help='path to the archive folder')
+    migrate_parser.add_argument('--format', choices=sorted(storage.EXTENSIONS))
+    migrate_parser.add_argument('--layout', choices=storage.LAYOUTS,
+                                help='flat for YYYY-MM-DD files, sharded for YYYY/MM/DD files')
+    migrate_parser.set_defaults(func=run_migrate_format)
+
+    layout_parser = commands.add_parser('migrate-layout', help='move channel folders named after channels to their ids')
+    layout_parser.add_argument('archive', help='path to the archive folder')
+    layout_parser.set_defaults(func=run_migrate_layout)
+
+    attachments_parser = commands.add_parser('fetch-attachments',
+                                             help='download every file shared in the archive that is missing')
+    attachments_parser.add_argument('archive', help='path to the archive folder')
+    attachments_parser.add_argument('--workers', type=int, default=4, help='number of files downloaded at once')
+    attachments_parser.set_defaults(func=run_fetch_attachments)
+
+    export_parser = commands.add_parser('export', help='write channels to a zip in the slack export format')
+    export_parser.add_argument('archive', help='path to the archive folder')
+    export_parser.add_argument('output', help='path of the zip to write')
+    export_parser.add_argument('--channel', action='append', help='channel name or id, repeat for more, default all')
+    export_parser.add_argument('--start', help='first day to include, YYYY-MM-DD')
+    export_parser.add_argument('--end', help='day to stop before, YYYY-MM-DD')
+    export_parser.add_argument('--workers', type=int, default=4, help='number of threads compressing at once')
+    export_parser.add_argument('--level', type=int, default=6, choices=range(10), metavar='0-9',
+                               help='zlib compression level')
+    export_parser.set_defaults(func=run_export)
+
+    benchmark_parser = commands.add_parser('benchmark', help='time archiving a synthetic workspace')
+    benchmark_parser.add_argument('--channels', type=int, default=10)
+    benchmark_parser.add_argument('--messages-per-day', type=int, default=20)
+    benchmark_parser.add_argument('--thread-depth', type=int, default=3, help='replies in each thread')
+    benchmark_parser.add_argument('--years', type=float, default=1, help='years of history')
+    benchmark_parser.add_argument('--repeat', type=int, default=1, help='runs of each phase, the best is kept')
+    benchmark_parser.add_argument('--format', default='json', choices=sorted(storage.EXTENSIONS))
+    benchmark_parser.add_argument('--merge-workers', type=int, default=1)
+    benchmark_parser.add_argument('--seed', type=int, default=0)
+    benchmark_parser.add_argument('--output', help='file to write the json report to')
+    benchmark_parser.add_argument('--baseline', help='json report to compare against, exits 1 on a regression')
+    benchmark_parser.add_argument('--threshold', type=float, default=0.2,
+                                  help='fraction slower than the baseline that counts as a regression')
+    benchmark_parser.set_defaults(func=run_benchmark)
+
+    verify_parser = commands.add_parser('verify', help='check the day files against their recorded checksums')
+    verify_parser.add_argument('archive', help='path to the archive folder')
+    verify_parser.add_argument('--workers', type=int, default=4, help='number of files hashed at once')
+    verify_parser.add_argument('--record', action='store_true',
+                               help='record the checksums of files that have none and forget missing files')
+    verify_parser.set_defaults(func=run_verify)
+
+    reindex_parser = commands.add_parser('reindex', help='build the message index again from the day files')
+    reindex_parser.add_argument('archive', help='path to the archive folder')
+    reindex_parser.set_defaults(func=run_reindex)
+
+    query_parser = commands.add_parser('query', help='look messages up in the message index')
+    query_parser.add_argument('archive', help='path to the archive folder')
+    query_parser.add_argument('--channel', help='channel name or id')
+    query_parser.add_argument('--user', help='id of the user who posted the messages')
+    query_parser.add_argument('--start', help='first day to include, YYYY-MM-DD')
+    query_parser.add_argument('--end', help='day to stop before, YYYY-MM-DD')
+    query_parser.add_argument('--thread', help='ts of the parent message of a thread')
+    query_parser.add_argument('--limit', type=int, help='most messages to return')
+    query_parser.add_argument('--messages', action='store_true', help='print the messages rather than where they are')
+    query_parser.set_defaults(func=run_query)
+
+    search_parser = commands.add_parser('search', help='find the messages containing every one of the terms')
+    search_parser.add_argument('archive', help='path to the archive folder')
+    search_parser.add_argument('terms', nargs='+', help='terms to search for')
+    search_parser.add_argument('--channel', help='channel name or id')
+    search_parser.add_argument('--start', help='first day to include, YYYY-MM-DD')
+    search_parser.add_argument('--end', help='day to stop before, YYYY-MM-DD')
+    search_parser.add_argument('--limit', type=int, help='most hits to return')
+    search_parser.set_defaults(func=run_search)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    options.func(options)
+
+
+if __name__ == '__main__':
+    main()
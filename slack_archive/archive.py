@@ -1,45 +1,177 @@
 import json
 import os
 import shutil
-from slacker import Slacker
-from slack_archive.config import settings, the_crypter
-from datetime import datetime
-from time import sleep
+import tempfile
+import time
+import heapq
+import glob
+from slacker import Error, Slacker
+from slack_archive.config import load_crypter, settings
+from slack_archive.rate_limit import limiter
+from slack_archive.metrics import metrics, write_json_report, write_prometheus_textfile
+from slack_archive.state import ALIASES_FILE, ChannelAliases, Checkpoints, CursorIndex, ThreadState
+from slack_archive.packaging import package_archive
+from slack_archive import checksums, storage
+from slack_archive.index import MessageIndex, archived_conversations, channel_ids, index_path
+from slack_archive.attachments import download_attachments
+from slack_archive.client import SlackSession
+from datetime import datetime, timedelta
 import re
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 
-def retrieve_messages(pageable_object, channel_id, last_time, page_size=100):
-    """ retrieves the messages from the passed in channel in json format and stores them in memory
-    :param pageable_object:
-    :type pageable_object: slacker.Channels or slacker.groups
+# largest page conversations.history and conversations.list hand out
+MAX_PAGE_SIZE = 999
+
+CONVERSATION_TYPES = ('public_channel', 'private_channel', 'mpim', 'im')
+
+TOP_LEVEL_FILES = ('users.json', 'channels.json', 'groups.json', 'dms.json')
+
+
+def iter_pages(method, api_call, rate_limiter=limiter, **params):
+    """ yields each page of a cursor paginated slack api call as soon as it is retrieved
+    :param method: slack api method name, used to pace the calls
+    :type method: str
+    :param api_call: function making the api call, taking the cursor and params as keyword arguments
+    :type api_call: callable
+    :param rate_limiter: rate limiter pacing the calls
+    :type rate_limiter: RateLimiter
+    :param params: parameters passed to every call
+    :return: generator of response bodies
+    :rtype: generator(dict)
+    """
+    cursor = None
+    while True:
+        body = rate_limiter.call(method, api_call, cursor=cursor, **params).body
+        metrics.count('pages_fetched', label=method)
+        yield body
+        cursor = (body.get('response_metadata') or {}).get('next_cursor')
+        if not cursor:
+            break
+
+
+def iter_message_pages(conversations, channel_id, last_time, page_size=MAX_PAGE_SIZE, rate_limiter=limiter,
+                       latest=None, inclusive=None):
+    """ yields the pages of messages from the passed in conversation as soon as each one is retrieved, so only one
+        page is ever held in memory. Works the same for public and private channels, ims and mpims
+    :param conversations: the slack conversations api
+    :type conversations: slacker.Conversations
     :param channel_id: slack channel id
     :type channel_id: str
-    :param last_time: last download run time of the archiving in epoch seconds
-    :type last_time: float
+    :param last_time: ts to fetch the messages after
+    :type last_time: float or str
+    :param page_size: page size
+    :type page_size: int
+    :param rate_limiter: rate limiter pacing the history calls
+    :type rate_limiter: RateLimiter
+    :param latest: ts to fetch the messages before, None for everything up to now
+    :type latest: str
+    :param inclusive: 1 to include the messages at last_time and latest too
+    :type inclusive: int
+    :return: generator of message pages, newest first
+    :rtype: generator(list(dict))
+    """
+    for body in iter_pages('conversations.history', conversations.history, rate_limiter, channel=channel_id,
+                           oldest=last_time, latest=latest, inclusive=inclusive, limit=page_size):
+        yield body['messages']
+
+
+def iter_messages(conversations, channel_id, last_time, page_size=MAX_PAGE_SIZE, rate_limiter=limiter):
+    """ yields the messages from the passed in conversation one at a time, fetching pages as they are needed
+    :param conversations: the slack conversations api
+    :type conversations: slacker.Conversations
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param last_time: ts to fetch the messages after
+    :type last_time: float or str
+    :param page_size: page size
+    :type page_size: int
+    :param rate_limiter: rate limiter pacing the history calls
+    :type rate_limiter: RateLimiter
+    :return: generator of messages in dict format
+    :rtype: generator(dict)
+    """
+    for page in iter_message_pages(conversations, channel_id, last_time, page_size=page_size,
+                                   rate_limiter=rate_limiter):
+        yield from page
+
+
+def iter_replies(conversations, channel_id, thread_ts, oldest=None, page_size=MAX_PAGE_SIZE, rate_limiter=limiter):
+    """ yields the parent of the passed in thread followed by its replies, oldest first
+    :param conversations: the slack conversations api
+    :type conversations: slacker.Conversations
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param thread_ts: ts of the thread's parent message
+    :type thread_ts: str
+    :param oldest: ts to fetch the replies after, None for every reply
+    :type oldest: str
+    :param page_size: page size
+    :type page_size: int
+    :param rate_limiter: rate limiter pacing the replies calls
+    :type rate_limiter: RateLimiter
+    :return: generator of messages in dict format
+    :rtype: generator(dict)
+    """
+    for body in iter_pages('conversations.replies', conversations.replies, rate_limiter, channel=channel_id,
+                           ts=thread_ts, oldest=oldest, limit=page_size):
+        yield from body['messages']
+
+
+def retrieve_messages(conversations, channel_id, last_time, page_size=MAX_PAGE_SIZE, rate_limiter=limiter):
+    """ retrieves the messages from the passed in conversation in json format and stores them in memory
+    :param conversations: the slack conversations api
+    :type conversations: slacker.Conversations
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param last_time: ts to fetch the messages after
+    :type last_time: float or str
     :param page_size: page size
     :type page_size: int
+    :param rate_limiter: rate limiter pacing the history calls
+    :type rate_limiter: RateLimiter
     :return: list of messages in dict format
     :rtype: list(dict)
     """
-    messages = []
-    last_timestamp = None
+    return list(iter_messages(conversations, channel_id, last_time, page_size, rate_limiter))
 
-    while True:
-        response = pageable_object.history(
-            channel=channel_id,
-            latest=last_timestamp,
-            oldest=last_time,
-            count=page_size).body
-        # Response has keys of ok, messages, and has_more
-        messages.extend(response['messages'])
-
-        if response['has_more']:
-            last_timestamp = messages[-1]['ts']  # -1 means last element in a list
-            sleep(2)  # Respect the Slack API rate limit
-        else:
-            break
 
-    return messages
+def channel_type(conversation):
+    """ works out the channel type used by the conversation's rename events
+    :param conversation: conversation properties
+    :type conversation: dict
+    :return: im, mpim, group or channel
+    :rtype: str
+    """
+    if conversation.get('is_im'):
+        return 'im'
+    if conversation.get('is_mpim'):
+        return 'mpim'
+    if conversation.get('is_private') or conversation.get('is_group'):
+        return 'group'
+    return 'channel'
+
+
+def folder_name(conversation):
+    """ gets the name of the folder the conversation is archived to, its slack id, which stays the same when the
+        channel is renamed
+    :param conversation: conversation properties
+    :type conversation: dict
+    :return: folder name
+    :rtype: str
+    """
+    return conversation['id']
+
+
+def display_name(conversation):
+    """ gets the name to show people for the conversation. ims have no name so use their id
+    :param conversation: conversation properties
+    :type conversation: dict
+    :return: the name
+    :rtype: str
+    """
+    return conversation.get('name') or conversation['id']
 
 
 def timestamp_to_datetime(time_stamp):
@@ -57,37 +189,146 @@ def timestamp_to_datetime(time_stamp):
             return datetime.utcfromtimestamp(float(t_list[0]))
 
 
-def channel_rename(old_channel, new_channel):
-    """ In the event of a channel rename, move all files from the old channel folder to the new one
-    :param old_channel: path to the old channel folder of jsons
-    :type old_channel: str
-    :param new_channel: path to the new channel folder where jsons should move to
-    :type new_channel: str
+def channel_rename(aliases, channel_id, old_name, new_name):
+    """ In the event of a channel rename, point both names at the channel in the alias map. The channel's folder is
+        named by its id so none of its files move
+    :param aliases: names of every channel mapped to its id
+    :type aliases: ChannelAliases
+    :param channel_id: slack id of the renamed channel
+    :type channel_id: str
+    :param old_name: name the channel had
+    :type old_name: str
+    :param new_name: name the channel was given
+    :type new_name: str
     :return: None
     """
-    if not os.path.isdir(old_channel):
-        return
-    _mkdir(new_channel)
-    for fileName in os.listdir(old_channel):
-        shutil.move(os.path.join(old_channel, fileName), new_channel)
-    os.rmdir(old_channel)
+    aliases.update([{'id': channel_id, 'name': old_name}, {'id': channel_id, 'name': new_name}])
+
+
+def migrate_layout(archive_folder, aliases=None):
+    """ moves the channel folders of an archive saved before folders were named by channel id over to their ids,
+        merging them into the id's folder if that's already there
+    :param archive_folder: path to the archive or staging folder, its top level channel files name the channels
+    :type archive_folder: str
+    :param aliases: alias map to record the folders' names in
+    :type aliases: ChannelAliases
+    :return: number of channel folders moved
+    :rtype: int
+    """
+    if not os.path.isdir(archive_folder):
+        return 0
+    conversations = archived_conversations(archive_folder)
+    migrated = 0
+    for conversation in conversations:
+        name = conversation.get('name')
+        if not name or name == conversation['id'] or not os.path.isdir(os.path.join(archive_folder, name)):
+            continue
+        channel_path = os.path.join(archive_folder, conversation['id'])
+        if os.path.isdir(channel_path):
+            merge_channel_folder(channel_path, os.path.join(archive_folder, name))
+        else:
+            # a rename within the same folder, so no day file is copied
+            os.rename(os.path.join(archive_folder, name), channel_path)
+        migrated += 1
+    if aliases is not None:
+        aliases.update(conversations)
+    if migrated:
+        print("Moved {0} channel folders in {1} to their channel ids".format(migrated, archive_folder))
+    return migrated
+
+
+def _storage_format(storage_format=None):
+    """ gets the format to save day files in, falling back to the one in the settings
+    :param storage_format: explicitly requested format
+    :type storage_format: str
+    :return: one of storage.EXTENSIONS
+    :rtype: str
+    """
+    return storage_format or settings.get('storage_format', storage.DEFAULT_FORMAT)
 
 
-def parse_and_save_messages(folder_path, messages, channel_type):
-    """ parses the message list into groupings by day and then saves the day groupings to a json
+def _storage_layout():
+    """ gets the layout to save day files in from the settings
+    :return: one of storage.LAYOUTS
+    :rtype: str
+    """
+    return settings.get('storage_layout', storage.DEFAULT_LAYOUT)
+
+
+def save_day(messages, folder_path, date, append=False, storage_format=None, index=None, channel_id=None):
+    """ saves a day's messages to its file sorted oldest first. When appending, the messages are merged into the
+        ones already in the day's file, whatever format it was saved in, replacing any with the same ts. A merge
+        that changes nothing leaves the file as it was, so packaging doesn't see it as changed
+    :param messages: list of messages in dict format from the same day
+    :type messages: list(dict)
+    :param folder_path: folder holding the channel's day files
+    :type folder_path: str
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param append: whether to merge into the existing file rather than overwrite it
+    :type append: bool
+    :param storage_format: format to save the day in, defaults to the storage_format setting
+    :type storage_format: str
+    :param index: message index to update with the saved day
+    :type index: MessageIndex
+    :param channel_id: slack id of the channel the day belongs to, needed when indexing
+    :type channel_id: str
+    :return: path of the saved file
+    :rtype: str
+    """
+    streams = []
+    existing = None
+    if append:
+        existing_file = storage.find_day_file(folder_path, date)
+        if existing_file:
+            # refuse to merge into, and overwrite, a day file that changed since it was written
+            checksums.check(folder_path, existing_file)
+            existing = list(_day_stream(existing_file))
+            streams.append(existing)
+            metrics.count('day_files_merged')
+    streams.append(sorted(messages, key=_stream_key))
+    day = list(merge_message_streams(*streams))
+    if day == existing:
+        metrics.count('day_files_unchanged')
+        return existing_file
+    path, _ = storage.save_day_file(day, folder_path, date, _storage_format(storage_format), _storage_layout())
+    if index is not None:
+        index.replace_day(channel_id, date, path, day)
+    return path
+
+
+def parse_and_save_messages(folder_path, messages, channel_type, append=False, storage_format=None, index=None,
+                            channel_id=None, aliases=None):
+    """ parses the messages into groupings by day and saves each day grouping to a json as soon as the day is
+        finished, so a generator of messages is written out while it is still being retrieved
     :param folder_path: folder to save the jsons to
     :type folder_path: str
-    :param messages: list of messages in dict format
-    :type messages: list(dict)
+    :param messages: messages in dict format, grouped by day
+    :type messages: iterable(dict)
     :param channel_type: what type of channel it is
     :type channel_type: str
-    :return: None
+    :param append: whether to merge into day files already in the folder rather than overwrite them
+    :type append: bool
+    :param storage_format: format to save the days in, defaults to the storage_format setting
+    :type storage_format: str
+    :param index: message index to update as each day is saved
+    :type index: MessageIndex
+    :param channel_id: slack id of the channel, needed when indexing or recording renames
+    :type channel_id: str
+    :param aliases: alias map the channel's renames are recorded in
+    :type aliases: ChannelAliases
+    :return: ts of the newest message saved, None if there were no messages
+    :rtype: str
     """
     name_change_flag = channel_type + "_name"
 
     current_file_date = ''
     current_messages = []
+    newest_ts = None
     for message in messages:
+        if newest_ts is None or float(message['ts']) > float(newest_ts):
+            newest_ts = message['ts']
+
         # first store the date of the next message
         ts = timestamp_to_datetime(message['ts'])
         file_date = '{:%Y-%m-%d}'.format(ts)
@@ -95,79 +336,484 @@ def parse_and_save_messages(folder_path, messages, channel_type):
         # if it's on a different day, write out the previous day's messages
         if file_date != current_file_date:
             if current_file_date:
-                out_file_name = '{room}/{file}.json'.format(room=folder_path, file=current_file_date)
-                _to_json(current_messages, out_file_name)
+                save_day(current_messages, folder_path, current_file_date, append, storage_format, index, channel_id)
             current_file_date = file_date
             current_messages = []
 
         # check if current message is a name change
         # dms won't have name change events
         if channel_type != "im" and ('subtype' in message) and message['subtype'] == name_change_flag:
-            old_name = message['old_name']
-            new_name = message['name']
-            channel_rename(old_name, new_name)
+            if aliases is not None and channel_id:
+                channel_rename(aliases, channel_id, message['old_name'], message['name'])
 
         current_messages.append(message)
-    out_file_name = '{room}/{file}.json'.format(room=folder_path, file=current_file_date)
-    _to_json(current_messages, out_file_name)
+    if current_file_date:
+        save_day(current_messages, folder_path, current_file_date, append, storage_format, index, channel_id)
+    return newest_ts
+
+
+def _last_activity(channel):
+    """ works out from the channel's metadata the newest time anything could have been posted to it. Only the ts
+        of the latest message, or when an archived channel was archived, count. conversations.list usually leaves
+        latest out, and updated on a live channel only tracks its own properties
+    :param channel: channel properties
+    :type channel: dict
+    :return: epoch seconds, None if the metadata doesn't say
+    :rtype: float
+    """
+    latest = channel.get('latest')
+    try:
+        if isinstance(latest, dict) and latest.get('ts'):
+            return float(latest['ts'])
+        if channel.get('is_archived') and channel.get('updated'):
+            updated = float(channel['updated'])
+            # conversations.list reports updated in milliseconds
+            return updated / 1000 if updated > 1e11 else updated
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def plan_downloads(channel_list, cursors, last_time=0):
+    """ works out which channels can possibly have new messages from their metadata and how far each has already
+        been fetched, so dormant and archived channels don't cost a history call. A channel is only skipped when
+        its metadata shows nothing was posted after its cursor, anything less is downloaded. Skipped channels still
+        need their threads polled, see repoll_threads
+    :param channel_list: list of channel properties dict
+    :type channel_list: list(dict)
+    :param cursors: newest fetched ts of each channel
+    :type cursors: CursorIndex
+    :param last_time: last download run time of the archiving in epoch seconds. Only a day is known for runs
+        before cursors, so it's never taken as evidence a channel can be skipped
+    :type last_time: float
+    :return: the channels to download and the number of history calls avoided
+    :rtype: tuple(list(dict), int)
+    """
+    scheduled = []
+    for channel in channel_list:
+        last_seen = cursors.get(channel['id'], None)
+        last_activity = _last_activity(channel)
+        if last_seen and last_activity is not None and last_activity <= float(last_seen):
+            continue
+        scheduled.append(channel)
+    avoided = len(channel_list) - len(scheduled)
+    print("Skipping {0} inactive channels".format(avoided))
+    return scheduled, avoided
+
+
+def _thread_candidates(messages, channel_id, threads, candidates):
+    """ passes the messages through, noting the threads with replies that haven't been fetched yet
+    :param messages: messages in dict format
+    :type messages: iterable(dict)
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param threads: state of every thread as of its last fetch
+    :type threads: ThreadState
+    :param candidates: set the ts of each thread needing a fetch is added to
+    :type candidates: set(str)
+    :return: generator of the same messages
+    :rtype: generator(dict)
+    """
+    for message in messages:
+        if threads.changed(channel_id, message):
+            candidates.add(message['thread_ts'])
+        yield message
+
+
+def _repoll_since():
+    """ gets how far back threads are looked for new replies, from the thread_repoll_days setting
+    :return: epoch seconds, None to look at every thread
+    :rtype: float
+    """
+    days = settings.get('thread_repoll_days', 30)
+    return None if days is None else time.time() - days * 86400
+
+
+def _lookback_threads(slack_object, channel_id, cursor, threads):
+    """ finds the threads with new replies whose parents are older than the channel's cursor. Replying to a thread
+        leaves its parent where it was in the history, so the history back to the oldest thread replied to within
+        the thread_repoll_days setting is read again, without being saved, for parents whose reply_count or
+        latest_reply changed
+    :param slack_object: the slack conversations api
+    :type slack_object: slacker.Conversations
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param cursor: ts the channel's history has been fetched up to
+    :type cursor: str or float
+    :param threads: state of every thread as of its last fetch
+    :type threads: ThreadState
+    :return: ts of the parent of each thread needing a fetch
+    :rtype: set(str)
+    """
+    since = _repoll_since()
+    recent = threads.recent(channel_id, since)
+    candidates = set()
+    if not recent or not cursor:
+        return candidates
+    for page in iter_message_pages(slack_object, channel_id, min(recent, key=float), latest=cursor, inclusive=1):
+        for message in page:
+            # threads quiet since before the window aren't tracked any more, there's nothing new in them to fetch
+            if message.get('thread_ts') != message['ts'] or \
+                    (since is not None and float(message.get('latest_reply') or 0) < since):
+                continue
+            if threads.changed(channel_id, message):
+                candidates.add(message['ts'])
+    return candidates
+
+
+def _fetch_thread(conversations, channel_id, thread_ts, threads):
+    """ fetches the parent of the passed in thread and the replies posted since its last fetch
+    :param conversations: the slack conversations api
+    :type conversations: slacker.Conversations
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param thread_ts: ts of the thread's parent message
+    :type thread_ts: str
+    :param threads: state of every thread as of its last fetch
+    :type threads: ThreadState
+    :return: the thread's messages in dict format
+    :rtype: list(dict)
+    """
+    state = threads.get(channel_id, thread_ts)
+    oldest = state['latest_reply'] if state else None
+    return list(iter_replies(conversations, channel_id, thread_ts, oldest))
+
+
+def repoll_threads(slack_object, channel, folder_path, threads, cursors, index=None):
+    """ fetches the new replies to the threads of a channel whose history download was skipped. Its metadata only
+        says no message was posted, replies to its threads don't show up there
+    :param slack_object: the slack conversations api
+    :type slack_object: slacker.Conversations
+    :param channel: channel properties
+    :type channel: dict
+    :param folder_path: path to save the channel folder to
+    :type folder_path: str
+    :param threads: state of every thread as of its last fetch
+    :type threads: ThreadState
+    :param cursors: newest fetched ts of each channel
+    :type cursors: CursorIndex
+    :param index: message index to update as days are saved
+    :type index: MessageIndex
+    :return: number of threads with new replies
+    :rtype: int
+    """
+    thread_ts_list = _lookback_threads(slack_object, channel['id'], cursors.get(channel['id'], None), threads)
+    if not thread_ts_list:
+        return 0
+    channel_path = os.path.join(folder_path, folder_name(channel))
+    _mkdir(channel_path)
+    return download_threads(slack_object, channel, channel_path, thread_ts_list, threads, index=index)
 
 
-def download_channels(slack_object, channel_list, folder_path, last_time):
+def download_threads(conversations, channel, channel_path, thread_ts_list, threads, concurrency=None, index=None):
+    """ fetches the new replies of the passed in threads, several threads at once under the shared rate limit,
+        merges them into the channel's day files and then records each thread's state so it isn't fetched again
+        until someone replies to it. Threads that turn out to have no new replies are left as they were
+    :param conversations: the slack conversations api
+    :type conversations: slacker.Conversations
+    :param channel: channel properties
+    :type channel: dict
+    :param channel_path: folder holding the channel's day files
+    :type channel_path: str
+    :param thread_ts_list: ts of the parent of each thread to fetch
+    :type thread_ts_list: iterable(str)
+    :param threads: state of every thread as of its last fetch
+    :type threads: ThreadState
+    :param concurrency: number of threads to fetch at once, defaults to the thread_concurrency setting
+    :type concurrency: int
+    :param index: message index to update as days are saved
+    :type index: MessageIndex
+    :return: number of threads with new replies
+    :rtype: int
+    """
+    concurrency = concurrency or settings.get('thread_concurrency', 1)
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = {executor.submit(_fetch_thread, conversations, channel['id'], thread_ts, threads): thread_ts
+                   for thread_ts in sorted(set(thread_ts_list))}
+        for future in as_completed(futures):
+            try:
+                fetched[futures[future]] = future.result()
+            except Error as error:
+                # the parent was deleted since, there's nothing left to fetch
+                print('issue fetching thread {} of {}: {}'.format(futures[future], display_name(channel), error))
+
+    changed = {}
+    for thread_ts, thread in fetched.items():
+        parent = next((message for message in thread if message['ts'] == thread_ts), {})
+        latest_reply = parent.get('latest_reply') or max(message['ts'] for message in thread)
+        state = (parent.get('reply_count', 0), latest_reply)
+        known = threads.get(channel['id'], thread_ts)
+        if known is None or (known['reply_count'], known['latest_reply']) != state:
+            changed[thread_ts] = (thread, state)
+
+    messages = sorted((message for thread, _ in changed.values() for message in thread), key=_stream_key)
+    parse_and_save_messages(channel_path, messages, channel_type(channel), append=True, index=index,
+                            channel_id=channel['id'])
+    if changed:
+        threads.update_threads(channel['id'], {thread_ts: state for thread_ts, (_, state) in changed.items()},
+                               _repoll_since())
+    return len(changed)
+
+
+def _download_pages(slack_object, channel, channel_path, oldest, checkpoints, threads=None, index=None,
+                    aliases=None):
+    """ downloads the channel's history a page at a time, merging each page into the day files and then
+        checkpointing how far back it has got. A run that was cut off carries on from the last checkpoint, fetching
+        only the older pages it never reached
+    :param slack_object: the slack conversations api
+    :type slack_object: slacker.Conversations
+    :param channel: channel properties
+    :type channel: dict
+    :param channel_path: folder holding the channel's day files
+    :type channel_path: str
+    :param oldest: ts to fetch the messages after, ignored when resuming
+    :type oldest: str or float
+    :param checkpoints: how far each unfinished channel download got
+    :type checkpoints: Checkpoints
+    :param threads: state of every thread, when given the threads with new replies are fetched too
+    :type threads: ThreadState
+    :param index: message index to update as days are saved
+    :type index: MessageIndex
+    :param aliases: alias map the channel's renames are recorded in
+    :type aliases: ChannelAliases
+    :return: ts of the newest message saved, None if there were no new messages
+    :rtype: str
+    """
+    checkpoint = checkpoints.get(channel['id'])
+    if checkpoint:
+        print('resuming {} from {}'.format(display_name(channel), checkpoint['latest']))
+        oldest, latest, newest_ts = checkpoint['oldest'], checkpoint['latest'], checkpoint['newest']
+        candidates = set(checkpoint['threads'])
+    else:
+        latest, newest_ts, candidates = None, None, set()
+
+    for page in iter_message_pages(slack_object, channel['id'], oldest, latest=latest):
+        if not page:
+            continue
+        if threads is not None:
+            page = list(_thread_candidates(page, channel['id'], threads, candidates))
+        # pages cut days in two, so each one is merged into what the previous pages saved
+        page_newest = parse_and_save_messages(channel_path, page, channel_type(channel), append=True, index=index,
+                                              channel_id=channel['id'], aliases=aliases)
+        if newest_ts is None or float(page_newest) > float(newest_ts):
+            newest_ts = page_newest
+        checkpoints.save(channel['id'], {'oldest': oldest, 'latest': min(page, key=_stream_key)['ts'],
+                                         'newest': newest_ts, 'threads': sorted(candidates)})
+
+    if threads is not None:
+        candidates.update(_lookback_threads(slack_object, channel['id'], oldest, threads))
+    if candidates:
+        download_threads(slack_object, channel, channel_path, candidates, threads, index=index)
+    return newest_ts
+
+
+def download_channel(slack_object, channel, folder_path, last_time, cursors=None, append=False, index=None,
+                     threads=None, checkpoints=None, aliases=None):
+    """ Downloads the passed in channel to its own folder under the passed in folder path
+    :param slack_object: the slack conversations api
+    :type slack_object: slacker.Conversations
+    :param channel: channel properties
+    :type channel: dict
+    :param folder_path: path to save the channel folder to
+    :type folder_path: str
+    :param last_time: last download run time of the archiving in epoch seconds, used if the channel has no cursor
+    :type last_time: float
+    :param cursors: newest fetched ts of each channel, moved forward once the channel is saved
+    :type cursors: CursorIndex
+    :param append: whether to merge the messages straight into day files already in the channel folder
+    :type append: bool
+    :param index: message index to update as the channel's days are saved
+    :type index: MessageIndex
+    :param threads: state of every thread, when given the threads with new replies are fetched too
+    :type threads: ThreadState
+    :param checkpoints: how far each unfinished channel download got, when given the history is saved and
+        checkpointed a page at a time so an interrupted download can resume
+    :type checkpoints: Checkpoints
+    :param aliases: alias map the channel's renames are recorded in
+    :type aliases: ChannelAliases
+    :return: ts of the newest message saved, None if there were no new messages
+    :rtype: str
+    """
+    print(display_name(channel))
+    channel_path = os.path.join(folder_path, folder_name(channel))
+    _mkdir(channel_path)
+    oldest = cursors.get(channel['id'], last_time) if cursors is not None else last_time
+    if checkpoints is not None:
+        newest_ts = _download_pages(slack_object, channel, channel_path, oldest, checkpoints, threads, index,
+                                    aliases)
+    else:
+        messages = iter_messages(slack_object, channel['id'], oldest)
+        candidates = set()
+        if threads is not None:
+            messages = _thread_candidates(messages, channel['id'], threads, candidates)
+        newest_ts = parse_and_save_messages(channel_path, messages, channel_type(channel), append, index=index,
+                                            channel_id=channel['id'], aliases=aliases)
+        if threads is not None:
+            candidates.update(_lookback_threads(slack_object, channel['id'], oldest, threads))
+        if candidates:
+            download_threads(slack_object, channel, channel_path, candidates, threads, index=index)
+    # the cursor only moves once the threads are saved too, so a crash refetches the parents that flagged them
+    if cursors is not None and newest_ts is not None:
+        cursors.update(channel['id'], newest_ts)
+    if checkpoints is not None:
+        checkpoints.clear(channel['id'])
+    return newest_ts
+
+
+def download_channels(slack_object, channel_list, folder_path, last_time, concurrency=1, cursors=None):
     """ Downloads the passed in channel list to the passed in folder path
-    :param slack_object: the slack connection
-    :type slack_object: slacker.Slacker()
+    :param slack_object: the slack conversations api
+    :type slack_object: slacker.Conversations
     :param channel_list: list of channel properties dict
     :type channel_list: list(dict)
     :param folder_path: path to save channel folders to
     :type folder_path: str
     :param last_time: last download run time of the archiving in epoch seconds
     :type last_time: float
+    :param concurrency: number of channels to download at once
+    :type concurrency: int
+    :param cursors: newest fetched ts of each channel
+    :type cursors: CursorIndex
     :return: None
     """
-    for channel in channel_list:
-        channel_name = channel['name']
-        print(channel_name)
-        channel_path = os.path.join(folder_path, channel_name)
-        _mkdir(channel_path)
-        messages = retrieve_messages(slack_object, channel['id'], last_time)
-        parse_and_save_messages(channel_path, messages, 'channel')
-        sleep(2)
+    download_all([(slack_object, channel) for channel in channel_list], folder_path, last_time, concurrency,
+                 cursors)
 
-    return
+
+def download_all(jobs, folder_path, last_time, concurrency=1, cursors=None, append=False, index=None,
+                 threads=None, checkpoints=None, aliases=None):
+    """ Downloads every channel in the passed in jobs, running up to concurrency downloads at once. All downloads
+        share the same rate limiter so running more of them at once never exceeds the Slack budget. A failing
+        channel doesn't stop the others, the first error is raised once they have all finished
+    :param jobs: the slack object to page each channel's history with and the channel's properties
+    :type jobs: list(tuple(slacker.Conversations, dict))
+    :param folder_path: path to save channel folders to
+    :type folder_path: str
+    :param last_time: last download run time of the archiving in epoch seconds
+    :type last_time: float
+    :param concurrency: number of channels to download at once
+    :type concurrency: int
+    :param cursors: newest fetched ts of each channel
+    :type cursors: CursorIndex
+    :param append: whether to merge the messages straight into day files already in the channel folders
+    :type append: bool
+    :param index: message index to update as days are saved
+    :type index: MessageIndex
+    :param threads: state of every thread, when given the threads with new replies are fetched too
+    :type threads: ThreadState
+    :param checkpoints: how far each unfinished channel download got, when given downloads resume from them
+    :type checkpoints: Checkpoints
+    :param aliases: alias map the channels' renames are recorded in
+    :type aliases: ChannelAliases
+    :return: number of channels that had new messages
+    :rtype: int
+    """
+    updated = 0
+    errors = []
+    if concurrency <= 1:
+        for slack_object, channel in jobs:
+            try:
+                if download_channel(slack_object, channel, folder_path, last_time, cursors, append, index, threads,
+                                    checkpoints, aliases) is not None:
+                    updated += 1
+            except Exception as error:
+                print('issue downloading {}: {}'.format(display_name(channel), error))
+                errors.append(error)
+        if errors:
+            raise errors[0]
+        return updated
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(download_channel, slack_object, channel, folder_path, last_time, cursors,
+                                   append, index, threads, checkpoints, aliases): display_name(channel)
+                   for slack_object, channel in jobs}
+        for future in as_completed(futures):
+            try:
+                if future.result() is not None:
+                    updated += 1
+            except Exception as error:
+                print('issue downloading {}: {}'.format(futures[future], error))
+                errors.append(error)
+    if errors:
+        raise errors[0]
+    return updated
 
 
 def _to_json(data_to_save, file_path):
-    """ writes the passed in user list to the passed in file path location
+    """ writes the passed in user list to the passed in file path location. The data is written to a temporary
+        file that is then renamed over the destination, so a crash never leaves a half written file behind
     :param data_to_save: data to save to a json
     :type data_to_save: list(dicts)
     :param file_path: path of the file to save to
     :type file_path: str
     :return: None
     """
-    with open(file_path, 'w') as write_file:
-        json.dump(data_to_save, write_file, indent=4)
+    folder = os.path.dirname(file_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as write_file:
+            json.dump(data_to_save, write_file, indent=4)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _users_list(users, **params):
+    """ calls users.list with cursor pagination, which slacker's Users.list doesn't support
+    :param users: the slack users api
+    :type users: slacker.Users
+    :return: the api response
+    :rtype: slacker.Response
+    """
+    return users.get('users.list', params=params)
 
 
-def bootstrap_key_values(slack_connection):
+def list_conversations(slack_connection, types, rate_limiter=limiter):
+    """ lists every conversation of the passed in types, following the cursor through every page
+    :param slack_connection: logged in connection to slack
+    :type slack_connection: Slacker
+    :param types: conversations.list types, e.g. public_channel
+    :type types: list(str)
+    :param rate_limiter: rate limiter pacing the list calls
+    :type rate_limiter: RateLimiter
+    :return: list of conversation properties
+    :rtype: list(dict)
+    """
+    conversations = []
+    for body in iter_pages('conversations.list', slack_connection.conversations.list, rate_limiter,
+                           types=','.join(types), limit=MAX_PAGE_SIZE):
+        conversations.extend(body['channels'])
+    return conversations
+
+
+def bootstrap_key_values(slack_connection, rate_limiter=limiter):
     """ caches values used throughout the downloading process
     :param slack_connection: logged in connection to slack
     :type slack_connection: Slacker
-    :return: lists of the users, public channels, and dms
-    :rtype: tuple(list[dicts], list, list
+    :param rate_limiter: rate limiter pacing the list calls
+    :type rate_limiter: RateLimiter
+    :return: lists of the users, public channels, private channels and group dms, and dms
+    :rtype: tuple(list[dicts], list, list, list)
     """
-    user_list = slack_connection.users.list().body['members']
+    user_list = []
+    for body in iter_pages('users.list', partial(_users_list, slack_connection.users), rate_limiter,
+                           limit=MAX_PAGE_SIZE):
+        user_list.extend(body['members'])
     print("Found {0} Users".format(len(user_list)))
-    sleep(2)
 
-    channel_list = slack_connection.channels.list().body['channels']
+    conversation_list = list_conversations(slack_connection, CONVERSATION_TYPES, rate_limiter)
+    channel_list = [i for i in conversation_list if channel_type(i) == 'channel']
     print("Found {0} Public Channels".format(len(channel_list)))
-    sleep(2)
 
-    private_channel_list = slack_connection.groups.list().body['groups']
+    private_channel_list = [i for i in conversation_list if channel_type(i) in ('group', 'mpim')]
     print("Found {0} Private Channels or Group DMs".format(len(private_channel_list)))
-    sleep(2)
 
-    return user_list, channel_list, private_channel_list
+    dm_list = [i for i in conversation_list if channel_type(i) == 'im']
+    print("Found {0} DMs".format(len(dm_list)))
+
+    return user_list, channel_list, private_channel_list, dm_list
 
 
 def _remove(path):
@@ -194,24 +840,34 @@ def _mkdir(directory):
 
 
 def extract_date(folder_path):
-    """ recursively gets the most recent date from a folder that contains files named in the YYYY-MM-DD format
+    """ recursively gets the most recent date from a folder that contains files named in the YYYY-MM-DD format, or
+        sharded into YYYY/MM folders of DD files. Only the newest shard of each channel is looked in
     :param folder_path: path to the folder to search
     :type folder_path: str
     :return: date time in epoch seconds
     :rtype: float
     """
     most_recent_time = 0
+    dates = []
+    sharded = False
     try:
         for i in os.listdir(folder_path):
             path = os.path.join(folder_path, i)
             regex_search = re.search('[0-9]{4}-[0-9]{2}-[0-9]{2}', i)
-            if os.path.isdir(path):  # recurse
+            if storage.YEAR_PATTERN.match(i) and os.path.isdir(path):  # a shard, searched below
+                sharded = True
+            elif os.path.isdir(path):  # recurse
                 most_recent_time = max([most_recent_time, extract_date(path)])
             elif regex_search:
-                utc_time = datetime.strptime(regex_search.group(0), "%Y-%m-%d")
-                most_recent_time = max([most_recent_time, (utc_time - datetime(1970, 1, 1)).total_seconds()])
+                dates.append(regex_search.group(0))
+        if sharded:
+            dates.append(storage.latest_day(folder_path))
     except (FileNotFoundError, NotADirectoryError):
         pass
+    for date in dates:
+        if date:
+            utc_time = datetime.strptime(date, "%Y-%m-%d")
+            most_recent_time = max([most_recent_time, (utc_time - datetime(1970, 1, 1)).total_seconds()])
     return most_recent_time
 
 
@@ -256,55 +912,81 @@ def pair_channels(i, j):
     return output_list
 
 
+def _stream_key(message):
+    """ sort key of a message in a stream, messages without a ts sort first
+    :param message: message in dict format
+    :type message: dict
+    :return: the message's ts as a number
+    :rtype: float
+    """
+    return float(message['ts']) if 'ts' in message else float('-inf')
+
+
+def _dedupe_key(message, dedupe):
+    """ key identifying the copies of the same message
+    :param message: message in dict format
+    :type message: dict
+    :param dedupe: ts to treat messages with the same ts as copies, thread to also require the same thread_ts
+    :type dedupe: str
+    :return: key, None if the message can't be matched with anything
+    """
+    if 'ts' not in message:
+        return None
+    if dedupe == 'thread':
+        return message.get('thread_ts'), message['ts']
+    return message['ts']
+
+
+def merge_message_streams(*streams, dedupe='ts', prefer='last'):
+    """ lazily merges any number of sorted message streams into one sorted stream using a heap, keeping a single
+        copy of messages that are in more than one stream. Only the messages sharing the current ts are held in
+        memory, so day files can be merged without loading them into lists
+    :param streams: iterables of messages in dict format, each sorted oldest first
+    :type streams: iterable(dict)
+    :param dedupe: ts to treat messages with the same ts as copies, thread to also require the same thread_ts
+    :type dedupe: str
+    :param prefer: which copy wins, last for the one from the latest stream, first for the earliest stream, or a
+        function taking the kept and the new copy and returning the one to keep
+    :type prefer: str or callable
+    :return: generator of messages sorted oldest first
+    :rtype: generator(dict)
+    """
+    if dedupe not in ('ts', 'thread'):
+        raise ValueError('Unknown dedupe rule {}'.format(dedupe))
+    if prefer not in ('first', 'last') and not callable(prefer):
+        raise ValueError('Unknown prefer rule {}'.format(prefer))
+    decorated = [((_stream_key(message), index, message) for message in stream) for index, stream in enumerate(streams)]
+    group_key, group = None, {}
+    for key, index, message in heapq.merge(*decorated, key=lambda item: (item[0], item[1])):
+        if key != group_key:
+            yield from group.values()
+            group_key, group = key, {}
+        message_key = _dedupe_key(message, dedupe)
+        if message_key is None:
+            group[id(message)] = message
+        elif message_key not in group or prefer == 'last':
+            group[message_key] = message
+        elif callable(prefer):
+            group[message_key] = prefer(group[message_key], message)
+    yield from group.values()
+
+
 def merge_json_list_by_ts(i, j):
-    """ Merges two sorted json lists based on timestamp of json values
+    """ Merges two sorted json lists based on timestamp of json values, keeping one copy of messages in both
     :param i: first sorted list of json
     :type i: list
-    :param j: second sorted list json
+    :param j: second sorted list json, whose copy of a message wins
     :type j: list
     :return: sorted list of json messages
     :rtype: list(dict())
     """
-    if not i:
-        return j
-    if not j:
-        return i
-
-    i = iter(i)
-    j = iter(j)
-    output_list = []
-    value_1 = next(i, None)
-    value_2 = next(j, None)
-    try:
-        while value_1 and value_2:
-            if value_1['ts'] == value_2['ts']:
-                output_list.append(value_1)
-                output_list.append(value_2)
-                value_1, value_2 = next(i, None), next(j, None)
-            elif value_1['ts'] > value_2['ts']:
-                output_list.append(value_2)
-                value_2 = next(j, None)
-            else:
-                output_list.append(value_1)
-                value_1 = next(i, None)
-
-        if value_1:
-            while value_1:
-                output_list.append(value_1)
-                value_1 = next(i, None)
-        else:
-            while value_2:
-                output_list.append(value_2)
-                value_2 = next(j, None)
-    except KeyError:
-        print('issue merging: \n {} \n {}'.format(value_1, value_2))
-
-    return output_list
+    return list(merge_message_streams(i, j))
 
 
 def merge_json_list_by_id(old_data, new_data):
-    """ Merges two json lists based on ids. If the newer data is different, overwrite the old
-        data and archive the old data in a .archive file
+    """ Merges two json lists based on ids. The newer data replaces the old data, and any old record that changed
+        or is no longer in the newer data is returned to be archived. The old data is indexed by id so the merge is
+        linear in the size of both lists
     :param old_data: first list of json
     :type old_data: list
     :param new_data: second list json
@@ -313,116 +995,276 @@ def merge_json_list_by_id(old_data, new_data):
     :rtype: list(tuple(element_in_first_list, element_in_second_list)
     """
     if not old_data:
-        return new_data
+        return new_data, []
     if not new_data:
-        return old_data
+        return old_data, []
 
+    old_by_id = {i['id']: i for i in old_data}
     current_list, archive_list = [], []
     for i in new_data:
-        try:
-            index = next(index_temp for index_temp, data_temp in enumerate(old_data) if i['id'] == data_temp['id'])
-        except StopIteration:
-            index = None
-        if index is not None:
-            if i != old_data[index]:
-                archive_list.append(old_data[index])
-            current_list.append(i)
-        else:
-            current_list.append(i)
+        old_record = old_by_id.pop(i['id'], None)
+        if old_record is not None and i != old_record:
+            archive_list.append(old_record)
+        current_list.append(i)
+    # anything left was removed from slack, keep its last version in the archive
+    archive_list.extend(old_by_id.values())
 
     return current_list, archive_list
 
 
+def append_archive(archive_list, file_path, archived_at=None):
+    """ appends the passed in records to a .archive history file as json lines, each stamped with when it was
+        archived, so every prior version is kept. A .archive file from before the history was kept is converted
+        to the new format first
+    :param archive_list: records to archive
+    :type archive_list: list(dict)
+    :param file_path: path to the .archive file
+    :type file_path: str
+    :param archived_at: epoch seconds to stamp the records with, defaults to now
+    :type archived_at: float
+    :return: None
+    """
+    if not archive_list:
+        return
+    archived_at = archived_at if archived_at is not None else time.time()
+    if os.path.exists(file_path):
+        with open(file_path) as read_file:
+            legacy = read_file.read(1) == '['
+        if legacy:
+            storage.write_records(load_archive_history(file_path), file_path, 'jsonl')
+    with open(file_path, 'a') as write_file:
+        for i in archive_list:
+            write_file.write(json.dumps({'archived_at': archived_at, 'record': i}, separators=(',', ':')))
+            write_file.write('\n')
+
+
+def load_archive_history(file_path):
+    """ loads every archived version of the records in a .archive file, oldest first
+    :param file_path: path to the .archive file
+    :type file_path: str
+    :return: records in dict format, each with the time it was archived
+    :rtype: list(dict(archived_at, record))
+    """
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path) as read_file:
+        if read_file.read(1) == '[':
+            # a single list written before the history was kept, all archived when the file was last written
+            read_file.seek(0)
+            return [{'archived_at': os.path.getmtime(file_path), 'record': i} for i in json.load(read_file)]
+        read_file.seek(0)
+        return [json.loads(line) for line in read_file if line.strip()]
+
+
 def load_json(file_path):
-    """ loads the data in the passed in file path
+    """ loads the data in the passed in file path, in any of the storage formats. A file that can't be read fails
+        loudly rather than loading as empty, which would have it overwritten and its data lost
     :param file_path: path to the file to load
     :type file_path: str
-    :return: data in the loaded list of json format
+    :return: data in the loaded list of json format, empty if there is no such file
     :rtype: list
+    :raises ValueError: if the file is truncated or corrupt
     """
     try:
-        with open(file_path) as f:
-            data = json.load(f)
-    except Exception:
+        return storage.read_records(file_path)
+    except FileNotFoundError:
         return []
-    return data
 
 
-def merge_channel_folder(destination_channel, new_channel_data):
-    """ merge the two channel folders
-    :param destination_channel:
-    :param new_channel_data:
-    :return: True if the merge occurred correctly and the source folder was deleted. false otherwise
-    :rtype: False
+def merge_top_level_file(destination_folder, file_name, new_data):
+    """ merges a list of users or conversations into the matching top level file of the archive by id, archiving
+        the old versions of anything that changed
+    :param destination_folder: The path to the archive folder
+    :type destination_folder: str
+    :param file_name: name of the top level file, e.g. users.json
+    :type file_name: str
+    :param new_data: newly downloaded list of json
+    :type new_data: list(dict)
+    :return: True if the file's contents changed
+    :rtype: bool
     """
-    result = False
-    destination_files = os.listdir(destination_channel)
-    source_files = os.listdir(new_channel_data)
-    for i in source_files:
-        destination_file = os.path.join(destination_channel, i)
-        source_file = os.path.join(new_channel_data, i)
-        if i in destination_files:
-            resultant_data = merge_json_list_by_ts(load_json(destination_file), load_json(source_file))
-            _to_json(resultant_data, destination_file)
-            os.remove(source_file)
-        else:
-            shutil.move(source_file, destination_file)
-    if os.listdir(new_channel_data):
-        shutil.rmtree(new_channel_data)
-        result = True
-    return result
+    base_name, ext = os.path.splitext(file_name)
+    destination_json = load_json(os.path.join(destination_folder, file_name))
+    current_list, archive_list = merge_json_list_by_id(destination_json, new_data)
+    _to_json(current_list, os.path.join(destination_folder, '{}{}'.format(base_name, ext)))
+    append_archive(archive_list, os.path.join(destination_folder, '{}.archive'.format(base_name)))
+    return current_list != destination_json
 
 
-def merge_archives(destination_folder, new_data_folder):
-    """ Recursively merges two data set folders into one larger data set
+def _day_stream(file_path):
+    """ streams the messages of a day file oldest first. Day files saved before they were kept sorted are sorted
+        as they're read
+    :param file_path: path to the day file
+    :type file_path: str
+    :return: messages in dict format sorted oldest first
+    :rtype: iterable(dict)
+    """
+    if not file_path.endswith('.json'):
+        return storage.iter_records(file_path)
+    messages = load_json(file_path)
+    keys = [_stream_key(message) for message in messages]
+    if any(keys[index] > keys[index + 1] for index in range(len(keys) - 1)):
+        messages.sort(key=_stream_key)
+    return messages
+
+
+def _merge_rules():
+    """ gets the dedupe rule and which copy wins when merging day files from the settings
+    :return: keyword arguments for merge_message_streams
+    :rtype: dict
+    """
+    return {'dedupe': settings.get('merge_dedupe', 'ts'), 'prefer': settings.get('merge_prefer', 'last')}
+
+
+def merge_channel_folder(destination_channel, new_channel_data, storage_format=None):
+    """ merge the channel folders. Days are paired up whatever format and layout each side was saved in, and every
+        copy of a day is merged in a single streaming pass and saved in the configured format and layout
+    :param destination_channel: path to the channel folder in the archive
+    :type destination_channel: str
+    :param new_channel_data: path, or list of paths oldest first, of newly downloaded folders for the channel
+    :type new_channel_data: str or list(str)
+    :param storage_format: format to save merged days in, defaults to the storage_format setting
+    :type storage_format: str
+    :return: paths of the day files in the archive that were added or changed
+    :rtype: list(str)
+    """
+    new_channel_folders = [new_channel_data] if isinstance(new_channel_data, str) else list(new_channel_data)
+    source_days = {}
+    for new_channel_folder in new_channel_folders:
+        for date, file_name in sorted(storage.list_day_files(new_channel_folder).items()):
+            source_days.setdefault(date, []).append(os.path.join(new_channel_folder, file_name))
+        for i in sorted(os.listdir(new_channel_folder)):
+            source_file = os.path.join(new_channel_folder, i)
+            if i == checksums.MANIFEST_FILE:
+                # the archive's manifest records the day files as they're moved or merged in
+                continue
+            if not storage.split_ext(i) and not (storage.YEAR_PATTERN.match(i) and os.path.isdir(source_file)):
+                shutil.move(source_file, os.path.join(destination_channel, i))
+    destination_days = {}
+    if source_days:
+        # only the archive's shards holding the new days are listed
+        end = datetime.strptime(max(source_days), '%Y-%m-%d') + timedelta(days=1)
+        destination_days = storage.list_day_files(destination_channel, min(source_days), '{:%Y-%m-%d}'.format(end))
+
+    layout = _storage_layout()
+    merged_files = []
+    for date, source_files in sorted(source_days.items()):
+        if date not in destination_days and len(source_files) == 1:
+            merged_files.append(storage.move_day_file(source_files[0], destination_channel, date, layout))
+            continue
+        streams = [_day_stream(i) for i in source_files]
+        if date in destination_days:
+            destination_file = os.path.join(destination_channel, destination_days[date])
+            # refuse to merge into, and overwrite, a day file that changed since it was written
+            checksums.check(destination_channel, destination_file)
+            streams.insert(0, _day_stream(destination_file))
+        destination_file, _ = storage.save_day_file(merge_message_streams(*streams, **_merge_rules()),
+                                                    destination_channel, date, _storage_format(storage_format),
+                                                    layout)
+        merged_files.append(destination_file)
+        for i in source_files:
+            os.remove(i)
+
+    for new_channel_folder in new_channel_folders:
+        shutil.rmtree(new_channel_folder)
+    return merged_files
+
+
+class MergeError(Exception):
+    def __init__(self, errors):
+        super().__init__('issue merging {} channels: {}'.format(len(errors), ', '.join(sorted(errors))))
+        self.errors = errors
+
+
+def merge_archives(destination_folder, new_data_folder, storage_format=None, workers=1, index=None):
+    """ Recursively merges data set folders into one larger data set. Several newly downloaded folders, e.g. the
+        staging folders of runs that never got merged, are combined with the archive in one pass. Channel folders
+        are independent of each other so with more than one worker they're merged in parallel processes
     :param destination_folder: The path to the archive folder that contains all the historical data
     :type destination_folder: str
-    :param new_data_folder: The path to the folder that contains newly downloaded data
-    :type new_data_folder: str
-    :return: True if the merge occurred correctly and the source folder was deleted. false otherwise
+    :param new_data_folder: The path, or list of paths oldest first, to the folders of newly downloaded data
+    :type new_data_folder: str or list(str)
+    :param storage_format: format to save merged days in, defaults to the storage_format setting
+    :type storage_format: str
+    :param workers: number of processes merging channel folders at once
+    :type workers: int
+    :param index: message index to update with the merged day files
+    :type index: MessageIndex
+    :return: True if the merge occurred correctly and the source folders were deleted. false otherwise
     :rtype: False
+    :raises MergeError: once every other channel is merged, if any channel or top level file failed to merge,
+        e.g. because the archive's copy fails its checksum. The failed downloads are left in place to be merged by
+        the next run
     """
-    if not os.path.exists(destination_folder):
-        os.rename(new_data_folder, destination_folder)
+    new_data_folders = [new_data_folder] if isinstance(new_data_folder, str) else list(new_data_folder)
+    if not os.path.exists(destination_folder) and len(new_data_folders) == 1:
+        os.rename(new_data_folders[0], destination_folder)
+        if index is not None:
+            index.rebuild(destination_folder)
         return True
+    _mkdir(destination_folder)
+    storage_format = _storage_format(storage_format)
 
-    result = False
-    paired_channels = pair_channels(os.listdir(destination_folder), os.listdir(new_data_folder))
-    for i in paired_channels:
-        dest_channel, new_data = i
-
-        # if a top level file, merge by id
-        if dest_channel == 'channels.json' or dest_channel == 'groups.json' or dest_channel == 'users.json':
-            base_name, ext = os.path.splitext(dest_channel)
-            destination_json = load_json(os.path.join(destination_folder, dest_channel))
-            source_json = load_json(os.path.join(new_data_folder, new_data))
-            current_list, archive_list = merge_json_list_by_id(destination_json, source_json)
-            _to_json(current_list, os.path.join(destination_folder, '{}{}'.format(base_name, ext)))
-            _to_json(archive_list, os.path.join(destination_folder, '{}.archive'.format(base_name)))
-            os.remove(os.path.join(new_data_folder, new_data))
-        else:  # Merge the channels
-            if dest_channel is None:  # If channel is new, simply move the file to the new folder and move on
-                destination_folder_path = os.path.join(destination_folder, new_data)
-                _mkdir(destination_folder_path)
-                new_channel_folder_path = os.path.join(new_data_folder, new_data)
-                for j in os.listdir(new_channel_folder_path):
-                    shutil.move(os.path.join(new_channel_folder_path, j),
-                                os.path.join(destination_folder_path, j))
-                continue
-            if new_data is None:  # if there have been no new activity in a channel, move on
-                continue
+    channels, errors = {}, {}
+    names = sorted(set().union(*(os.listdir(i) for i in new_data_folders)))
+    for name in names:
+        sources = [os.path.join(i, name) for i in new_data_folders if os.path.exists(os.path.join(i, name))]
+        destination = os.path.join(destination_folder, name)
+
+        if name in TOP_LEVEL_FILES:  # if a top level file, merge by id
+            try:
+                for source in sources:
+                    merge_top_level_file(destination_folder, name, load_json(source))
+                    os.remove(source)
+            except ValueError as error:
+                # a corrupt file is left as it is, along with the downloads that were to be merged into it
+                errors[name] = error
+        elif os.path.isdir(sources[0]):  # Merge the channels
+            _mkdir(destination)
+            channels[name] = (destination, sources)
+        else:  # any other file, the newest copy wins
+            shutil.move(sources[-1], destination)
+
+    results = {}
+    if workers <= 1:
+        for name, (destination, sources) in channels.items():
+            try:
+                results[name] = merge_channel_folder(destination, sources, storage_format)
+            except Exception as error:
+                errors[name] = error
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(merge_channel_folder, destination, sources, storage_format): name
+                       for name, (destination, sources) in channels.items()}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as error:
+                    errors[futures[future]] = error
+    print("Merged {0} day files across {1} channels".format(sum(len(i) for i in results.values()), len(results)))
+    metrics.count('day_files_merged', sum(len(i) for i in results.values()))
+    if workers > 1:
+        # the worker processes counted what they wrote into their own copies of the metrics
+        metrics.count('bytes_written', sum(os.path.getsize(i) for files in results.values() for i in files))
+    if index is not None:
+        ids = channel_ids(destination_folder)
+        for name, merged_files in results.items():
+            for merged_file in merged_files:
+                if name in ids:
+                    index.index_file(ids[name], merged_file)
 
-            dest_path = os.path.join(destination_folder, dest_channel)
-            new_path = os.path.join(new_data_folder, new_data)
-            merge_channel_folder(dest_path, new_path)
-    if os.listdir(new_data_folder):
-        shutil.rmtree(new_data_folder)
-        result = True
-    return result
+    if errors:
+        for name, error in sorted(errors.items()):
+            print('issue merging {}: {}'.format(name, error))
+        raise MergeError(errors)
+    for i in new_data_folders:
+        shutil.rmtree(i)
+    return bool(names)
 
 
 def main(token, last_time=0):
-    """  downloads all public and private channel messages the user is connected to from the last timestamp
+    """  downloads all public and private channel, group dm and dm messages the user is connected to from the last
+         timestamp
     :param token: encrypted slack token
     :type token: str
     :param last_time: last download run time of the archiving in epoch seconds
@@ -430,33 +1272,112 @@ def main(token, last_time=0):
     :return: None
     """
 
-    slack = Slacker(token)
+    run_started = time.time()
+    metrics.reset()
+    # one pool of keep alive connections, big enough for every channel and thread worker to hold one at once
+    pool_size = max(settings.get('concurrency', 1) * settings.get('thread_concurrency', 1),
+                    settings.get('attachment_workers', 4))
+    timeout = settings.get('api_timeout', 30)
+    session = SlackSession(token, pool_size=pool_size, timeout=timeout, retries=settings.get('api_retries', 3))
+    slack = Slacker(token, timeout=timeout, session=session)
+
+    with metrics.phase('bootstrap'):
+        orig_folder = limiter.call('team.info', slack.team.info).body['team']['domain']
+        # archives made before per channel cursors only know the day of the last run
+        last_time_file = os.path.join(orig_folder, 'last_run.txt')
+        if os.path.exists(last_time_file):
+            with open(last_time_file, 'r') as read_file:
+                last_time = float(read_file.read())
+        cursors = CursorIndex(os.path.join(orig_folder, 'cursors.json'))
+        threads = None
+        if settings.get('harvest_threads', True):
+            threads = ThreadState(os.path.join(orig_folder, 'threads.json'))
+        checkpoints = None
+        if settings.get('checkpoint_pages', True):
+            checkpoints = Checkpoints(os.path.join(orig_folder, 'checkpoints.json'))
+        aliases = ChannelAliases(os.path.join(orig_folder, ALIASES_FILE))
+        # archives saved before channel folders were named by id are moved over before anything new is saved,
+        # while their top level files still have the names the folders were saved under
+        migrated = migrate_layout(orig_folder, aliases)
+        # direct ingest merges new messages straight into the archive instead of a dated staging folder
+        direct_ingest = settings.get('direct_ingest', True)
+        if direct_ingest:
+            folder_path = orig_folder
+        else:
+            todays_date = datetime.today().strftime('%d-%m-%y')
+            folder_path = '{}-{}'.format(orig_folder, todays_date)
+            # staging folders left behind by runs that never got merged are merged along with today's
+            staging_folders = [i for i in glob.glob('{}-??-??-??'.format(glob.escape(orig_folder)))
+                               if os.path.isdir(i) and i != folder_path]
+            staging_folders.sort(key=os.path.getmtime)
+            for staging_folder in staging_folders:
+                migrate_layout(staging_folder, aliases)
+        _mkdir(folder_path)
+
+        users, public_channels, private_channels, direct_messages = bootstrap_key_values(slack)
+        aliases.update(public_channels + private_channels + direct_messages)
 
-    orig_folder = slack.team.info().body['team']['domain']
-    last_time_file = os.path.join(orig_folder, 'last_run.txt')
-    if os.path.exists(last_time_file):
-        with open(last_time_file, 'r') as read_file:
-            last_time = float(read_file.read())
-    todays_date = datetime.today().strftime('%d-%m-%y')
-    current_folder_path = '{}-{}'.format(orig_folder, todays_date)
-    _mkdir(current_folder_path)
+        changed = False
+        for file_name, data in zip(TOP_LEVEL_FILES, (users, public_channels, private_channels, direct_messages)):
+            if direct_ingest:
+                changed = merge_top_level_file(folder_path, file_name, data) or changed
+            else:
+                _to_json(data, os.path.join(folder_path, file_name))
 
-    users, public_channels, private_channels = bootstrap_key_values(slack)
+    index = MessageIndex(index_path(orig_folder)) if settings.get('message_index', False) else None
+    if index is not None and migrated:
+        index.rebuild(orig_folder)
 
-    _to_json(users, os.path.join(current_folder_path, 'users.json'))
-    _to_json(public_channels, os.path.join(current_folder_path, 'channels.json'))
-    _to_json(private_channels, os.path.join(current_folder_path, 'groups.json'))
+    with metrics.phase('download'):
+        conversations = public_channels + private_channels + direct_messages
+        scheduled, avoided = plan_downloads(conversations, cursors, last_time)
+        jobs = [(slack.conversations, channel) for channel in scheduled]
+        # staged days are only indexed once they're merged into the archive
+        updated = download_all(jobs, folder_path, last_time, settings.get('concurrency', 1), cursors, direct_ingest,
+                               index if direct_ingest else None, threads, checkpoints, aliases)
+        if threads is not None:
+            # a skipped channel had nothing posted to it, but its threads can still have new replies
+            scheduled_ids = {channel['id'] for channel in scheduled}
+            skipped = [channel for channel in conversations if channel['id'] not in scheduled_ids]
+            repoll = partial(repoll_threads, slack.conversations, folder_path=folder_path, threads=threads,
+                             cursors=cursors, index=index if direct_ingest else None)
+            pages_fetched = metrics.total('pages_fetched')
+            with ThreadPoolExecutor(max_workers=max(settings.get('concurrency', 1), 1)) as executor:
+                # only channels whose threads had new replies count as updated
+                updated += sum(1 for replied in executor.map(repoll, skipped) if replied)
+            avoided -= metrics.total('pages_fetched') - pages_fetched
+        print("{0} api calls saved by skipping inactive channels".format(avoided))
+        metrics.count('calls_avoided', avoided)
 
-    download_channels(slack.channels, public_channels, current_folder_path, last_time)
-    download_channels(slack.groups, private_channels, current_folder_path, last_time)
+    if direct_ingest:
+        # threads can get new replies in channels with no new messages, so anything written counts
+        result = changed or updated > 0 or metrics.total('bytes_written') > 0
+    else:
+        with metrics.phase('merge'):
+            result = merge_archives(orig_folder, staging_folders + [folder_path],
+                                    workers=settings.get('merge_workers', 1), index=index)
+    if index is not None:
+        index.close()
+    if settings.get('download_attachments', False):
+        with metrics.phase('attachments'):
+            download_attachments(orig_folder, session, settings.get('attachment_workers', 4),
+                                 modified_since=run_started)
+    if result or not os.path.exists('{}.zip'.format(orig_folder)):
+        with metrics.phase('zip'):
+            package_archive(orig_folder)
 
-    last_extracted_time = extract_date(current_folder_path)
-    result = merge_archives(orig_folder, current_folder_path)
-    with open(last_time_file, 'w') as write_file:
-        write_file.write(str(last_extracted_time))
-    if result:
-        shutil.make_archive(orig_folder, 'zip', orig_folder)
+    report = metrics.report(session, limiter)
+    for method, stats in report['api'].items():
+        print("{0}: {1} calls, {2} retries, {3:.3f}s average, {4:.3f}s slowest".format(
+            method, stats['calls'], stats['retries'], stats['seconds'] / stats['calls'], stats['max_seconds']))
+    for phase, stats in report['phases'].items():
+        print("{0}: {1:.1f}s".format(phase, stats['seconds']))
+    print("Spent {:.1f}s throttled by the Slack rate limits".format(report['throttled_seconds']))
+    # next to the zip rather than in the archive, so the report doesn't end up packaged
+    write_json_report(report, settings.get('run_report') or '{}.run-report.json'.format(orig_folder))
+    if settings.get('prometheus_textfile'):
+        write_prometheus_textfile(report, settings['prometheus_textfile'])
 
 
 if __name__ == "__main__":
-    main(the_crypter.decrypt(settings['api_token']))
+    main(load_crypter().decrypt(settings['api_token']))
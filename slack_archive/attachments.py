@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from slack_archive import storage
+
+# slack channel names can't start with a dot, so the store never clashes with a channel folder
+ATTACHMENTS_FOLDER = '.attachments'
+
+MANIFEST_FILE = 'manifest.json'
+
+# files a run set out to download and hasn't got yet, retried by every run until they're in the store
+PENDING_FILE = 'pending.json'
+
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_TIMEOUT = 60
+
+
+def file_url(file_info):
+    """ gets the url to download the passed in file from
+    :param file_info: an entry of a message's files list
+    :type file_info: dict
+    :return: the url, None if the file can't be downloaded, e.g. it was deleted or is external
+    :rtype: str
+    """
+    if file_info.get('mode') in ('tombstone', 'hidden_by_limit', 'external'):
+        return None
+    return file_info.get('url_private_download') or file_info.get('url_private')
+
+
+def iter_file_refs(archive_folder, modified_since=None):
+    """ yields every downloadable file referenced by the messages of the archive
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param modified_since: only read the day files modified at or after this time in epoch seconds
+    :type modified_since: float
+    :return: generator of the channel folder name and the file's properties
+    :rtype: generator(tuple(str, dict))
+    """
+    for name in sorted(os.listdir(archive_folder)):
+        channel_path = os.path.join(archive_folder, name)
+        if name.startswith('.') or not os.path.isdir(channel_path):
+            continue
+        for _, file_name in sorted(storage.list_day_files(channel_path).items()):
+            path = os.path.join(channel_path, file_name)
+            if modified_since is not None and os.path.getmtime(path) < modified_since:
+                continue
+            for message in storage.iter_records(path):
+                for file_info in message.get('files') or []:
+                    if file_info.get('id') and file_url(file_info):
+                        yield name, file_info
+
+
+class AttachmentStore:
+    """ content addressed store of downloaded files. Each file is saved once under the sha256 of its content, and a
+        manifest maps slack's file ids to the hash along with the channels the file was shared in
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = self._load(MANIFEST_FILE)
+        # file id mapped to the file's properties and the channels it was shared in
+        self.pending = self._load(PENDING_FILE)
+
+    def _load(self, file_name):
+        """ reads one of the store's json files
+        :param file_name: name of the file in the store folder
+        :type file_name: str
+        :return: its content, empty if there's no such file yet
+        :rtype: dict
+        """
+        try:
+            with open(os.path.join(self.folder, file_name)) as read_file:
+                return json.load(read_file)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self, file_name, data):
+        """ writes one of the store's json files to a temporary file and renames it over the old one. Callers hold
+            the lock
+        :param file_name: name of the file in the store folder
+        :type file_name: str
+        :param data: the file's content
+        :type data: dict
+        :return: None
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix='.{}-'.format(file_name.split('.')[0]), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as write_file:
+                json.dump(data, write_file, indent=4, sort_keys=True)
+            os.replace(temp_path, os.path.join(self.folder, file_name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _save_manifest(self):
+        """ writes the manifest. Callers hold the lock
+        :return: None
+        """
+        self._save(MANIFEST_FILE, self.manifest)
+
+    def set_pending(self, files, channels):
+        """ records the files about to be downloaded, so a later run retries any that don't make it into the store
+        :param files: properties of the files, as in a message's files list
+        :type files: list(dict)
+        :param channels: file id mapped to the channel folder names it was shared in
+        :type channels: dict
+        :return: None
+        """
+        pending = {file_info['id']: {'file': file_info, 'channels': sorted(channels[file_info['id']])}
+                   for file_info in files}
+        with self.lock:
+            if pending != self.pending:
+                self.pending = pending
+                self._save(PENDING_FILE, self.pending)
+
+    def blob_path(self, sha256):
+        """ gets the path the content with the passed in hash is stored at
+        :param sha256: hex digest of the content
+        :type sha256: str
+        :return: path to the blob
+        :rtype: str
+        """
+        return os.path.join(self.folder, 'objects', sha256[:2], sha256)
+
+    def has(self, file_id):
+        """ checks whether the file has already been downloaded
+        :param file_id: slack file id
+        :type file_id: str
+        :rtype: bool
+        """
+        with self.lock:
+            entry = self.manifest.get(file_id)
+        return entry is not None and os.path.exists(self.blob_path(entry['sha256']))
+
+    def add_channels(self, file_id, channels):
+        """ records more channels the already downloaded file was shared in
+        :param file_id: slack file id
+        :type file_id: str
+        :param channels: channel folder names
+        :type channels: iterable(str)
+        :return: None
+        """
+        with self.lock:
+            entry = self.manifest[file_id]
+            merged = sorted(set(entry['channels']) | set(channels))
+            if merged != entry['channels']:
+                entry['channels'] = merged
+                self._save_manifest()
+
+    def fetch(self, session, file_info, channels=(), timeout=DEFAULT_TIMEOUT):
+        """ downloads the file into the store. Data is streamed to a partial file as it arrives, so a download that
+            is cut off carries on from where it stopped next time rather than starting over
+        :param session: session to download with
+        :type session: SlackSession
+        :param file_info: an entry of a message's files list
+        :type file_info: dict
+        :param channels: channel folder names the file was shared in
+        :type channels: iterable(str)
+        :param timeout: seconds to wait for the server to connect or send more data
+        :type timeout: float
+        :return: hex sha256 digest of the file's content
+        :rtype: str
+        :raises OSError: if slack gave the file's size and a different number of bytes came down
+        """
+        # a dotfile, so packaging never picks up a half downloaded file
+        partial_path = os.path.join(self.folder, '.{}.part'.format(file_info['id']))
+        # slack usually says how big the file is, without it a partial file can't be told apart from a whole one
+        size = file_info.get('size')
+        digest = hashlib.sha256()
+        offset = 0
+        if os.path.exists(partial_path):
+            if size is not None and os.path.getsize(partial_path) > size:
+                os.remove(partial_path)
+            else:
+                with open(partial_path, 'rb') as read_file:
+                    for chunk in iter(lambda: read_file.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        offset += len(chunk)
+
+        while True:
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            with session.get(file_url(file_info), headers=headers, stream=True, timeout=timeout) as response:
+                if offset and response.status_code == 416:
+                    # the range starts at or past the end of the file, which only means the last run got all of it
+                    # when the partial file is as big as slack says the file is
+                    if offset == size:
+                        break
+                    os.remove(partial_path)
+                    digest = hashlib.sha256()
+                    offset = 0
+                    continue
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # the server ignored the range, so start again from the beginning
+                    digest = hashlib.sha256()
+                    offset = 0
+                with open(partial_path, 'ab' if offset else 'wb') as write_file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        write_file.write(chunk)
+                        offset += len(chunk)
+            break
+
+        if size is not None and offset != size:
+            if offset > size:
+                os.remove(partial_path)
+            raise OSError('got {} of the {} bytes of file {}'.format(offset, size, file_info['id']))
+        sha256 = digest.hexdigest()
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if os.path.exists(blob_path):
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, blob_path)
+
+        with self.lock:
+            self.manifest[file_info['id']] = {
+                'sha256': sha256,
+                'size': os.path.getsize(blob_path),
+                'name': file_info.get('name'),
+                'mimetype': file_info.get('mimetype'),
+                'channels': sorted(set(channels)),
+            }
+            self._save_manifest()
+            if self.pending.pop(file_info['id'], None) is not None:
+                self._save(PENDING_FILE, self.pending)
+        return sha256
+
+
+def download_attachments(archive_folder, session, workers=4, modified_since=None):
+    """ downloads every file referenced by the archive's messages that isn't in the store yet, several at once.
+        Files an earlier run failed to download are tried again whatever day files are looked in
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param session: session to download with, its pool should hold at least as many connections as workers
+    :type session: SlackSession
+    :param workers: number of files to download at once
+    :type workers: int
+    :param modified_since: only look for files in the day files modified at or after this time in epoch seconds
+    :type modified_since: float
+    :return: number of files downloaded
+    :rtype: int
+    """
+    store = AttachmentStore(os.path.join(archive_folder, ATTACHMENTS_FOLDER))
+    files, channels = {}, {}
+    for channel, file_info in iter_file_refs(archive_folder, modified_since):
+        files.setdefault(file_info['id'], file_info)
+        channels.setdefault(file_info['id'], set()).add(channel)
+    for file_id, entry in store.pending.items():
+        files.setdefault(file_id, entry['file'])
+        channels.setdefault(file_id, set()).update(entry['channels'])
+
+    pending = []
+    for file_id, file_info in sorted(files.items()):
+        if store.has(file_id):
+            store.add_channels(file_id, channels[file_id])
+        else:
+            pending.append(file_info)
+    store.set_pending(pending, channels)
+
+    downloaded = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(store.fetch, session, file_info, channels[file_info['id']]): file_info['id']
+                   for file_info in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                downloaded += 1
+            except (requests.RequestException, OSError) as error:
+                print('issue downloading file {}: {}'.format(futures[future], error))
+    print("Downloaded {0} of {1} new files".format(downloaded, len(pending)))
+    return downloaded
@@ -0,0 +1,220 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from slacker import Slacker
+from slack_archive import archive, storage, synthetic
+from slack_archive.fake_slack import FakeSlack
+from slack_archive.packaging import package_archive
+from slack_archive.rate_limit import RateLimiter
+
+PHASES = ('fetch', 'fetch_replies', 'parse_and_save', 'merge_archives', 'extract_date', 'package', 'package_delta')
+
+# slower than the baseline by more than this fraction counts as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# budgets big enough that the benchmark measures the archiver rather than the rate limits
+UNTHROTTLED = {tier: (10 ** 9, 10 ** 6) for tier in (1, 2, 3, 4)}
+
+
+class Timer:
+    """ times a block of code, keeping the best of however many times it runs """
+
+    def __init__(self):
+        self.results = {}
+
+    def time(self, phase, func, *args, **kwargs):
+        """ runs the function and records how long it took against the phase
+        :param phase: name of the phase
+        :type phase: str
+        :param func: function to time
+        :type func: callable
+        :return: whatever the function returns
+        """
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - started
+        self.results[phase] = min(seconds, self.results.get(phase, seconds))
+        return result
+
+
+def _fetch(slack, workspace, limiter):
+    """ fetches the history of every channel of the workspace
+    :param slack: slack connection to the fake
+    :type slack: Slacker
+    :param workspace: the generated workspace
+    :type workspace: dict
+    :param limiter: rate limiter pacing the calls
+    :type limiter: RateLimiter
+    :return: channel id mapped to its messages, newest first
+    :rtype: dict
+    """
+    return {conversation['id']: archive.retrieve_messages(slack.conversations, conversation['id'], 0,
+                                                          rate_limiter=limiter)
+            for conversation in workspace['conversations']}
+
+
+def _fetch_replies(slack, history, limiter):
+    """ fetches the replies of every thread found in the history
+    :param slack: slack connection to the fake
+    :type slack: Slacker
+    :param history: channel id mapped to its messages
+    :type history: dict
+    :param limiter: rate limiter pacing the calls
+    :type limiter: RateLimiter
+    :return: number of messages fetched
+    :rtype: int
+    """
+    fetched = 0
+    for channel_id, messages in history.items():
+        for message in messages:
+            if message.get('reply_count'):
+                fetched += len(list(archive.iter_replies(slack.conversations, channel_id, message['ts'],
+                                                         rate_limiter=limiter)))
+    return fetched
+
+
+def _save(folder, workspace, history, storage_format, keep):
+    """ saves the part of every channel's history picked by keep to the folder, the way a download would
+    :param folder: folder to save to
+    :type folder: str
+    :param workspace: the generated workspace
+    :type workspace: dict
+    :param history: channel id mapped to its messages
+    :type history: dict
+    :param storage_format: format to save the day files in
+    :type storage_format: str
+    :param keep: picks the messages to save by their ts
+    :type keep: callable
+    :return: None
+    """
+    for conversation in workspace['conversations']:
+        channel_path = os.path.join(folder, archive.folder_name(conversation))
+        archive._mkdir(channel_path)
+        messages = [message for message in history[conversation['id']] if keep(float(message['ts']))]
+        archive.parse_and_save_messages(channel_path, messages, archive.channel_type(conversation),
+                                        storage_format=storage_format)
+    archive._to_json(workspace['users'], os.path.join(folder, 'users.json'))
+    archive._to_json(workspace['conversations'], os.path.join(folder, 'channels.json'))
+
+
+def run_benchmark(channels=10, messages_per_day=20, thread_depth=3, years=1, repeat=1, storage_format='json',
+                  merge_workers=1, seed=0):
+    """ generates a synthetic workspace, serves it from a local fake slack and times each stage of archiving it
+    :param channels: number of channels
+    :type channels: int
+    :param messages_per_day: top level messages posted to each channel each day
+    :type messages_per_day: int
+    :param thread_depth: replies in each thread
+    :type thread_depth: int
+    :param years: years of history
+    :type years: float
+    :param repeat: times to run each phase, the best time is kept
+    :type repeat: int
+    :param storage_format: format to save the day files in
+    :type storage_format: str
+    :param merge_workers: processes merging channel folders at once
+    :type merge_workers: int
+    :param seed: seed of the generated workspace
+    :type seed: int
+    :return: the report, holding the configuration and the seconds each phase took
+    :rtype: dict
+    """
+    config = {'channels': channels, 'messages_per_day': messages_per_day, 'thread_depth': thread_depth,
+              'years': years, 'repeat': repeat, 'storage_format': storage_format, 'merge_workers': merge_workers,
+              'seed': seed}
+    workspace = synthetic.generate_workspace(channels, messages_per_day, thread_depth, years, seed=seed)
+    limiter = RateLimiter(tiers=UNTHROTTLED)
+    timer = Timer()
+    counts = {}
+
+    with FakeSlack(**workspace) as fake:
+        slack = Slacker('token', session=fake.session())
+        for _ in range(repeat):
+            history = timer.time('fetch', _fetch, slack, workspace, limiter)
+            counts['fetch'] = sum(len(i) for i in history.values())
+            counts['fetch_replies'] = timer.time('fetch_replies', _fetch_replies, slack, history, limiter)
+
+    all_ts = sorted(float(message['ts']) for messages in history.values() for message in messages)
+    # the staged download overlaps the archive by a tenth of the history, like a run after a missed merge
+    split = all_ts[int(len(all_ts) * 0.7)] if all_ts else 0
+    overlap = all_ts[int(len(all_ts) * 0.6)] if all_ts else 0
+
+    work_folder = tempfile.mkdtemp(prefix='slack-archive-benchmark-')
+    try:
+        for _ in range(repeat):
+            shutil.rmtree(work_folder, ignore_errors=True)
+            destination = os.path.join(work_folder, 'archive')
+            staging = os.path.join(work_folder, 'archive-staging')
+            timer.time('parse_and_save', _save, destination, workspace, history, storage_format,
+                       lambda ts: ts < split)
+            _save(staging, workspace, history, storage_format, lambda ts: ts >= overlap)
+            timer.time('merge_archives', archive.merge_archives, destination, staging, storage_format,
+                       workers=merge_workers)
+            timer.time('extract_date', archive.extract_date, destination)
+            timer.time('package', package_archive, destination)
+            # touching one day file is the smallest change a nightly run makes
+            channel_path = os.path.join(destination, archive.folder_name(workspace['conversations'][0]))
+            day_file = storage.list_day_files(channel_path)[storage.latest_day(channel_path)]
+            os.utime(os.path.join(channel_path, day_file))
+            timer.time('package_delta', package_archive, destination)
+        counts['parse_and_save'] = sum(1 for ts in all_ts if ts < split)
+        counts['merge_archives'] = sum(1 for ts in all_ts if ts >= overlap)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    return {
+        'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'messages': len(all_ts),
+        'phases': {phase: {'seconds': timer.results[phase], 'items': counts.get(phase)}
+                   for phase in PHASES if phase in timer.results},
+    }
+
+
+def compare_reports(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """ compares the phase times of two reports
+    :param baseline: report to compare against
+    :type baseline: dict
+    :param current: the new report
+    :type current: dict
+    :param threshold: fraction slower than the baseline that counts as a regression
+    :type threshold: float
+    :return: phase mapped to the baseline and current seconds, their ratio and whether it regressed
+    :rtype: dict
+    """
+    comparison = {}
+    for phase, result in current['phases'].items():
+        if phase not in baseline['phases']:
+            continue
+        before = baseline['phases'][phase]['seconds']
+        ratio = result['seconds'] / before if before else float('inf')
+        comparison[phase] = {'baseline': before, 'current': result['seconds'], 'ratio': ratio,
+                             'regressed': ratio > 1 + threshold}
+    return comparison
+
+
+def format_report(report, comparison=None):
+    """ formats the report as a table for the command line
+    :param report: report from run_benchmark
+    :type report: dict
+    :param comparison: result of compare_reports against a baseline
+    :type comparison: dict
+    :return: the table
+    :rtype: str
+    """
+    lines = ['{} messages, {}'.format(report['messages'], json.dumps(report['config'], sort_keys=True))]
+    for phase, result in report['phases'].items():
+        line = '{:<16}{:>10.3f}s'.format(phase, result['seconds'])
+        if result['items'] and result['seconds']:
+            line += '{:>12.0f}/s'.format(result['items'] / result['seconds'])
+        if comparison and phase in comparison:
+            line += '  {:>6.2f}x baseline{}'.format(comparison[phase]['ratio'],
+                                                    '  REGRESSION' if comparison[phase]['regressed'] else '')
+        lines.append(line)
+    return '\n'.join(lines)
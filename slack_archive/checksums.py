@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# each channel folder keeps the checksum of every day file in it, a line is appended on every write and the latest
+# line for a file wins. A pending line is appended before a new file is renamed into place, so a crash before its
+# checksum is recorded leaves a file that still matches
+MANIFEST_FILE = '.checksums.jsonl'
+
+READ_SIZE = 1024 * 1024
+
+# the manifest is rewritten without its superseded lines once it holds this many lines more than files
+COMPACT_SLACK = 1000
+
+_lock = threading.Lock()
+
+# manifest path mapped to the stat of the manifest when it was read, its entries and how many lines it holds
+_cache = {}
+
+
+class ChecksumError(ValueError):
+    def __init__(self, path, expected, actual):
+        super().__init__('{} does not match its recorded checksum, expected {} but found {}'.format(
+            path, expected, actual))
+        self.path = path
+
+
+def manifest_path(folder_path):
+    """ gets the path of the channel folder's checksum manifest
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :rtype: str
+    """
+    return os.path.join(folder_path, MANIFEST_FILE)
+
+
+def _relative(folder_path, path):
+    """ gets the key of a day file in its folder's manifest, the same whichever os wrote it
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param path: path to the day file
+    :type path: str
+    :rtype: str
+    """
+    return os.path.relpath(path, folder_path).replace(os.sep, '/')
+
+
+def file_checksum(path):
+    """ hashes a file as it's stored on disk, compressed or not
+    :param path: path to the file
+    :type path: str
+    :return: the sha256 in hex and the size of the file
+    :rtype: tuple(str, int)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as read_file:
+        for chunk in iter(lambda: read_file.read(READ_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _stat(path):
+    """ gets what tells whether a manifest changed since it was read
+    :param path: path to the manifest
+    :type path: str
+    :return: the size and modification time, None if there's no manifest
+    :rtype: tuple(int, int)
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _apply(entries, line):
+    """ applies a manifest line to the entries read so far
+    :param entries: day file path mapped to its checksum and any pending one
+    :type entries: dict
+    :param line: manifest line
+    :type line: dict
+    :return: None
+    """
+    if line.get('sha256') is None:
+        entries.pop(line['path'], None)
+    elif line.get('pending'):
+        # copied rather than changed in place, load_manifest hands out the entries
+        entries[line['path']] = dict(entries.get(line['path'], {}),
+                                     pending={'sha256': line['sha256'], 'size': line['size']})
+    else:
+        entries[line['path']] = {'sha256': line['sha256'], 'size': line['size']}
+
+
+def accepted(entry):
+    """ lists the checksums a day file can match, the one recorded and the one of a write that may not have been
+    :param entry: the file's manifest entry
+    :type entry: dict
+    :return: the sha256 in hex and size of each
+    :rtype: list(tuple(str, int))
+    """
+    return [(i['sha256'], i['size']) for i in (entry, entry.get('pending') or {}) if i.get('sha256')]
+
+
+def _load(path):
+    """ reads a manifest, replaying its lines, must be called holding the lock
+    :param path: path to the manifest
+    :type path: str
+    :return: the cached stat, entries and line count
+    :rtype: list
+    """
+    stat = _stat(path)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == stat:
+        return cached
+    entries, lines = {}, 0
+    if stat is not None:
+        with open(path) as read_file:
+            for line in read_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut off by a crash mid append, the file it was for is reported unrecorded
+                    continue
+                lines += 1
+                _apply(entries, entry)
+    cached = [stat, entries, lines]
+    _cache[path] = cached
+    return cached
+
+
+def load_manifest(folder_path):
+    """ loads the checksums recorded for the channel folder's day files
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :return: day file path relative to the folder mapped to its sha256 and size, along with the sha256 and size of
+        a write that may not have been recorded as pending
+    :rtype: dict
+    """
+    with _lock:
+        return dict(_load(manifest_path(folder_path))[1])
+
+
+def _compact(path, cached):
+    """ rewrites a manifest with a line for each file it records, must be called holding the lock
+    :param path: path to the manifest
+    :type path: str
+    :param cached: the manifest's cache entry
+    :type cached: list
+    :return: None
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as write_file:
+            for file_path, entry in sorted(cached[1].items()):
+                if entry.get('sha256'):
+                    write_file.write(json.dumps({'path': file_path, 'sha256': entry['sha256'], 'size': entry['size']},
+                                                sort_keys=True) + '\n')
+                if entry.get('pending'):
+                    write_file.write(json.dumps(dict(entry['pending'], path=file_path, pending=True),
+                                                sort_keys=True) + '\n')
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    cached[0], cached[2] = _stat(path), len(cached[1])
+
+
+def _append(folder_path, lines):
+    """ appends lines to the channel folder's manifest, compacting it once it's mostly superseded lines
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param lines: manifest lines, a None sha256 forgets the file
+    :type lines: list(dict)
+    :return: None
+    """
+    path = manifest_path(folder_path)
+    with _lock:
+        cached = _load(path)
+        with open(path, 'a') as write_file:
+            write_file.write(''.join(json.dumps(line, sort_keys=True) + '\n' for line in lines))
+        for line in lines:
+            _apply(cached[1], line)
+        cached[0], cached[2] = _stat(path), cached[2] + len(lines)
+        if cached[2] > 2 * len(cached[1]) + COMPACT_SLACK:
+            _compact(path, cached)
+
+
+def record(folder_path, path, checksum=None):
+    """ records the checksum of a day file just written to the channel folder
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param path: path to the day file
+    :type path: str
+    :param checksum: the file's sha256 and size if already known, otherwise the file is hashed
+    :type checksum: tuple(str, int)
+    :return: None
+    """
+    sha256, size = checksum or file_checksum(path)
+    _append(folder_path, [{'path': _relative(folder_path, path), 'sha256': sha256, 'size': size}])
+
+
+def record_pending(folder_path, path, checksum):
+    """ records the checksum of a day file about to be renamed into the channel folder, accepted until record is
+        called for it, so a crash in between doesn't make the file look corrupt
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param path: path the day file is about to have
+    :type path: str
+    :param checksum: the file's sha256 and size
+    :type checksum: tuple(str, int)
+    :return: None
+    """
+    sha256, size = checksum
+    _append(folder_path, [{'path': _relative(folder_path, path), 'sha256': sha256, 'size': size, 'pending': True}])
+
+
+def forget(folder_path, path):
+    """ drops a day file removed from the channel folder from its manifest
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param path: path to the removed day file
+    :type path: str
+    :return: None
+    """
+    _append(folder_path, [{'path': _relative(folder_path, path), 'sha256': None}])
+
+
+def check(folder_path, path):
+    """ checks a day file against the checksum recorded for it before it's merged into and overwritten
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param path: path to the day file
+    :type path: str
+    :return: True if the file matches its checksum, False if it has none recorded
+    :rtype: bool
+    :raises ChecksumError: if the file doesn't match its checksum
+    """
+    entry = load_manifest(folder_path).get(_relative(folder_path, path))
+    if entry is None:
+        return False
+    expected = accepted(entry)
+    # a truncated file shows up in its size without hashing it
+    size = os.path.getsize(path)
+    if size not in [i[1] for i in expected]:
+        raise ChecksumError(path, ' or '.join('{} bytes'.format(i[1]) for i in expected), '{} bytes'.format(size))
+    sha256, _ = file_checksum(path)
+    if (sha256, size) not in expected:
+        raise ChecksumError(path, ' or '.join(i[0] for i in expected), sha256)
+    if sha256 != entry.get('sha256'):
+        # the write went through but crashed before its checksum was recorded
+        record(folder_path, path, (sha256, size))
+    return True
@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+SLACK_API_URL = 'https://slack.com/api/'
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 10
+
+# backoff before the nth retry is drawn between 0 and min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n) seconds
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# slack methods that only read, so sending them again after a failure can't change anything
+READ_SUFFIXES = ('.list', '.info', '.history', '.replies')
+
+
+class SlackSession(requests.Session):
+    """ keep alive session shared by every worker talking to slack. Its connection pool is sized for the workers,
+        each call gets a timeout, idempotent reads that fail with a server error or a dropped connection are retried
+        with jittered exponential backoff, and the latency of every call is counted per method
+    """
+
+    def __init__(self, token=None, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 method_timeouts=None, base_url=None, sleep=time.sleep):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        if token:
+            self.headers['Authorization'] = 'Bearer {}'.format(token)
+        self.timeout = timeout
+        self.method_timeouts = method_timeouts or {}
+        self.retries = retries
+        self.base_url = base_url
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _record(self, method, seconds, retried=False, failed=False):
+        """ adds a call to the method's latency counters
+        :param method: slack api method name
+        :type method: str
+        :param seconds: how long the call took
+        :type seconds: float
+        :param retried: whether the call is being sent again
+        :type retried: bool
+        :param failed: whether the call failed
+        :type failed: bool
+        :return: None
+        """
+        with self.lock:
+            stats = self.stats.setdefault(method, {'calls': 0, 'retries': 0, 'errors': 0, 'seconds': 0.0,
+                                                   'max_seconds': 0.0})
+            stats['calls'] += 1
+            stats['retries'] += int(retried)
+            stats['errors'] += int(failed)
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def backoff(self, attempt):
+        """ works out how long to wait before retrying, spreading retries from concurrent workers apart
+        :param attempt: number of retries already made
+        :type attempt: int
+        :return: seconds to wait
+        :rtype: float
+        """
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url and url.startswith(SLACK_API_URL):
+            url = self.base_url + url[len(SLACK_API_URL):]
+        api_method = api_method_name(url)
+        kwargs['timeout'] = self.method_timeouts.get(api_method) or kwargs.get('timeout') or self.timeout
+        idempotent = method.upper() in ('GET', 'HEAD') or api_method.endswith(READ_SUFFIXES)
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                retry = idempotent and attempt < self.retries
+                self._record(api_method, time.monotonic() - started, retried=retry, failed=not retry)
+                if not retry:
+                    raise
+            else:
+                retry = idempotent and attempt < self.retries and response.status_code in RETRY_STATUSES
+                self._record(api_method, time.monotonic() - started, retried=retry,
+                             failed=not retry and response.status_code >= 400)
+                if not retry:
+                    return response
+                response.close()
+            self.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def report(self):
+        """ summarises the calls made through the session
+        :return: method name mapped to its calls, retries, errors, total and slowest seconds
+        :rtype: dict
+        """
+        with self.lock:
+            return {method: dict(stats) for method, stats in sorted(self.stats.items())}
+
+
+def api_method_name(url):
+    """ gets the slack method a url calls, e.g. conversations.history
+    :param url: url of the call
+    :type url: str
+    :return: the method name, or the first part of the path for urls outside the api such as file downloads
+    :rtype: str
+    """
+    path = urlsplit(url).path.strip('/')
+    if path.startswith('api/'):
+        return path[len('api/'):]
+    return path.split('/')[0]
@@ -8,6 +8,40 @@ parent_dir = os.path.dirname(__file__)
 with open(os.path.join(parent_dir, 'settings.yaml'), 'r') as read_file:
     settings = yaml.load(read_file, Loader=yaml.FullLoader)
 
-# loads the encryption/decryption object to be used across the project
-with open(os.path.join(parent_dir, settings['key_file']), 'r') as read_file:
-    the_crypter = Security(read_file.read())
+
+def key_path():
+    """ gets the path of the key the api token is encrypted with, the SLACK_ARCHIVE_KEY_FILE environment variable
+        or else the key_file setting relative to the package
+    :rtype: str
+    """
+    return os.environ.get('SLACK_ARCHIVE_KEY_FILE') or os.path.join(parent_dir, settings['key_file'])
+
+
+def load_crypter(path=None):
+    """ loads the encryption/decryption object from the key file. The key is never committed, each install keeps
+        its own
+    :param path: path to the key file, defaults to key_path()
+    :type path: str
+    :return: the encryption/decryption object
+    :rtype: Security
+    :raises SystemExit: if there is no key file
+    """
+    path = path or key_path()
+    try:
+        with open(path, 'r') as read_file:
+            return Security(read_file.read())
+    except FileNotFoundError:
+        raise SystemExit('No key file at {}. Generate one with cryptography.fernet.Fernet.generate_key(), save it '
+                         'there or point SLACK_ARCHIVE_KEY_FILE at it, and encrypt api_token in settings.yaml with '
+                         'it'.format(path))
+
+
+def __getattr__(name):
+    """ keeps config.the_crypter working for existing callers, loading the key only when it's first asked for
+    :param name: module attribute name
+    :type name: str
+    :rtype: Security
+    """
+    if name == 'the_crypter':
+        return load_crypter()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
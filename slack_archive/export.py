@@ -0,0 +1,276 @@
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from slack_archive import reader, storage
+from slack_archive.index import channel_ids
+
+DEFAULT_LEVEL = 6
+
+# members each worker can have compressed ahead of the writer, keeping memory flat however big the export is
+QUEUE_DEPTH = 4
+
+# sizes, offsets and member counts from these on need the zip64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+LOCAL_HEADER = 0x04034b50
+CENTRAL_HEADER = 0x02014b50
+ZIP64_END = 0x06064b50
+ZIP64_LOCATOR = 0x07064b50
+END_OF_CENTRAL_DIRECTORY = 0x06054b50
+ZIP64_EXTRA = 0x0001
+DEFLATED = 8
+UTF8_NAMES = 0x800
+
+
+def _dos_time(date_time):
+    """ packs a time into the time and date fields of a zip header
+    :param date_time: year, month, day, hour, minute and second
+    :type date_time: tuple(int)
+    :return: the dos time and date
+    :rtype: tuple(int, int)
+    """
+    year, month, day, hour, minute, second = date_time[:6]
+    return hour << 11 | minute << 5 | second // 2, max(year - 1980, 0) << 9 | month << 5 | day
+
+
+class ZipWriter:
+    """ writes a zip file front to back from members deflated beforehand, so the compressing can be spread over
+        worker threads while the members are still written one after another. It never seeks, and switches to the
+        zip64 records once the file outgrows the classic ones
+    """
+
+    def __init__(self, write_file, date_time=None):
+        self.write_file = write_file
+        self.offset = 0
+        self.entries = []
+        self.dos_time, self.dos_date = _dos_time(date_time or time.localtime())
+
+    def _write(self, data):
+        """ writes to the file, keeping track of where in it the next member starts
+        :param data: bytes to write
+        :type data: bytes
+        :return: None
+        """
+        self.write_file.write(data)
+        self.offset += len(data)
+
+    def add(self, name, compressed, crc, size):
+        """ writes a member
+        :param name: path of the member inside the zip
+        :type name: str
+        :param compressed: the member's data as a raw deflate stream
+        :type compressed: bytes
+        :param crc: crc32 of the uncompressed data
+        :type crc: int
+        :param size: length of the uncompressed data
+        :type size: int
+        :return: None
+        """
+        encoded = name.encode('utf-8')
+        zip64 = size >= ZIP64_LIMIT or len(compressed) >= ZIP64_LIMIT
+        extra = struct.pack('<HHQQ', ZIP64_EXTRA, 16, size, len(compressed)) if zip64 else b''
+        self.entries.append((encoded, crc, len(compressed), size, self.offset))
+        self._write(struct.pack('<IHHHHHIIIHH', LOCAL_HEADER, 45 if zip64 else 20, UTF8_NAMES, DEFLATED,
+                                self.dos_time, self.dos_date, crc, 0xFFFFFFFF if zip64 else len(compressed),
+                                0xFFFFFFFF if zip64 else size, len(encoded), len(extra)))
+        self._write(encoded)
+        self._write(extra)
+        self._write(compressed)
+
+    def close(self):
+        """ writes the central directory, finishing the zip. The file itself is left open
+        :return: None
+        """
+        start = self.offset
+        for encoded, crc, compressed_size, size, offset in self.entries:
+            # the zip64 extra field holds whichever of these overflowed, in this order
+            fields = [value for value in (size, compressed_size, offset) if value >= ZIP64_LIMIT]
+            extra = struct.pack('<HH{}Q'.format(len(fields)), ZIP64_EXTRA, 8 * len(fields), *fields) if fields else b''
+            version = 45 if fields else 20
+            self._write(struct.pack('<IHHHHHHIIIHHHHHII', CENTRAL_HEADER, 3 << 8 | version, version, UTF8_NAMES,
+                                    DEFLATED, self.dos_time, self.dos_date, crc,
+                                    0xFFFFFFFF if compressed_size >= ZIP64_LIMIT else compressed_size,
+                                    0xFFFFFFFF if size >= ZIP64_LIMIT else size, len(encoded), len(extra), 0, 0, 0,
+                                    0o100644 << 16, 0xFFFFFFFF if offset >= ZIP64_LIMIT else offset))
+            self._write(encoded)
+            self._write(extra)
+        count, directory_size = len(self.entries), self.offset - start
+        if count >= ZIP64_COUNT_LIMIT or directory_size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            zip64_end = self.offset
+            self._write(struct.pack('<IQHHIIQQQQ', ZIP64_END, 44, 3 << 8 | 45, 45, 0, 0, count, count,
+                                    directory_size, start))
+            self._write(struct.pack('<IIQI', ZIP64_LOCATOR, 0, zip64_end, 1))
+            count, directory_size, start = 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF
+        self._write(struct.pack('<IHHHHIIH', END_OF_CENTRAL_DIRECTORY, 0, 0, count, count, directory_size, start, 0))
+
+
+def _compress(name, data, level):
+    """ deflates a member's data, run in the worker threads
+    :param name: path of the member inside the zip
+    :type name: str
+    :param data: the member's data
+    :type data: bytes
+    :param level: zlib compression level
+    :type level: int
+    :return: arguments for ZipWriter.add
+    :rtype: tuple(str, bytes, int, int)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return name, compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data)
+
+
+def _to_member(data):
+    """ formats a list of json the way slack's exports do
+    :param data: list of json
+    :type data: list(dict)
+    :rtype: bytes
+    """
+    return json.dumps(data, indent=4).encode('utf-8')
+
+
+def _day_member(name, path, start, end, level, use_mmap):
+    """ reads the messages of a day file within the time range and compresses them as an export day file, run in
+        the worker threads
+    :param name: path of the member inside the zip
+    :type name: str
+    :param path: path to the day file
+    :type path: str
+    :param start: start of the range, see reader.iter_messages
+    :param end: end of the range, not included
+    :param level: zlib compression level
+    :type level: int
+    :param use_mmap: read the day file through a memory map
+    :type use_mmap: bool
+    :return: arguments for ZipWriter.add, None if no message of the day is in the range
+    :rtype: tuple(str, bytes, int, int)
+    """
+    messages = list(reader.read_day(path, start, end, use_mmap))
+    return _compress(name, _to_member(messages), level) if messages else None
+
+
+def _read_top_level(archive_folder, file_name):
+    """ loads a top level file of the archive
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param file_name: name of the file, e.g. users.json
+    :type file_name: str
+    :return: list of json, empty if the archive has no such file
+    :rtype: list(dict)
+    """
+    path = os.path.join(archive_folder, file_name)
+    return storage.read_records(path) if os.path.exists(path) else []
+
+
+def export_conversations(archive_folder, selected=None):
+    """ sorts the archive's conversations into the top level files of a slack export: public channels into
+        channels.json, private channels into groups.json, group dms into mpims.json and dms into dms.json, and picks
+        the folder each one's day files go in, its name, or its id for dms and for names already taken
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param selected: ids of the conversations to export, None for all of them
+    :type selected: set(str)
+    :return: export file name mapped to its conversations, and conversation id mapped to its folder name
+    :rtype: tuple(dict, dict)
+    """
+    files = {'channels.json': [], 'groups.json': [], 'mpims.json': [], 'dms.json': []}
+    folders = {}
+    taken = set()
+    conversations = _read_top_level(archive_folder, 'channels.json') + _read_top_level(archive_folder, 'groups.json')
+    for conversation in conversations + _read_top_level(archive_folder, 'dms.json'):
+        # names are handed out over every conversation so a channel's folder doesn't depend on what's exported
+        name = conversation.get('name')
+        if conversation.get('is_im') or not name or name in taken:
+            name = conversation['id']
+        taken.add(name)
+        folders[conversation['id']] = name
+        if selected is not None and conversation['id'] not in selected:
+            continue
+        if conversation.get('is_im'):
+            files['dms.json'].append(conversation)
+        elif conversation.get('is_mpim'):
+            files['mpims.json'].append(conversation)
+        elif conversation.get('is_private') or conversation.get('is_group'):
+            files['groups.json'].append(conversation)
+        else:
+            files['channels.json'].append(conversation)
+    return files, folders
+
+
+def _members(archive_folder, channels, start, end, level, use_mmap):
+    """ lists the work making up the export, in the order its members are written
+    :return: generator of a function and the arguments to run it with in a worker thread
+    :rtype: generator(tuple)
+    """
+    selected = None
+    if channels is not None:
+        ids = channel_ids(archive_folder)
+        selected = {ids.get(channel, channel) for channel in channels}
+    files, folders = export_conversations(archive_folder, selected)
+    yield _compress, 'users.json', _to_member(_read_top_level(archive_folder, 'users.json')), level
+    for file_name, conversations in files.items():
+        # slack leaves out the files of conversation types it has nothing of, except channels.json
+        if conversations or file_name == 'channels.json':
+            yield _compress, file_name, _to_member(conversations), level
+    for channel_id, date, path in reader.iter_days(archive_folder, channels, start, end):
+        name = '{}/{}.json'.format(folders.get(channel_id, channel_id), date)
+        yield _day_member, name, path, start, end, level, use_mmap
+
+
+def export_archive(archive_folder, output_path, channels=None, start=None, end=None, workers=4, level=DEFAULT_LEVEL,
+                   use_mmap=False):
+    """ streams the archive straight into a zip in the layout of slack's own exports: users.json, the conversation
+        files and a folder of YYYY-MM-DD.json day files for each channel. The members are built and deflated in
+        worker threads and written as they finish, in order, with no copy of the export made on disk first
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param output_path: path of the zip, replaced in a single rename once it's complete
+    :type output_path: str
+    :param channels: channel ids or names, current or past, None for every channel in the archive
+    :type channels: iterable(str)
+    :param start: start of the range: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds
+    :type start: str or datetime or float
+    :param end: end of the range, not included, in the same forms as start
+    :type end: str or datetime or float
+    :param workers: number of threads compressing members at once
+    :type workers: int
+    :param level: zlib compression level
+    :type level: int
+    :param use_mmap: read the day files through memory maps rather than buffered reads
+    :type use_mmap: bool
+    :return: number of day files exported
+    :rtype: int
+    """
+    folder = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.export-', suffix='.tmp')
+    exported = 0
+    try:
+        with os.fdopen(fd, 'wb') as write_file, ThreadPoolExecutor(max_workers=workers) as executor:
+            zip_writer = ZipWriter(write_file)
+            pending = deque()
+
+            def write_next():
+                func, future = pending.popleft()
+                member = future.result()
+                if member is not None:
+                    zip_writer.add(*member)
+                return func is _day_member and member is not None
+
+            for func, *args in _members(archive_folder, channels, start, end, level, use_mmap):
+                pending.append((func, executor.submit(func, *args)))
+                if len(pending) > workers * QUEUE_DEPTH:
+                    exported += write_next()
+            while pending:
+                exported += write_next()
+            zip_writer.close()
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return exported
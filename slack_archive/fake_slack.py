@@ -0,0 +1,277 @@
+import base64
+import json
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from slack_archive.client import SlackSession
+
+# largest page slack hands out for the conversations methods
+MAX_LIMIT = 999
+
+
+class FakeSlack:
+    """ a local stand-in for the slack web api that serves an in memory workspace, used by the tests and
+        benchmarks so they never have to touch a real workspace
+    """
+
+    def __init__(self, team=None, users=None, conversations=None, messages=None):
+        self.team = team or {'id': 'T0000001', 'domain': 'fake-workspace'}
+        self.users = users or []
+        self.conversations = conversations or []
+        self.messages = {}
+        for channel_id, channel_messages in (messages or {}).items():
+            self.add_messages(channel_id, channel_messages)
+        self.files = {}
+        self.ranges = []
+        self.calls = Counter()
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """ starts serving the workspace on a free local port in a background thread
+        :return: None
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self, dict(parse_qsl(urlsplit(self.path).query)))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                params = dict(parse_qsl(urlsplit(self.path).query))
+                params.update(parse_qsl(self.rfile.read(length).decode('utf-8')))
+                fake._handle(self, params)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        # poll often so stopping the server doesn't hold up every test
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ stops the server
+        :return: None
+        """
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def url(self):
+        """ base url of the fake api, the equivalent of https://slack.com/api/
+        :rtype: str
+        """
+        return 'http://127.0.0.1:{}/api/'.format(self.server.server_address[1])
+
+    def session(self, **kwargs):
+        """ builds a slack session that sends calls meant for slack to the fake instead
+        :param kwargs: any other SlackSession options
+        :return: session to hand to Slacker
+        :rtype: SlackSession
+        """
+        return SlackSession(base_url=self.url, **kwargs)
+
+    def add_messages(self, channel_id, messages):
+        """ adds messages, including thread replies, to a channel
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param messages: messages in dict format
+        :type messages: list(dict)
+        :return: None
+        """
+        channel_messages = self.messages.setdefault(channel_id, [])
+        channel_messages.extend(messages)
+        channel_messages.sort(key=lambda message: float(message['ts']), reverse=True)
+
+    def add_file(self, name, data):
+        """ serves the passed in bytes the way slack serves uploaded files
+        :param name: name of the file in its url
+        :type name: str
+        :param data: the file's content
+        :type data: bytes
+        :return: url to download the file from
+        :rtype: str
+        """
+        self.files[name] = data
+        return 'http://127.0.0.1:{}/files/{}'.format(self.server.server_address[1], name)
+
+    def queue_error(self, method, status, headers=None):
+        """ makes the next call to the method fail with the passed in http status
+        :param method: slack api method name
+        :type method: str
+        :param status: http status to answer with, e.g. 429
+        :type status: int
+        :param headers: headers to send with the error, e.g. Retry-After
+        :type headers: dict
+        :return: None
+        """
+        with self.lock:
+            self.errors.setdefault(method, []).append((status, headers or {}))
+
+    def _handle(self, request, params):
+        """ answers a single http request
+        :param request: the request handler
+        :type request: BaseHTTPRequestHandler
+        :param params: query string and form parameters
+        :type params: dict
+        :return: None
+        """
+        path = urlsplit(request.path).path
+        if path.startswith('/files/'):
+            self._serve_file(request, path[len('/files/'):])
+            return
+        method = path[len('/api/'):] if path.startswith('/api/') else path
+        with self.lock:
+            self.calls[method] += 1
+            queued = self.errors.get(method)
+            error = queued.pop(0) if queued else None
+        if error:
+            status, headers = error
+            self._respond(request, status, {'ok': False, 'error': 'http_{}'.format(status)}, headers)
+            return
+
+        handler = getattr(self, 'api_' + method.replace('.', '_'), None)
+        if handler is None:
+            self._respond(request, 200, {'ok': False, 'error': 'unknown_method'})
+            return
+        self._respond(request, 200, handler(params))
+
+    def _respond(self, request, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, str(value))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _serve_file(self, request, name):
+        """ answers a file download, honouring a Range header asking for the rest of the file
+        :param request: the request handler
+        :type request: BaseHTTPRequestHandler
+        :param name: name of the file in its url
+        :type name: str
+        :return: None
+        """
+        with self.lock:
+            self.calls['files'] += 1
+            self.ranges.append(request.headers.get('Range'))
+            queued = self.errors.get('files')
+            error = queued.pop(0) if queued else None
+        if error or name not in self.files:
+            status, headers = error or (404, {})
+            self._respond(request, status, {'ok': False, 'error': 'http_{}'.format(status)}, headers)
+            return
+        data = self.files[name]
+        match = re.match(r'bytes=(\d+)-$', request.headers.get('Range') or '')
+        start = int(match.group(1)) if match else 0
+        if start and start >= len(data):
+            # nothing of the file is left from there on
+            request.send_response(416)
+            request.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        request.send_response(206 if match else 200)
+        request.send_header('Content-Type', 'application/octet-stream')
+        request.send_header('Content-Length', str(len(data) - start))
+        if match:
+            request.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)))
+        request.end_headers()
+        request.wfile.write(data[start:])
+
+    def _page(self, items, params, key):
+        """ cuts one cursor paginated page out of the passed in items
+        :param items: everything the call could return
+        :type items: list
+        :param params: call parameters holding the cursor and limit
+        :type params: dict
+        :param key: name of the list in the response body
+        :type key: str
+        :return: response body
+        :rtype: dict
+        """
+        offset = int(base64.b64decode(params['cursor']).decode('utf-8')) if params.get('cursor') else 0
+        limit = min(int(params.get('limit') or 100), MAX_LIMIT)
+        next_offset = offset + limit
+        next_cursor = ''
+        if next_offset < len(items):
+            next_cursor = base64.b64encode(str(next_offset).encode('utf-8')).decode('utf-8')
+        return {'ok': True, key: items[offset:next_offset], 'has_more': bool(next_cursor),
+                'response_metadata': {'next_cursor': next_cursor}}
+
+    def api_team_info(self, params):
+        return {'ok': True, 'team': self.team}
+
+    def api_users_list(self, params):
+        return self._page(self.users, params, 'members')
+
+    def api_conversations_list(self, params):
+        types = set((params.get('types') or 'public_channel').split(','))
+        matches = [conversation for conversation in self.conversations if conversation_type(conversation) in types]
+        if params.get('exclude_archived') in ('1', 'true', 'True'):
+            matches = [conversation for conversation in matches if not conversation.get('is_archived')]
+        return self._page(matches, params, 'channels')
+
+    def api_conversations_history(self, params):
+        if params.get('channel') not in self.messages:
+            return {'ok': False, 'error': 'channel_not_found'}
+        inclusive = params.get('inclusive') in ('1', 'true', 'True')
+        oldest = float(params.get('oldest') or 0)
+        latest = float(params['latest']) if params.get('latest') else None
+        history = []
+        for message in self.messages[params['channel']]:
+            ts = float(message['ts'])
+            # thread replies only show up through conversations.replies, unless they're broadcast to the channel
+            is_reply = message.get('thread_ts', message['ts']) != message['ts']
+            if is_reply and message.get('subtype') != 'thread_broadcast':
+                continue
+            if ts < oldest or (ts == oldest and not inclusive):
+                continue
+            if latest is not None and (ts > latest or (ts == latest and not inclusive)):
+                continue
+            history.append(message)
+        return self._page(history, params, 'messages')
+
+    def api_conversations_replies(self, params):
+        if params.get('channel') not in self.messages:
+            return {'ok': False, 'error': 'channel_not_found'}
+        oldest = float(params.get('oldest') or 0)
+        thread = [message for message in reversed(self.messages[params['channel']])
+                  if message.get('thread_ts') == params.get('ts') and
+                  (message['ts'] == params.get('ts') or float(message['ts']) > oldest)]
+        if not thread:
+            return {'ok': False, 'error': 'thread_not_found'}
+        return self._page(thread, params, 'messages')
+
+
+def conversation_type(conversation):
+    """ works out which conversations.list type the passed in conversation is
+    :param conversation: conversation properties
+    :type conversation: dict
+    :return: one of public_channel, private_channel, mpim or im
+    :rtype: str
+    """
+    if conversation.get('is_im'):
+        return 'im'
+    if conversation.get('is_mpim'):
+        return 'mpim'
+    if conversation.get('is_private') or conversation.get('is_group'):
+        return 'private_channel'
+    return 'public_channel'
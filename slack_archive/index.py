@@ -0,0 +1,279 @@
+import os
+import re
+import sqlite3
+import threading
+from slack_archive import storage
+from slack_archive.state import ALIASES_FILE, ChannelAliases
+
+# kept inside the archive folder as a dotfile so packaging skips it, it can always be rebuilt from the day files
+INDEX_FILE = '.index.sqlite3'
+
+CHANNEL_FILES = ('channels.json', 'groups.json', 'dms.json')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    channel_id TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    ts_num REAL NOT NULL,
+    user TEXT,
+    thread_ts TEXT,
+    date TEXT NOT NULL,
+    day_file TEXT NOT NULL,
+    PRIMARY KEY (channel_id, ts)
+);
+CREATE INDEX IF NOT EXISTS messages_channel_date ON messages (channel_id, date);
+CREATE INDEX IF NOT EXISTS messages_user ON messages (user, ts_num);
+CREATE INDEX IF NOT EXISTS messages_thread ON messages (channel_id, thread_ts);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    ts_list TEXT NOT NULL,
+    PRIMARY KEY (term, channel_id, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_channel_date ON postings (channel_id, date);
+"""
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def index_path(archive_folder):
+    """ gets the path of the passed in archive's message index
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :return: path to the index
+    :rtype: str
+    """
+    return os.path.join(archive_folder, INDEX_FILE)
+
+
+def tokenize(text):
+    """ splits message text into the lower case terms it's searchable by
+    :param text: message text
+    :type text: str
+    :return: the distinct terms
+    :rtype: set(str)
+    """
+    return set(TOKEN_PATTERN.findall((text or '').lower()))
+
+
+def archived_conversations(archive_folder):
+    """ loads the conversations listed in the archive's top level channel files
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :return: conversation properties
+    :rtype: list(dict)
+    """
+    conversations = []
+    for file_name in CHANNEL_FILES:
+        path = os.path.join(archive_folder, file_name)
+        if os.path.exists(path):
+            conversations.extend(storage.read_records(path))
+    return conversations
+
+
+def channel_ids(archive_folder):
+    """ maps the archive's channel ids, current names and past names from its alias map to the channel ids
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :return: id or name mapped to channel id
+    :rtype: dict
+    """
+    ids = dict(ChannelAliases(os.path.join(archive_folder, ALIASES_FILE)).data)
+    for conversation in archived_conversations(archive_folder):
+        if conversation.get('name'):
+            ids[conversation['name']] = conversation['id']
+    for channel_id in set(ids.values()):
+        ids[channel_id] = channel_id
+    return ids
+
+
+class MessageIndex:
+    """ sqlite index of every archived message's channel, ts, user and thread, pointing back to the day file
+        holding it, so lookups don't have to open every day file of a channel. Alongside it is an inverted index
+        of message text, holding a posting list of ts for every term in each channel's day
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ closes the database
+        :return: None
+        """
+        with self.lock:
+            self.connection.close()
+
+    def replace_day(self, channel_id, date, day_file, messages):
+        """ replaces everything indexed for the channel's day with the passed in messages, in one transaction
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param date: the day in YYYY-MM-DD format
+        :type date: str
+        :param day_file: path to the file the day is saved in
+        :type day_file: str
+        :param messages: every message of the day in dict format
+        :type messages: iterable(dict)
+        :return: None
+        """
+        relative_path = os.path.relpath(os.path.abspath(day_file), self.root).replace(os.sep, '/')
+        rows = []
+        postings = {}
+        for message in messages:
+            rows.append((channel_id, message['ts'], float(message['ts']), message.get('user'),
+                         message.get('thread_ts'), date, relative_path))
+            for term in tokenize(message.get('text')):
+                postings.setdefault(term, []).append(message['ts'])
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM messages WHERE channel_id = ? AND date = ?', (channel_id, date))
+            self.connection.executemany('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.execute('DELETE FROM postings WHERE channel_id = ? AND date = ?', (channel_id, date))
+            self.connection.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                                        [(term, channel_id, date, ' '.join(ts_list))
+                                         for term, ts_list in postings.items()])
+
+    def index_file(self, channel_id, day_file):
+        """ reads a day file and indexes its messages
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param day_file: path to the day file
+        :type day_file: str
+        :return: number of messages indexed
+        :rtype: int
+        """
+        messages = storage.read_records(day_file)
+        self.replace_day(channel_id, storage.split_day_path(day_file)[0], day_file, messages)
+        return len(messages)
+
+    def rebuild(self, archive_folder):
+        """ drops the index and indexes every day file of the archive again
+        :param archive_folder: path to the archive folder
+        :type archive_folder: str
+        :return: number of messages indexed
+        :rtype: int
+        """
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM messages')
+            self.connection.execute('DELETE FROM postings')
+        indexed = 0
+        # folders are named by channel id, but archives from before then are still named by channel name
+        for name, channel_id in sorted(channel_ids(archive_folder).items()):
+            channel_path = os.path.join(archive_folder, name)
+            if not os.path.isdir(channel_path):
+                continue
+            for _, file_name in sorted(storage.list_day_files(channel_path).items()):
+                indexed += self.index_file(channel_id, os.path.join(channel_path, file_name))
+        return indexed
+
+    def query(self, channel_id=None, user=None, start=None, end=None, thread_ts=None, limit=None):
+        """ looks up the messages matching every passed in filter, oldest first
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param user: slack user id of the author
+        :type user: str
+        :param start: first day to include in YYYY-MM-DD format
+        :type start: str
+        :param end: day to stop before in YYYY-MM-DD format
+        :type end: str
+        :param thread_ts: ts of the thread's parent message
+        :type thread_ts: str
+        :param limit: most rows to return
+        :type limit: int
+        :return: rows with the channel_id, ts, user, thread_ts, date and day_file of each message
+        :rtype: list(dict)
+        """
+        filters = [('channel_id = ?', channel_id), ('user = ?', user), ('date >= ?', start), ('date < ?', end),
+                   ('thread_ts = ?', thread_ts)]
+        clauses = [clause for clause, value in filters if value is not None]
+        sql = 'SELECT channel_id, ts, user, thread_ts, date, day_file FROM messages'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY ts_num'
+        params = [value for _, value in filters if value is not None]
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def search(self, text, channel_id=None, start=None, end=None, limit=None):
+        """ finds the messages containing every term of the passed in text, using only the posting lists
+        :param text: terms to search for
+        :type text: str
+        :param channel_id: slack channel id to search in
+        :type channel_id: str
+        :param start: first day to include in YYYY-MM-DD format
+        :type start: str
+        :param end: day to stop before in YYYY-MM-DD format
+        :type end: str
+        :param limit: most hits to return
+        :type limit: int
+        :return: the channel_id, date and ts of each hit, oldest first
+        :rtype: list(dict)
+        """
+        terms = tokenize(text)
+        if not terms:
+            return []
+        filters = [('channel_id = ?', channel_id), ('date >= ?', start), ('date < ?', end)]
+        clauses = ['term = ?'] + [clause for clause, value in filters if value is not None]
+        sql = 'SELECT channel_id, date, ts_list FROM postings WHERE ' + ' AND '.join(clauses)
+        hits = None
+        with self.lock:
+            # start from the rarest term so every later term only has to narrow a small set of days
+            counts = {term: self.connection.execute('SELECT COUNT(*) FROM postings WHERE term = ?', (term,))
+                      .fetchone()[0] for term in terms}
+            for term in sorted(terms, key=counts.get):
+                params = [term] + [value for _, value in filters if value is not None]
+                found = {}
+                for row in self.connection.execute(sql, params):
+                    day = (row['channel_id'], row['date'])
+                    ts_set = set(row['ts_list'].split(' '))
+                    if hits is not None:
+                        ts_set &= hits.get(day, set())
+                    if ts_set:
+                        found[day] = ts_set
+                hits = found
+                if not hits:
+                    return []
+        results = sorted(({'channel_id': channel_id, 'date': date, 'ts': ts}
+                          for (channel_id, date), ts_set in hits.items() for ts in ts_set),
+                         key=lambda hit: float(hit['ts']))
+        return results[:limit] if limit is not None else results
+
+    def load_messages(self, rows):
+        """ reads the messages the passed in rows point to, opening each day file only once
+        :param rows: rows returned by query
+        :type rows: list(dict)
+        :return: the messages in dict format, in the order of the rows
+        :rtype: list(dict)
+        """
+        day_files = {}
+        for row in rows:
+            if row['day_file'] not in day_files:
+                path = os.path.join(self.root, row['day_file'])
+                day_files[row['day_file']] = {message['ts']: message for message in storage.iter_records(path)}
+        return [day_files[row['day_file']].get(row['ts']) for row in rows]
+
+
+def format_row(row):
+    """ formats a query row as a tab separated line for the command line
+    :param row: row returned by query
+    :type row: dict
+    :return: line of text
+    :rtype: str
+    """
+    return '\t'.join([row['channel_id'], row['date'], row['ts'], row['user'] or '', row['day_file']])
+
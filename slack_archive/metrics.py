@@ -0,0 +1,239 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+PROMETHEUS_PREFIX = 'slack_archive'
+
+
+class RunMetrics:
+    """ collects what a run spent its time on: the phases of the run, counters such as pages fetched and bytes
+        written, and any timers callers add of their own
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ forgets everything collected so far and starts the run's clock again
+        :return: None
+        """
+        with self.lock:
+            self.started = datetime.utcnow()
+            self.start_time = self.clock()
+            self.phases = {}
+            self.timers = {}
+            self.counters = {}
+
+    def _add(self, table, name, seconds):
+        """ adds a timing to the phase or timer of the passed in name
+        :param table: the phases or timers
+        :type table: dict
+        :param name: name of the phase or timer
+        :type name: str
+        :param seconds: the time
+        :type seconds: float
+        :return: None
+        """
+        with self.lock:
+            entry = table.setdefault(name, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += seconds
+            entry['count'] += 1
+
+    @contextmanager
+    def phase(self, name):
+        """ times one of the run's phases, e.g. bootstrap, download, merge or zip
+        :param name: name of the phase
+        :type name: str
+        """
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self._add(self.phases, name, self.clock() - started)
+
+    @contextmanager
+    def timer(self, name):
+        """ times a block of code under the passed in name, for callers adding their own timers
+        :param name: name of the timer
+        :type name: str
+        """
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self._add(self.timers, name, self.clock() - started)
+
+    def timed(self, name):
+        """ decorator timing every call of the function under the passed in name
+        :param name: name of the timer
+        :type name: str
+        :return: the decorator
+        :rtype: callable
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_time(self, name, seconds):
+        """ records time measured elsewhere against a timer
+        :param name: name of the timer
+        :type name: str
+        :param seconds: the time
+        :type seconds: float
+        :return: None
+        """
+        self._add(self.timers, name, seconds)
+
+    def count(self, name, amount=1, label=None):
+        """ adds to a counter, e.g. pages fetched or bytes written
+        :param name: name of the counter
+        :type name: str
+        :param amount: amount to add
+        :type amount: int or float
+        :param label: what the amount is broken down by, e.g. the api method the page was fetched with
+        :type label: str
+        :return: None
+        """
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[label or ''] = counter.get(label or '', 0) + amount
+
+    def total(self, name):
+        """ gets the sum of a counter over all its labels
+        :param name: name of the counter
+        :type name: str
+        :rtype: int or float
+        """
+        with self.lock:
+            return sum(self.counters.get(name, {}).values())
+
+    def report(self, session=None, rate_limiter=None):
+        """ builds the run report
+        :param session: session the run's api calls went through, for their calls and latency by method
+        :type session: SlackSession
+        :param rate_limiter: rate limiter the run's api calls were paced by, for the time spent throttled
+        :type rate_limiter: RateLimiter
+        :return: the report
+        :rtype: dict
+        """
+        with self.lock:
+            report = {
+                'started': self.started.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'seconds': self.clock() - self.start_time,
+                'phases': {name: dict(entry) for name, entry in self.phases.items()},
+                'timers': {name: dict(entry) for name, entry in self.timers.items()},
+                'counters': {name: dict(counter) for name, counter in self.counters.items()},
+            }
+        report['api'] = session.report() if session is not None else {}
+        throttled = rate_limiter.report() if rate_limiter is not None else {}
+        report['throttled'] = {method: stats['throttled'] for method, stats in throttled.items()}
+        report['throttled_seconds'] = sum(report['throttled'].values())
+        return report
+
+
+def _write_atomic(text, path):
+    """ writes the text to a temporary file and renames it over the path, so readers such as the prometheus node
+        exporter never see half a file
+    :param text: text to write
+    :type text: str
+    :param path: path of the file
+    :type path: str
+    :return: None
+    """
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.metrics-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as write_file:
+            write_file.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_json_report(report, path):
+    """ saves the run report as json
+    :param report: report from RunMetrics.report
+    :type report: dict
+    :param path: path of the file
+    :type path: str
+    :return: None
+    """
+    _write_atomic(json.dumps(report, indent=4, sort_keys=True), path)
+
+
+def _metric_name(name):
+    """ builds a valid prometheus metric name
+    :param name: name of the metric without the project prefix
+    :type name: str
+    :rtype: str
+    """
+    return '{}_{}'.format(PROMETHEUS_PREFIX, ''.join(char if char.isalnum() else '_' for char in name))
+
+
+def _escape(value):
+    """ escapes a prometheus label value
+    :param value: the value
+    :rtype: str
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(report):
+    """ formats the run report in the prometheus text exposition format
+    :param report: report from RunMetrics.report
+    :type report: dict
+    :return: the metrics
+    :rtype: str
+    """
+    lines = []
+
+    def metric(name, kind, samples):
+        lines.append('# TYPE {} {}'.format(_metric_name(name), kind))
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(key, _escape(label)) for key, label in labels if label != '')
+            lines.append('{}{} {}'.format(_metric_name(name), '{' + label_text + '}' if label_text else '', value))
+
+    metric('run_seconds', 'gauge', [((), report['seconds'])])
+    metric('phase_seconds', 'gauge', [((('phase', name),), entry['seconds'])
+                                      for name, entry in sorted(report['phases'].items())])
+    metric('timer_seconds', 'gauge', [((('timer', name),), entry['seconds'])
+                                      for name, entry in sorted(report['timers'].items())])
+    metric('timer_calls', 'gauge', [((('timer', name),), entry['count'])
+                                    for name, entry in sorted(report['timers'].items())])
+    for name, counter in sorted(report['counters'].items()):
+        metric(name, 'gauge', [((('label', label),), value) for label, value in sorted(counter.items())])
+    for key in ('calls', 'retries', 'errors', 'seconds', 'max_seconds'):
+        metric('api_' + key, 'gauge', [((('method', method),), stats[key])
+                                       for method, stats in sorted(report['api'].items())])
+    metric('throttled_seconds', 'gauge', [((('method', method),), seconds)
+                                          for method, seconds in sorted(report['throttled'].items())])
+    metric('last_run_timestamp_seconds', 'gauge', [((), int(time.time()))])
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(report, path):
+    """ saves the run report for the prometheus node exporter's textfile collector
+    :param report: report from RunMetrics.report
+    :type report: dict
+    :param path: path of the .prom file
+    :type path: str
+    :return: None
+    """
+    _write_atomic(prometheus_text(report), path)
+
+
+# shared across the project so every stage of a run counts into the same report
+metrics = RunMetrics()
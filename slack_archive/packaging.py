@@ -0,0 +1,156 @@
+import json
+import os
+import zipfile
+from slack_archive import checksums
+
+# rebuild the full zip once this many deltas have piled up so restoring never replays too many
+MAX_DELTAS = 30
+
+DELTA_MANIFEST = 'delta_manifest.json'
+
+
+def _manifest_path(base_name):
+    """ gets the path of the manifest recording what has been packaged
+    :param base_name: path of the package without the .zip extension
+    :type base_name: str
+    :return: path to the manifest
+    :rtype: str
+    """
+    return '{}.manifest.json'.format(base_name)
+
+
+def load_manifest(base_name):
+    """ loads the manifest of the passed in package, starting empty if it has never been packaged
+    :param base_name: path of the package without the .zip extension
+    :type base_name: str
+    :return: the manifest
+    :rtype: dict
+    """
+    try:
+        with open(_manifest_path(base_name)) as read_file:
+            return json.load(read_file)
+    except FileNotFoundError:
+        return {'files': {}, 'deltas': []}
+
+
+def _save_manifest(base_name, manifest):
+    """ writes the manifest, replacing the old one in a single rename
+    :param base_name: path of the package without the .zip extension
+    :type base_name: str
+    :param manifest: the manifest
+    :type manifest: dict
+    :return: None
+    """
+    temp_path = _manifest_path(base_name) + '.tmp'
+    with open(temp_path, 'w') as write_file:
+        json.dump(manifest, write_file, indent=4, sort_keys=True)
+    os.replace(temp_path, _manifest_path(base_name))
+
+
+def scan_folder(folder):
+    """ stats every file under the passed in folder. Dotfiles are left out as they're temporary or partial
+        files, apart from the channels' checksum manifests, so a restored archive still verifies
+    :param folder: folder to scan
+    :type folder: str
+    :return: path relative to the folder mapped to the file's size and modified time in nanoseconds
+    :rtype: dict
+    """
+    files = {}
+    stack = [folder]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and (not entry.name.startswith('.') or
+                                                               entry.name == checksums.MANIFEST_FILE):
+                    stat = entry.stat(follow_symlinks=False)
+                    relative_path = os.path.relpath(entry.path, folder).replace(os.sep, '/')
+                    files[relative_path] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def _write_zip(zip_path, folder, members, delta_manifest=None):
+    """ zips the passed in members of the folder, writing to a temporary file first so a crash never leaves a
+        truncated zip with the final name
+    :param zip_path: path of the zip to write
+    :type zip_path: str
+    :param folder: folder the members are relative to
+    :type folder: str
+    :param members: paths relative to the folder to add
+    :type members: list(str)
+    :param delta_manifest: description of the delta to store alongside the members
+    :type delta_manifest: dict
+    :return: None
+    """
+    temp_path = zip_path + '.tmp'
+    with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for member in members:
+            zip_file.write(os.path.join(folder, member), member)
+        if delta_manifest is not None:
+            zip_file.writestr(DELTA_MANIFEST, json.dumps(delta_manifest, indent=4))
+    os.replace(temp_path, zip_path)
+
+
+def package_archive(folder, base_name=None, max_deltas=MAX_DELTAS):
+    """ packages the archive folder incrementally. The first run zips everything to {base_name}.zip, after which
+        each run only zips the files that were added or changed since the last package into the next
+        {base_name}-delta-NNNN.zip, along with a list of the files that were deleted
+    :param folder: the archive folder
+    :type folder: str
+    :param base_name: path of the package without the .zip extension, defaults to the folder's path
+    :type base_name: str
+    :param max_deltas: number of deltas to allow before rebuilding the full zip
+    :type max_deltas: int
+    :return: path of the zip that was written, None if nothing changed
+    :rtype: str
+    """
+    base_name = base_name or folder.rstrip('/\\')
+    manifest = load_manifest(base_name)
+    current = scan_folder(folder)
+    full_zip = '{}.zip'.format(base_name)
+
+    # zips made before the manifest existed can't be diffed against, so start again from a full zip
+    if not os.path.exists(full_zip) or not manifest['files'] or len(manifest['deltas']) >= max_deltas:
+        _write_zip(full_zip, folder, sorted(current))
+        for delta in manifest['deltas']:
+            delta_path = os.path.join(os.path.dirname(base_name), delta)
+            if os.path.exists(delta_path):
+                os.remove(delta_path)
+        _save_manifest(base_name, {'files': current, 'deltas': []})
+        return full_zip
+
+    changed = sorted(path for path, stat in current.items() if manifest['files'].get(path) != stat)
+    deleted = sorted(path for path in manifest['files'] if path not in current)
+    if not changed and not deleted:
+        return None
+
+    sequence = len(manifest['deltas']) + 1
+    delta_zip = '{}-delta-{:04d}.zip'.format(base_name, sequence)
+    _write_zip(delta_zip, folder, changed,
+               {'base': os.path.basename(full_zip), 'sequence': sequence, 'changed': changed, 'deleted': deleted})
+    manifest['files'] = current
+    manifest['deltas'].append(os.path.basename(delta_zip))
+    _save_manifest(base_name, manifest)
+    return delta_zip
+
+
+def unpack_archive(base_name, destination):
+    """ rebuilds the archive folder from the full zip and every delta after it
+    :param base_name: path of the package without the .zip extension
+    :type base_name: str
+    :param destination: folder to unpack to
+    :type destination: str
+    :return: None
+    """
+    with zipfile.ZipFile('{}.zip'.format(base_name)) as zip_file:
+        zip_file.extractall(destination)
+    for delta in load_manifest(base_name)['deltas']:
+        with zipfile.ZipFile(os.path.join(os.path.dirname(base_name), delta)) as zip_file:
+            delta_manifest = json.loads(zip_file.read(DELTA_MANIFEST))
+            for member in delta_manifest['changed']:
+                zip_file.extract(member, destination)
+        for member in delta_manifest['deleted']:
+            path = os.path.join(destination, member)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,161 @@
+import threading
+import time
+import requests
+
+# Slack's documented per-method budgets in calls per minute, with the burst each bucket allows
+# https://api.slack.com/docs/rate-limits
+TIERS = {
+    1: (1, 1),
+    2: (20, 3),
+    3: (50, 5),
+    4: (100, 10),
+}
+
+METHOD_TIERS = {
+    'team.info': 3,
+    'users.list': 2,
+    'channels.list': 2,
+    'groups.list': 2,
+    'conversations.list': 2,
+    'channels.history': 3,
+    'groups.history': 3,
+    'conversations.history': 3,
+    'conversations.replies': 3,
+    'conversations.info': 3,
+}
+
+DEFAULT_TIER = 3
+
+# seconds to wait after a 429 if Slack doesn't send a Retry-After header
+DEFAULT_RETRY_AFTER = 20
+DEFAULT_RETRIES = 5
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ takes a token from the bucket, going into debt if it is empty
+        :return: seconds the caller has to wait before using the token
+        :rtype: float
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        """ stops the bucket handing out usable tokens for the given number of seconds
+        :param seconds: how long Slack asked us to back off for
+        :type seconds: float
+        :return: None
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    def __init__(self, tiers=None, method_tiers=None, retries=DEFAULT_RETRIES, sleep=time.sleep,
+                 clock=time.monotonic):
+        self.tiers = dict(TIERS)
+        self.tiers.update(tiers or {})
+        self.method_tiers = dict(METHOD_TIERS)
+        self.method_tiers.update(method_tiers or {})
+        self.retries = retries
+        self.sleep = sleep
+        self.clock = clock
+        self.buckets = {}
+        self.calls = {}
+        self.throttled = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, method):
+        """ gets the token bucket for the passed in method, sized to its tier's budget
+        :param method: slack api method name, e.g. conversations.history
+        :type method: str
+        :return: the method's bucket
+        :rtype: TokenBucket
+        """
+        with self.lock:
+            if method not in self.buckets:
+                per_minute, burst = self.tiers[self.method_tiers.get(method, DEFAULT_TIER)]
+                self.buckets[method] = TokenBucket(per_minute, burst, self.clock)
+            return self.buckets[method]
+
+    def _throttle(self, method, seconds):
+        """ sleeps for the passed in time and records it against the method
+        :param method: slack api method name
+        :type method: str
+        :param seconds: seconds to sleep
+        :type seconds: float
+        :return: None
+        """
+        if seconds <= 0:
+            return
+        with self.lock:
+            self.throttled[method] = self.throttled.get(method, 0.0) + seconds
+        self.sleep(seconds)
+
+    def wait(self, method):
+        """ blocks until the method's budget allows another call
+        :param method: slack api method name
+        :type method: str
+        :return: None
+        """
+        self._throttle(method, self._bucket(method).reserve())
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def call(self, method, func, *args, **kwargs):
+        """ calls the passed in slack function once its method's budget allows it, backing off and retrying
+            whenever slack answers with HTTP 429
+        :param method: slack api method name the function calls
+        :type method: str
+        :param func: function making the api call
+        :type func: callable
+        :return: whatever the function returns
+        """
+        attempt = 0
+        while True:
+            self.wait(method)
+            try:
+                return func(*args, **kwargs)
+            except requests.HTTPError as error:
+                response = error.response
+                if response is None or response.status_code != 429 or attempt >= self.retries:
+                    raise
+                attempt += 1
+                retry_after = float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+                self._bucket(method).block(retry_after)
+
+    @property
+    def throttled_time(self):
+        """ total seconds spent waiting on the rate limit
+        :rtype: float
+        """
+        with self.lock:
+            return sum(self.throttled.values())
+
+    def report(self):
+        """ summarises the calls made and time spent throttled for every method
+        :return: method name mapped to its call count and throttled seconds
+        :rtype: dict
+        """
+        with self.lock:
+            return {method: {'calls': self.calls.get(method, 0), 'throttled': self.throttled.get(method, 0.0)}
+                    for method in sorted(set(self.calls) | set(self.throttled))}
+
+
+# shared across the project so every caller draws from the same budget
+limiter = RateLimiter()
@@ -0,0 +1,143 @@
+import os
+from datetime import datetime, timedelta
+from slack_archive import storage
+from slack_archive.index import channel_ids
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _bound(value):
+    """ converts a bound of a time range to the day it falls on and its time in epoch seconds
+    :param value: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds, None for no bound
+    :type value: str or datetime or float
+    :return: the day in YYYY-MM-DD format and the epoch seconds, both None for no bound
+    :rtype: tuple(str, float)
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d')
+    elif not isinstance(value, datetime):
+        value = datetime.utcfromtimestamp(float(value))
+    return '{:%Y-%m-%d}'.format(value), (value - EPOCH).total_seconds()
+
+
+def _end_day(value):
+    """ works out the day to stop listing day files before for the end of a time range
+    :param value: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds, None for no bound
+    :type value: str or datetime or float
+    :return: the day in YYYY-MM-DD format, None for no bound
+    :rtype: str
+    """
+    day, seconds = _bound(value)
+    if day is None or seconds % 86400 == 0:
+        return day
+    # the range ends part way through the day, so the day's file is still needed
+    return '{:%Y-%m-%d}'.format(datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1))
+
+
+def channel_folders(archive_folder, channels=None):
+    """ finds the folders of the passed in channels in the archive
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param channels: channel ids or names, current or past, None for every channel in the archive
+    :type channels: iterable(str)
+    :return: the id and folder of each channel, channels with nothing archived are left out
+    :rtype: list(tuple(str, str))
+    """
+    ids = channel_ids(archive_folder)
+    if channels is None:
+        return [(ids.get(name, name), os.path.join(archive_folder, name)) for name in sorted(os.listdir(archive_folder))
+                if not name.startswith('.') and os.path.isdir(os.path.join(archive_folder, name))]
+    folders = []
+    for channel in channels:
+        channel_id = ids.get(channel, channel)
+        # archives saved before folders were named by id keep them under the channel's name
+        names = [channel_id] + sorted(name for name, alias_id in ids.items() if alias_id == channel_id)
+        path = next((os.path.join(archive_folder, name) for name in names
+                     if os.path.isdir(os.path.join(archive_folder, name))), None)
+        if path is not None:
+            folders.append((channel_id, path))
+    return folders
+
+
+def iter_days(archive_folder, channels=None, start=None, end=None):
+    """ yields the day files of the passed in channels that can hold messages in the time range, oldest first for
+        each channel. Only the day files, and shards, within the range are listed
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param channels: channel ids or names, current or past, None for every channel in the archive
+    :type channels: iterable(str)
+    :param start: start of the range: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds
+    :type start: str or datetime or float
+    :param end: end of the range, not included, in the same forms as start
+    :type end: str or datetime or float
+    :return: generator of the channel id, the day in YYYY-MM-DD format and the path to its file
+    :rtype: generator(tuple(str, str, str))
+    """
+    start_day, end_day = _bound(start)[0], _end_day(end)
+    for channel_id, folder in channel_folders(archive_folder, channels):
+        for date, file_name in sorted(storage.list_day_files(folder, start_day, end_day).items()):
+            yield channel_id, date, os.path.join(folder, file_name)
+
+
+def read_day(path, start=None, end=None, use_mmap=False):
+    """ yields the messages of a day file posted within the time range, a message at a time
+    :param path: path to the day file
+    :type path: str
+    :param start: start of the range: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds
+    :type start: str or datetime or float
+    :param end: end of the range, not included, in the same forms as start
+    :type end: str or datetime or float
+    :param use_mmap: read the file through a memory map rather than buffered reads
+    :type use_mmap: bool
+    :return: generator of messages in dict format
+    :rtype: generator(dict)
+    """
+    start_seconds, end_seconds = _bound(start)[1], _bound(end)[1]
+    for message in storage.iter_records(path, use_mmap):
+        if 'ts' in message:
+            ts = float(message['ts'])
+            if (start_seconds is not None and ts < start_seconds) or (end_seconds is not None and ts >= end_seconds):
+                continue
+        yield message
+
+
+def iter_messages(archive_folder, channels=None, start=None, end=None, use_mmap=False):
+    """ yields the messages of the passed in channels posted within the time range. Messages are streamed out of the
+        day files one at a time, so the whole archive can be read in constant memory
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param channels: channel ids or names, current or past, None for every channel in the archive
+    :type channels: iterable(str)
+    :param start: start of the range: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds
+    :type start: str or datetime or float
+    :param end: end of the range, not included, in the same forms as start
+    :type end: str or datetime or float
+    :param use_mmap: read the day files through memory maps rather than buffered reads
+    :type use_mmap: bool
+    :return: generator of the channel id and the message, in the order they're stored in, oldest first
+    :rtype: generator(tuple(str, dict))
+    """
+    for channel_id, _, path in iter_days(archive_folder, channels, start, end):
+        for message in read_day(path, start, end, use_mmap):
+            yield channel_id, message
+
+
+def iter_channel(archive_folder, channel, start=None, end=None, use_mmap=False):
+    """ yields the messages of one channel posted within the time range, see iter_messages
+    :param archive_folder: path to the archive folder
+    :type archive_folder: str
+    :param channel: channel id or name, current or past
+    :type channel: str
+    :param start: start of the range: a day in YYYY-MM-DD format, a UTC datetime or epoch seconds
+    :type start: str or datetime or float
+    :param end: end of the range, not included, in the same forms as start
+    :type end: str or datetime or float
+    :param use_mmap: read the day files through memory maps rather than buffered reads
+    :type use_mmap: bool
+    :return: generator of messages in dict format
+    :rtype: generator(dict)
+    """
+    for _, message in iter_messages(archive_folder, [channel], start, end, use_mmap):
+        yield message
@@ -0,0 +1,256 @@
+import json
+import os
+import tempfile
+import threading
+
+# channel folders are named by their stable slack id, this file maps every name a channel has had to its id
+ALIASES_FILE = 'aliases.json'
+
+
+class JsonState:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = self._load()
+
+    def _load(self):
+        """ loads the persisted state, starting empty if there is none yet
+        :return: the state
+        :rtype: dict
+        """
+        try:
+            with open(self.path) as read_file:
+                return json.load(read_file)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self):
+        """ writes the state to a temporary file and renames it over the old one, so a crash mid write never
+            leaves a truncated file behind
+        :return: None
+        """
+        folder = os.path.dirname(self.path) or '.'
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.state-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as write_file:
+                json.dump(self.data, write_file, indent=4, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+class CursorIndex(JsonState):
+    """ remembers the ts of the newest message fetched from every channel """
+
+    def get(self, channel_id, default=0):
+        """ gets the newest fetched ts of the passed in channel
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param default: value to return if the channel has never been fetched
+        :type default: float
+        :return: the ts of the newest message already archived for the channel
+        :rtype: str or float
+        """
+        with self.lock:
+            return self.data.get(channel_id, default)
+
+    def update(self, channel_id, ts):
+        """ moves the channel's cursor forward to the passed in ts and persists the index
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param ts: ts of the newest message fetched for the channel
+        :type ts: str
+        :return: None
+        """
+        with self.lock:
+            current = self.data.get(channel_id)
+            if current is not None and float(current) >= float(ts):
+                return
+            self.data[channel_id] = ts
+            self._save()
+
+
+class ThreadState(JsonState):
+    """ remembers the reply_count and latest_reply of every thread as of its last fetch, so threads nobody has
+        replied to since are never fetched again
+    """
+
+    def get(self, channel_id, thread_ts):
+        """ gets the state of the thread as of its last fetch
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param thread_ts: ts of the thread's parent message
+        :type thread_ts: str
+        :return: the thread's reply_count and latest_reply, None if it has never been fetched
+        :rtype: dict
+        """
+        with self.lock:
+            return self.data.get(channel_id, {}).get(thread_ts)
+
+    def changed(self, channel_id, message):
+        """ works out whether the passed in message shows its thread has replies that haven't been fetched yet.
+            Parents carry the thread's reply_count and latest_reply, replies broadcast to the channel carry their
+            own ts
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param message: message from the channel history
+        :type message: dict
+        :return: True if the thread needs fetching
+        :rtype: bool
+        """
+        thread_ts = message.get('thread_ts')
+        if not thread_ts:
+            return False
+        state = self.get(channel_id, thread_ts)
+        if thread_ts == message['ts']:
+            if not message.get('reply_count'):
+                return False
+            return state is None or (state['reply_count'], state['latest_reply']) != \
+                (message['reply_count'], message.get('latest_reply'))
+        return state is None or float(message['ts']) > float(state['latest_reply'])
+
+    def recent(self, channel_id, since=None):
+        """ lists the channel's threads last replied to at or after the passed in time. Replies to them won't show up
+            in the channel's history unless they're broadcast, so they have to be polled
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param since: epoch seconds, None for every thread of the channel
+        :type since: float
+        :return: ts of the parent of each thread, sorted
+        :rtype: list(str)
+        """
+        with self.lock:
+            return sorted(thread_ts for thread_ts, state in self.data.get(channel_id, {}).items()
+                          if since is None or float(state['latest_reply']) >= since)
+
+    def update(self, channel_id, thread_ts, reply_count, latest_reply):
+        """ records the state of the thread once its replies are saved and persists it
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param thread_ts: ts of the thread's parent message
+        :type thread_ts: str
+        :param reply_count: number of replies in the thread
+        :type reply_count: int
+        :param latest_reply: ts of the newest reply
+        :type latest_reply: str
+        :return: None
+        """
+        self.update_threads(channel_id, {thread_ts: (reply_count, latest_reply)})
+
+    def update_threads(self, channel_id, states, since=None):
+        """ records the state of several of the channel's threads once their replies are saved, persisting the
+            state once for all of them
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param states: ts of each thread's parent mapped to its reply_count and latest_reply
+        :type states: dict
+        :param since: epoch seconds, the channel's threads last replied to before this are forgotten. None keeps
+            every thread
+        :type since: float
+        :return: None
+        """
+        with self.lock:
+            channel = self.data.setdefault(channel_id, {})
+            for thread_ts, (reply_count, latest_reply) in states.items():
+                channel[thread_ts] = {'reply_count': reply_count, 'latest_reply': latest_reply}
+            if since is not None:
+                for thread_ts in [thread_ts for thread_ts, state in channel.items()
+                                  if float(state['latest_reply']) < since]:
+                    del channel[thread_ts]
+            if not channel:
+                del self.data[channel_id]
+            self._save()
+
+
+class Checkpoints(JsonState):
+    """ remembers how far back each unfinished channel download has durably saved its history """
+
+    def get(self, channel_id):
+        """ gets the channel's checkpoint
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :return: the oldest ts the download started from, the oldest ts saved so far as latest, the newest ts saved
+            and the threads waiting to be fetched. None if the channel has no unfinished download
+        :rtype: dict
+        """
+        with self.lock:
+            return self.data.get(channel_id)
+
+    def save(self, channel_id, checkpoint):
+        """ records the channel's checkpoint once a page is saved and persists it
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :param checkpoint: the checkpoint, see get
+        :type checkpoint: dict
+        :return: None
+        """
+        with self.lock:
+            self.data[channel_id] = checkpoint
+            self._save()
+
+    def clear(self, channel_id):
+        """ forgets the channel's checkpoint once its download has finished
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :return: None
+        """
+        with self.lock:
+            if self.data.pop(channel_id, None) is not None:
+                self._save()
+
+
+class ChannelAliases(JsonState):
+    """ maps the names every channel has had to its slack id, so renaming a channel only changes the map and
+        never moves the channel's folder. Old names are kept pointing at the channel unless another one takes them
+    """
+
+    def get(self, name, default=None):
+        """ gets the id of the channel with the passed in name, now or in the past
+        :param name: channel name
+        :type name: str
+        :param default: value to return if no channel has had the name
+        :type default: str
+        :return: slack channel id
+        :rtype: str
+        """
+        with self.lock:
+            return self.data.get(name, default)
+
+    def names(self, channel_id):
+        """ gets every name the channel has had
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :return: the names, sorted
+        :rtype: list(str)
+        """
+        with self.lock:
+            return sorted(name for name, alias_id in self.data.items() if alias_id == channel_id)
+
+    def add(self, name, channel_id):
+        """ points the name at the channel and persists the map if it changed
+        :param name: channel name
+        :type name: str
+        :param channel_id: slack channel id
+        :type channel_id: str
+        :return: None
+        """
+        self.update([{'id': channel_id, 'name': name}])
+
+    def update(self, conversations):
+        """ points the current name of each conversation at it and persists the map if anything changed. Ims have
+            no name so are left out
+        :param conversations: conversation properties
+        :type conversations: iterable(dict)
+        :return: None
+        """
+        with self.lock:
+            changed = False
+            for conversation in conversations:
+                name = conversation.get('name')
+                if name and name != conversation['id'] and self.data.get(name) != conversation['id']:
+                    self.data[name] = conversation['id']
+                    changed = True
+            if changed:
+                self._save()
@@ -0,0 +1,617 @@
+import codecs
+import gzip
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from slack_archive import checksums
+from slack_archive.metrics import metrics
+
+# storage format mapped to the extension its day files are saved with
+EXTENSIONS = {
+    'json': '.json',
+    'compact': '.json',
+    'jsonl': '.jsonl',
+    'jsonl.gz': '.jsonl.gz',
+    'jsonl.zst': '.jsonl.zst',
+}
+
+DAY_EXTENSIONS = ('.json', '.jsonl', '.jsonl.gz', '.jsonl.zst')
+
+DEFAULT_FORMAT = 'json'
+
+DAY_PATTERN = re.compile('^([0-9]{4}-[0-9]{2}-[0-9]{2})(\\.json|\\.jsonl|\\.jsonl\\.gz|\\.jsonl\\.zst)$')
+
+# flat keeps every day file of a channel in its folder, sharded keeps them in YYYY/MM subfolders as DD files so
+# channels with years of history are never listed in one go
+LAYOUTS = ('flat', 'sharded')
+
+DEFAULT_LAYOUT = 'flat'
+
+YEAR_PATTERN = re.compile('^[0-9]{4}$')
+
+MONTH_PATTERN = re.compile('^[0-9]{2}$')
+
+# bytes read at a time when streaming the messages out of a json day file
+READ_SIZE = 64 * 1024
+
+WHITESPACE = re.compile('[ \\t\\n\\r]*')
+
+SHARD_PATTERN = re.compile('^([0-9]{2})(\\.json|\\.jsonl|\\.jsonl\\.gz|\\.jsonl\\.zst)$')
+
+
+def split_ext(file_name):
+    """ splits a day file name into its date and extension, understanding the multi part extensions
+    :param file_name: name of the file, e.g. 2019-04-20.jsonl.gz
+    :type file_name: str
+    :return: the date and extension, None if the name isn't a day file
+    :rtype: tuple(str, str)
+    """
+    match = DAY_PATTERN.match(file_name)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+def split_day_path(path):
+    """ splits the path of a day file in either layout into its date and extension
+    :param path: path to the file, e.g. general/2019-04-20.json or general/2019/04/20.json
+    :type path: str
+    :return: the date and extension, None if the path isn't a day file
+    :rtype: tuple(str, str)
+    """
+    file_name = os.path.basename(path)
+    parts = split_ext(file_name)
+    if parts:
+        return parts
+    match = SHARD_PATTERN.match(file_name)
+    if not match:
+        return None
+    month_folder = os.path.dirname(path)
+    year, month = os.path.basename(os.path.dirname(month_folder)), os.path.basename(month_folder)
+    if not YEAR_PATTERN.match(year) or not MONTH_PATTERN.match(month):
+        return None
+    return '{}-{}-{}'.format(year, month, match.group(1)), match.group(2)
+
+
+def day_file_name(date, storage_format=DEFAULT_FORMAT):
+    """ builds the name a day's file is saved under in the passed in format
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param storage_format: one of the keys of EXTENSIONS
+    :type storage_format: str
+    :return: file name
+    :rtype: str
+    """
+    if storage_format not in EXTENSIONS:
+        raise ValueError('Unknown storage format {}'.format(storage_format))
+    return date + EXTENSIONS[storage_format]
+
+
+def day_file_path(date, storage_format=DEFAULT_FORMAT, layout=DEFAULT_LAYOUT):
+    """ builds the path a day's file is saved under in a channel folder
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param storage_format: one of the keys of EXTENSIONS
+    :type storage_format: str
+    :param layout: one of LAYOUTS
+    :type layout: str
+    :return: path relative to the channel folder
+    :rtype: str
+    """
+    if storage_format not in EXTENSIONS:
+        raise ValueError('Unknown storage format {}'.format(storage_format))
+    return _layout_path(date, EXTENSIONS[storage_format], layout)
+
+
+def _layout_path(date, extension, layout):
+    """ builds the path a day's file with the passed in extension has in a layout
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param extension: one of DAY_EXTENSIONS
+    :type extension: str
+    :param layout: one of LAYOUTS
+    :type layout: str
+    :return: path relative to the channel folder
+    :rtype: str
+    """
+    if layout == 'flat':
+        return date + extension
+    if layout == 'sharded':
+        year, month, day = date.split('-')
+        return os.path.join(year, month, day + extension)
+    raise ValueError('Unknown storage layout {}'.format(layout))
+
+
+def _in_range(date, start, end):
+    """ checks whether the day, or the year or month prefix of one, can fall within [start, end)
+    :param date: the day in YYYY-MM-DD format, or its YYYY or YYYY-MM prefix
+    :type date: str
+    :param start: first day to include in YYYY-MM-DD format, None for no lower bound
+    :type start: str
+    :param end: day to stop before in YYYY-MM-DD format, None for no upper bound
+    :type end: str
+    :rtype: bool
+    """
+    if start is not None and date < start[:len(date)]:
+        return False
+    if end is not None and date >= end[:len(date)]:
+        # a year or month holding the end day still holds the days before it
+        return len(date) < len(end) and date == end[:len(date)]
+    return True
+
+
+def list_day_files(folder_path, start=None, end=None):
+    """ lists the day files in a channel folder, whatever format and layout they're stored in. Shards outside the
+        date range aren't listed at all
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param start: first day to include in YYYY-MM-DD format, None for no lower bound
+    :type start: str
+    :param end: day to stop before in YYYY-MM-DD format, None for no upper bound
+    :type end: str
+    :return: date mapped to the path of the file holding that day, relative to the channel folder
+    :rtype: dict
+    """
+    days = {}
+    years = []
+    for file_name in os.listdir(folder_path):
+        parts = split_ext(file_name)
+        if parts:
+            if _in_range(parts[0], start, end):
+                days[parts[0]] = file_name
+        elif YEAR_PATTERN.match(file_name) and _in_range(file_name, start, end):
+            years.append(file_name)
+    for year in years:
+        year_path = os.path.join(folder_path, year)
+        if not os.path.isdir(year_path):
+            continue
+        for month in os.listdir(year_path):
+            if not MONTH_PATTERN.match(month) or not _in_range('{}-{}'.format(year, month), start, end):
+                continue
+            for file_name in os.listdir(os.path.join(year_path, month)):
+                match = SHARD_PATTERN.match(file_name)
+                date = '{}-{}-{}'.format(year, month, match.group(1)) if match else None
+                if date and _in_range(date, start, end):
+                    days[date] = os.path.join(year, month, file_name)
+    return days
+
+
+def latest_day(folder_path):
+    """ finds the newest day with a file in a channel folder. Only the newest shards are listed
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :return: the day in YYYY-MM-DD format, None if the folder has no day files
+    :rtype: str
+    """
+    file_names = os.listdir(folder_path)
+    latest = max((parts[0] for parts in map(split_ext, file_names) if parts), default=None)
+    for year in sorted((i for i in file_names if YEAR_PATTERN.match(i)), reverse=True):
+        if latest is not None and year < latest[:4]:
+            break
+        year_path = os.path.join(folder_path, year)
+        if not os.path.isdir(year_path):
+            continue
+        for month in sorted((i for i in os.listdir(year_path) if MONTH_PATTERN.match(i)), reverse=True):
+            days = [match.group(1) for match in map(SHARD_PATTERN.match, os.listdir(os.path.join(year_path, month)))
+                    if match]
+            if days:
+                return max(latest or '', '{}-{}-{}'.format(year, month, max(days)))
+    return latest
+
+
+def find_day_file(folder_path, date):
+    """ finds the file holding the passed in day in a channel folder, whatever format and layout it's stored in
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :return: path to the file, None if the day has no file
+    :rtype: str
+    """
+    for layout in LAYOUTS:
+        for extension in DAY_EXTENSIONS:
+            path = os.path.join(folder_path, _layout_path(date, extension, layout))
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImportError('the zstandard package is needed for the jsonl.zst storage format')
+    return zstandard
+
+
+def _open_read(path):
+    """ opens a day file for reading text, decompressing it if needed
+    :param path: path to the file
+    :type path: str
+    :return: text file object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        raw = open(path, 'rb')
+        return io.TextIOWrapper(_zstandard().ZstdDecompressor().stream_reader(raw, closefd=True), encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+@contextmanager
+def _open_binary(path, use_mmap=False):
+    """ opens a day file for reading bytes, decompressing it if needed
+    :param path: path to the file
+    :type path: str
+    :param use_mmap: read the file through a memory map rather than buffered reads
+    :type use_mmap: bool
+    :return: binary file object with read and readline
+    """
+    with ExitStack() as stack:
+        raw = stack.enter_context(open(path, 'rb'))
+        # empty files can't be mapped
+        if use_mmap and os.fstat(raw.fileno()).st_size:
+            raw = stack.enter_context(mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ))
+        if path.endswith('.gz'):
+            raw = stack.enter_context(gzip.GzipFile(fileobj=raw, mode='rb'))
+        elif path.endswith('.zst'):
+            raw = stack.enter_context(io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(raw)))
+        yield raw
+
+
+def _iter_json_array(read_file, read_size=READ_SIZE):
+    """ yields the values of a json array a value at a time, reading no more of the file than the value being parsed
+    :param read_file: binary file object holding the array
+    :param read_size: bytes read at a time
+    :type read_size: int
+    :return: generator of the array's values
+    :raises ValueError: if the file isn't a complete json array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer, position, finished = '', 0, False
+    state = 'start'
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if state == 'start' and char == '[':
+                state, position = 'first', position + 1
+                continue
+            if state in ('first', 'separator') and char == ']':
+                if (buffer[position + 1:] + text_decoder.decode(read_file.read(), final=True)).strip():
+                    raise ValueError('extra data after json array')
+                return
+            if state == 'separator' and char == ',':
+                state, position = 'value', position + 1
+                continue
+            if state not in ('first', 'value'):
+                raise ValueError('unexpected {!r} in json array'.format(char))
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                end = None
+            # a value isn't over until the comma or bracket after it has been read, a number could carry on in the
+            # rest of the file
+            if end is not None and (finished or buffer[WHITESPACE.match(buffer, end).end():][:1] in (',', ']')):
+                yield value
+                state, position = 'separator', end
+                continue
+        if finished:
+            raise ValueError('unexpected end of json array')
+        # reads grow with the buffer, so a value bigger than a read is only parsed again a few times
+        chunk = read_file.read(max(read_size, len(buffer) - position))
+        finished = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=finished)
+        position = 0
+
+
+def iter_records(path, use_mmap=False):
+    """ yields the messages stored in a day file of any format a message at a time, so only the message being read
+        is ever held in memory
+    :param path: path to the file
+    :type path: str
+    :param use_mmap: read the file through a memory map rather than buffered reads
+    :type use_mmap: bool
+    :return: generator of messages in dict format
+    :rtype: generator(dict)
+    """
+    with _open_binary(path, use_mmap) as read_file:
+        if path.endswith('.json'):
+            yield from _iter_json_array(read_file)
+            return
+        for line in iter(read_file.readline, b''):
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_records(path):
+    """ loads the messages stored in a day file of any format
+    :param path: path to the file
+    :type path: str
+    :return: list of messages in dict format
+    :rtype: list(dict)
+    """
+    if path.endswith('.json'):
+        # parsing the whole array at once is quicker than streaming it when it all ends up in memory anyway
+        with _open_read(path) as read_file:
+            return json.load(read_file)
+    return list(iter_records(path))
+
+
+def _dump(records, write_file, storage_format):
+    """ serialises the records to the open text file in the passed in format
+    :param records: messages in dict format
+    :type records: iterable(dict)
+    :param write_file: text file object to write to
+    :param storage_format: one of the keys of EXTENSIONS
+    :type storage_format: str
+    :return: None
+    """
+    if storage_format == 'json':
+        json.dump(list(records), write_file, indent=4)
+    elif storage_format == 'compact':
+        json.dump(list(records), write_file, separators=(',', ':'))
+    else:
+        for record in records:
+            write_file.write(json.dumps(record, separators=(',', ':')))
+            write_file.write('\n')
+
+
+class _HashingWriter(io.RawIOBase):
+    """ passes writes through to a file, hashing the bytes as they go so the file never has to be read back """
+
+    def __init__(self, raw):
+        super().__init__()
+        self.raw = raw
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.raw.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+
+def write_records(records, path, storage_format=DEFAULT_FORMAT, before_replace=None):
+    """ writes the messages to the passed in path in the passed in format. The data goes to a temporary file that is
+        then renamed over the destination, so a crash never leaves a half written file behind
+    :param records: messages in dict format
+    :type records: iterable(dict)
+    :param path: path of the file to save to
+    :type path: str
+    :param storage_format: one of the keys of EXTENSIONS
+    :type storage_format: str
+    :param before_replace: called with the sha256 and size of the finished file before it's renamed into place
+    :type before_replace: callable
+    :return: number of bytes written to disk
+    :rtype: int
+    """
+    if storage_format not in EXTENSIONS:
+        raise ValueError('Unknown storage format {}'.format(storage_format))
+    folder = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            hashing = _HashingWriter(raw)
+            if storage_format == 'jsonl.gz':
+                binary = gzip.GzipFile(fileobj=hashing, mode='wb')
+            elif storage_format == 'jsonl.zst':
+                binary = _zstandard().ZstdCompressor().stream_writer(hashing, closefd=False)
+            else:
+                binary = hashing
+            with io.TextIOWrapper(binary, encoding='utf-8') as write_file:
+                _dump(records, write_file, storage_format)
+        if before_replace is not None:
+            before_replace((hashing.digest.hexdigest(), hashing.size))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    size = os.path.getsize(path)
+    metrics.count('bytes_written', size)
+    return size
+
+
+def _remove_stale(folder_path, date, path):
+    """ removes the day's files in every other format and layout than the passed in one, along with any shard
+        folders left empty
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param path: path of the day's current file
+    :type path: str
+    :return: None
+    """
+    for layout in LAYOUTS:
+        for extension in DAY_EXTENSIONS:
+            stale_path = os.path.join(folder_path, _layout_path(date, extension, layout))
+            if stale_path == path or not os.path.exists(stale_path):
+                continue
+            os.remove(stale_path)
+            checksums.forget(folder_path, stale_path)
+            if layout == 'sharded':
+                month_folder = os.path.dirname(stale_path)
+                for shard_folder in (month_folder, os.path.dirname(month_folder)):
+                    if os.listdir(shard_folder):
+                        break
+                    os.rmdir(shard_folder)
+
+
+def save_day_file(records, folder_path, date, storage_format=DEFAULT_FORMAT, layout=DEFAULT_LAYOUT):
+    """ saves a day's messages to the channel folder in the passed in format and layout, removing the day's file in
+        any other format or layout so each day only ever has one file
+    :param records: messages in dict format
+    :type records: iterable(dict)
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param storage_format: one of the keys of EXTENSIONS
+    :type storage_format: str
+    :param layout: one of LAYOUTS
+    :type layout: str
+    :return: path of the saved file and the number of bytes written
+    :rtype: tuple(str, int)
+    """
+    path = os.path.join(folder_path, day_file_path(date, storage_format, layout))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = []
+
+    def record_pending(checksum):
+        written.append(checksum)
+        checksums.record_pending(folder_path, path, checksum)
+
+    size = write_records(records, path, storage_format, record_pending)
+    checksums.record(folder_path, path, written[0])
+    _remove_stale(folder_path, date, path)
+    return path, size
+
+
+def move_day_file(source_path, folder_path, date, layout=DEFAULT_LAYOUT):
+    """ moves a day file into the channel folder in the passed in layout, keeping its format
+    :param source_path: path to the day file
+    :type source_path: str
+    :param folder_path: path to the channel folder
+    :type folder_path: str
+    :param date: the day in YYYY-MM-DD format
+    :type date: str
+    :param layout: one of LAYOUTS
+    :type layout: str
+    :return: path of the moved file
+    :rtype: str
+    """
+    path = os.path.join(folder_path, _layout_path(date, split_day_path(source_path)[1], layout))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    checksum = checksums.file_checksum(source_path)
+    checksums.record_pending(folder_path, path, checksum)
+    shutil.move(source_path, path)
+    checksums.record(folder_path, path, checksum)
+    _remove_stale(folder_path, date, path)
+    return path
+
+
+def _channel_folders(folder_path):
+    """ finds the folders under the archive folder holding day files
+    :param folder_path: path to the archive folder
+    :type folder_path: str
+    :return: generator of paths to the channel folders
+    :rtype: generator(str)
+    """
+    for root, folder_names, file_names in os.walk(folder_path):
+        # a folder whose day files have all gone missing still has its manifest
+        if any(split_ext(i) for i in file_names) or any(YEAR_PATTERN.match(i) for i in folder_names) or \
+                checksums.MANIFEST_FILE in file_names:
+            yield root
+            # the shards are read through list_day_files rather than walked
+            folder_names[:] = [i for i in folder_names if not YEAR_PATTERN.match(i)]
+
+
+def migrate(folder_path, storage_format=None, layout=None):
+    """ rewrites every day file under the archive folder in the passed in format, and moves it to the passed in
+        layout. Files only changing layout are moved rather than rewritten
+    :param folder_path: path to the archive folder
+    :type folder_path: str
+    :param storage_format: one of the keys of EXTENSIONS, None to keep each file's format
+    :type storage_format: str
+    :param layout: one of LAYOUTS, None to keep each file's layout
+    :type layout: str
+    :return: number of day files rewritten or moved
+    :rtype: int
+    """
+    migrated = 0
+    for channel_folder in list(_channel_folders(folder_path)):
+        for date, file_name in sorted(list_day_files(channel_folder).items()):
+            path = os.path.join(channel_folder, file_name)
+            current_layout = 'flat' if split_ext(file_name) else 'sharded'
+            if storage_format is not None:
+                save_day_file(read_records(path), channel_folder, date, storage_format, layout or current_layout)
+            elif layout is not None and layout != current_layout:
+                move_day_file(path, channel_folder, date, layout)
+            else:
+                continue
+            migrated += 1
+    return migrated
+
+
+def _hash_jobs(folder_path, missing):
+    """ lists the day files to hash under the archive folder, collecting the recorded files that have gone missing
+    :param folder_path: path to the archive folder
+    :type folder_path: str
+    :param missing: list to add the channel folder and path of each missing file to
+    :type missing: list(tuple(str, str))
+    :return: generator of the channel folder, the day file's path and its recorded checksum, None if unrecorded
+    :rtype: generator(tuple(str, str, dict))
+    """
+    for channel_folder in _channel_folders(folder_path):
+        manifest = checksums.load_manifest(channel_folder)
+        day_files = {file_name.replace(os.sep, '/') for file_name in list_day_files(channel_folder).values()}
+        for file_name in sorted(set(manifest) - day_files):
+            # a file only pending was never renamed into place, the run writing it crashed first
+            if manifest[file_name].get('sha256'):
+                missing.append((channel_folder, os.path.join(channel_folder, file_name)))
+        for file_name in sorted(day_files):
+            yield channel_folder, os.path.join(channel_folder, file_name), manifest.get(file_name)
+
+
+def verify_archive(folder_path, workers=4, record=False):
+    """ hashes every day file under the archive folder in a pool of worker threads and compares them against the
+        checksums recorded when they were written
+    :param folder_path: path to the archive folder
+    :type folder_path: str
+    :param workers: number of files hashed at once
+    :type workers: int
+    :param record: record the checksums of the files that have none, e.g. in archives saved before checksums were
+        kept, and forget the missing files. Files that don't match their checksums are never recorded
+    :type record: bool
+    :return: number of files checked and lists of the paths that are mismatched, missing or unrecorded
+    :rtype: dict
+    """
+    report = {'checked': 0, 'mismatched': [], 'missing': [], 'unrecorded': []}
+    missing = []
+    pending = deque()
+
+    def check_next():
+        channel_folder, path, expected, future = pending.popleft()
+        checksum = future.result()
+        report['checked'] += 1
+        if expected is None:
+            report['unrecorded'].append(path)
+            if record:
+                checksums.record(channel_folder, path, checksum)
+        elif checksum not in checksums.accepted(expected):
+            report['mismatched'].append(path)
+        elif record and checksum != (expected.get('sha256'), expected.get('size')):
+            # written in full by a run that crashed before recording it
+            checksums.record(channel_folder, path, checksum)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for channel_folder, path, expected in _hash_jobs(folder_path, missing):
+            pending.append((channel_folder, path, expected, executor.submit(checksums.file_checksum, path)))
+            # hashing runs ahead of the comparisons by a few files a worker, so memory stays flat
+            if len(pending) > workers * 4:
+                check_next()
+        while pending:
+            check_next()
+    for channel_folder, path in missing:
+        report['missing'].append(path)
+        if record:
+            checksums.forget(channel_folder, path)
+    return report
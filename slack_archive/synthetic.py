@@ -0,0 +1,102 @@
+import random
+from datetime import datetime, timedelta
+
+# generated history ends here rather than now, so the same settings always give the same workspace
+DEFAULT_END = datetime(2019, 1, 1)
+
+WORDS = ('invoice', 'deploy', 'meeting', 'report', 'lunch', 'release', 'review', 'bug', 'customer', 'roadmap',
+         'budget', 'design', 'launch', 'update', 'question', 'thanks', 'standup', 'incident', 'draft', 'metrics')
+
+
+def _text(rng):
+    """ makes up a few words of message text
+    :param rng: random number generator
+    :type rng: random.Random
+    :return: the text
+    :rtype: str
+    """
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+
+
+def generate_channel(rng, channel_id, users, messages_per_day, thread_every, thread_depth, start, days):
+    """ generates a channel's history, with every thread_every-th message starting a thread
+    :param rng: random number generator
+    :type rng: random.Random
+    :param channel_id: slack channel id
+    :type channel_id: str
+    :param users: user ids to post as
+    :type users: list(str)
+    :param messages_per_day: top level messages posted each day
+    :type messages_per_day: int
+    :param thread_every: how often a message starts a thread, 0 for no threads
+    :type thread_every: int
+    :param thread_depth: replies in each thread
+    :type thread_depth: int
+    :param start: first day of history
+    :type start: datetime
+    :param days: number of days of history
+    :type days: int
+    :return: the channel's messages, including thread replies, newest first
+    :rtype: list(dict)
+    """
+    epoch = datetime(1970, 1, 1)
+    messages = []
+    spacing = 86400.0 / (messages_per_day + 1)
+    for day in range(days):
+        day_start = (start + timedelta(days=day) - epoch).total_seconds()
+        for number in range(messages_per_day):
+            seconds = day_start + spacing * (number + 1)
+            ts = '{:.6f}'.format(seconds)
+            message = {'type': 'message', 'user': rng.choice(users), 'text': _text(rng), 'ts': ts}
+            if thread_every and thread_depth and number % thread_every == 0:
+                # replies land between this message and the next so they stay on the same day
+                replies = ['{:.6f}'.format(seconds + spacing * (reply + 1) / (thread_depth + 1))
+                           for reply in range(thread_depth)]
+                message.update(thread_ts=ts, reply_count=thread_depth, latest_reply=replies[-1])
+                messages.extend({'type': 'message', 'user': rng.choice(users), 'text': _text(rng),
+                                 'ts': reply_ts, 'thread_ts': ts} for reply_ts in replies)
+            messages.append(message)
+    messages.sort(key=lambda message: float(message['ts']), reverse=True)
+    return messages
+
+
+def generate_workspace(channels=10, messages_per_day=20, thread_depth=3, years=1, users=25, thread_every=10,
+                       seed=0, end=DEFAULT_END):
+    """ generates a workspace to serve from FakeSlack, the same every time for the same arguments
+    :param channels: number of public channels
+    :type channels: int
+    :param messages_per_day: top level messages posted to each channel each day
+    :type messages_per_day: int
+    :param thread_depth: replies in each thread
+    :type thread_depth: int
+    :param years: years of history
+    :type years: float
+    :param users: number of users
+    :type users: int
+    :param thread_every: how often a message starts a thread, 0 for no threads
+    :type thread_every: int
+    :param seed: seed of the random text and authors
+    :type seed: int
+    :param end: day the history stops before
+    :type end: datetime
+    :return: keyword arguments for FakeSlack, i.e. the team, users, conversations and messages
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    days = int(round(365 * years))
+    start = end - timedelta(days=days)
+    user_list = [{'id': 'U{:07d}'.format(number), 'name': 'user{}'.format(number)} for number in range(users)]
+    user_ids = [user['id'] for user in user_list]
+    conversations = []
+    messages = {}
+    for number in range(channels):
+        channel_id = 'C{:07d}'.format(number)
+        messages[channel_id] = generate_channel(rng, channel_id, user_ids, messages_per_day, thread_every,
+                                                thread_depth, start, days)
+        conversation = {'id': channel_id, 'name': 'channel-{}'.format(number), 'is_channel': True,
+                        'created': int((start - datetime(1970, 1, 1)).total_seconds())}
+        if messages[channel_id]:
+            conversation['latest'] = {'ts': messages[channel_id][0]['ts']}
+        conversations.append(conversation)
+    return {'team': {'id': 'T0000001', 'domain': 'synthetic'}, 'users': user_list,
+            'conversations': conversations, 'messages': messages}
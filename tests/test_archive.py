@@ -3,8 +3,15 @@ import os
 import shutil
 import json
 import datetime
-from slack_archive import archive
+import zipfile
+from functools import partial
+from slack_archive import archive, checksums, index, packaging, state, storage
+from slack_archive.client import SlackSession
+from slack_archive.fake_slack import FakeSlack
+from slack_archive.rate_limit import RateLimiter
+from slacker import Error, Slacker
 from unittest.mock import MagicMock, patch, call
+import requests
 
 
 class RetrieveMessagesTestSuite(unittest.TestCase):
@@ -13,9 +20,11 @@ class RetrieveMessagesTestSuite(unittest.TestCase):
         self.updated_ts = 123
         self.messages = [[{'name': 'message1', 'ts': self.updated_ts}], [{'name': 'message2', 'ts': 456}]]
         self.first_page = MagicMock()
-        self.first_page.body = {'messages': self.messages[0], 'has_more': True}
+        self.first_page.body = {'messages': self.messages[0], 'has_more': True,
+                                'response_metadata': {'next_cursor': 'next_page'}}
         self.second_page = MagicMock()
-        self.second_page.body = {'messages': self.messages[1], 'has_more': False}
+        self.second_page.body = {'messages': self.messages[1], 'has_more': False,
+                                 'response_metadata': {'next_cursor': ''}}
         self.response = [self.first_page, self.second_page]
         self.pageable_object = MagicMock()
         self.channel_id = '123456'
@@ -24,12 +33,308 @@ class RetrieveMessagesTestSuite(unittest.TestCase):
     def tearDown(self):
         pass
 
-    @patch('slack_archive.archive.sleep')
-    def test_retrieve_messages(self, mock_sleep):
+    def test_retrieve_messages(self):
         self.pageable_object.history.side_effect = self.response
         actual = archive.retrieve_messages(self.pageable_object, self.channel_id, self.last_time)
         self.assertEqual([self.messages[0][0], self.messages[1][0]], actual)
 
+    def test_iter_message_pages(self):
+        self.pageable_object.history.side_effect = self.response
+        pages = archive.iter_message_pages(self.pageable_object, self.channel_id, self.last_time)
+
+        # Verify the second page is only requested once the first has been consumed
+        self.assertEqual(self.messages[0], next(pages))
+        self.pageable_object.history.assert_called_once()
+        self.assertEqual(self.messages[1], next(pages))
+        self.assertEqual('next_page', self.pageable_object.history.call_args.kwargs['cursor'])
+        self.assertEqual(archive.MAX_PAGE_SIZE, self.pageable_object.history.call_args.kwargs['limit'])
+        self.assertIsNone(next(pages, None))
+
+
+class FakeSlackTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.conversations = [{'id': 'C1', 'name': 'general', 'is_channel': True},
+                              {'id': 'G1', 'name': 'secret', 'is_private': True},
+                              {'id': 'G2', 'name': 'mpdm-a--b', 'is_private': True, 'is_mpim': True},
+                              {'id': 'D1', 'is_im': True, 'user': 'U1'}]
+        # an hour apart, newest first as slack returns them
+        self.messages = {i['id']: [{'ts': '{}.000100'.format(1555786317 + j * 3600), 'text': str(j)}
+                                   for j in reversed(range(2500))]
+                         for i in self.conversations}
+        self.users = [{'id': 'U{}'.format(i)} for i in range(1200)]
+        self.fake = FakeSlack(users=self.users, conversations=self.conversations, messages=self.messages)
+        self.fake.start()
+        self.slack = Slacker('token', session=self.fake.session())
+        self.limiter = RateLimiter(tiers={2: (6000, 100), 3: (6000, 100)})
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_history_follows_cursor_with_large_pages(self):
+        for conversation in self.conversations:
+            actual = archive.retrieve_messages(self.slack.conversations, conversation['id'], 0,
+                                               rate_limiter=self.limiter)
+            self.assertEqual(self.messages[conversation['id']], actual)
+        # 2500 messages in pages of 999 is three calls per conversation
+        self.assertEqual(12, self.fake.calls['conversations.history'])
+
+    def test_history_after_cursor(self):
+        actual = archive.retrieve_messages(self.slack.conversations, 'C1', self.messages['C1'][1]['ts'],
+                                           rate_limiter=self.limiter)
+        self.assertEqual([self.messages['C1'][0]], actual)
+
+    def test_bootstrap(self):
+        users, public, private, dms = archive.bootstrap_key_values(self.slack, self.limiter)
+        self.assertEqual(self.users, users)
+        self.assertEqual([self.conversations[0]], public)
+        self.assertEqual(self.conversations[1:3], private)
+        self.assertEqual([self.conversations[3]], dms)
+        self.assertEqual(2, self.fake.calls['users.list'])
+        self.assertEqual(1, self.fake.calls['conversations.list'])
+
+    def test_download_all(self):
+        folder_path = 'fake_download_folder'
+        self.addCleanup(remove, folder_path)
+        jobs = [(self.slack.conversations, i) for i in self.conversations]
+        with patch('slack_archive.archive.iter_messages',
+                   partial(archive.iter_messages, rate_limiter=self.limiter)):
+            archive.download_all(jobs, folder_path, 0, concurrency=4)
+        self.assertEqual(['C1', 'D1', 'G1', 'G2'], sorted(os.listdir(folder_path)))
+        days = {'{:%Y-%m-%d}.json'.format(archive.timestamp_to_datetime(i['ts'])) for i in self.messages['D1']}
+        self.assertEqual(sorted(days | {checksums.MANIFEST_FILE}), sorted(os.listdir(os.path.join(folder_path, 'D1'))))
+
+    def test_download_all_failure(self):
+        folder_path = 'fake_download_folder'
+        self.addCleanup(remove, folder_path)
+        jobs = [(self.slack.conversations, i) for i in [{'id': 'C9', 'name': 'missing'}] + self.conversations]
+        for concurrency in (1, 4):
+            with self.subTest(concurrency=concurrency), \
+                    patch('slack_archive.archive.iter_messages',
+                          partial(archive.iter_messages, rate_limiter=self.limiter)):
+                remove(folder_path)
+                with self.assertRaises(Error):
+                    archive.download_all(jobs, folder_path, 0, concurrency=concurrency)
+
+                # Verify the channel that failed didn't stop the others downloading before the error was raised
+                self.assertEqual(['C1', 'C9', 'D1', 'G1', 'G2'], sorted(os.listdir(folder_path)))
+                self.assertEqual(len(self.messages['D1']), sum(
+                    len(archive.load_json(os.path.join(folder_path, 'D1', file_name)))
+                    for file_name in storage.list_day_files(os.path.join(folder_path, 'D1')).values()))
+
+
+class CheckpointTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder_path = 'fake_checkpoint_folder'
+        self.channel = {'id': 'C1', 'name': 'general', 'is_channel': True}
+        # an hour apart, newest first as slack returns them
+        self.messages = [{'ts': '{}.000100'.format(1555786317 + i * 3600)} for i in reversed(range(2500))]
+        self.fake = FakeSlack(conversations=[self.channel], messages={'C1': self.messages})
+        self.fake.start()
+        self.slack = Slacker('token', session=self.fake.session(retries=0))
+        self.cursors = state.CursorIndex(os.path.join(self.folder_path, 'cursors.json'))
+        self.checkpoints = state.Checkpoints(os.path.join(self.folder_path, 'checkpoints.json'))
+        limiter = RateLimiter(tiers={3: (6000, 100)})
+        self.patch = patch('slack_archive.archive.iter_message_pages',
+                           partial(archive.iter_message_pages, rate_limiter=limiter))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.fake.stop()
+        remove(self.folder_path)
+
+    def _download(self):
+        return archive.download_channel(self.slack.conversations, self.channel, self.folder_path, 0, self.cursors,
+                                        append=True, checkpoints=self.checkpoints)
+
+    def _saved(self):
+        channel_path = os.path.join(self.folder_path, 'C1')
+        return [message for _, file_name in sorted(storage.list_day_files(channel_path).items())
+                for message in archive.load_json(os.path.join(channel_path, file_name))]
+
+    def test_resume_after_interruption(self):
+        original = self.fake.api_conversations_history
+        history_calls = []
+
+        def history(params):
+            history_calls.append(params)
+            # the call for the second page fails
+            if len(history_calls) == 1:
+                self.fake.queue_error('conversations.history', 500)
+            return original(params)
+
+        self.fake.api_conversations_history = history
+        with self.assertRaises(requests.HTTPError):
+            self._download()
+
+        # Verify the first page is on disk and checkpointed but the cursor hasn't moved
+        checkpoint = self.checkpoints.get('C1')
+        self.assertEqual(self.messages[998]['ts'], checkpoint['latest'])
+        self.assertEqual(self.messages[0]['ts'], checkpoint['newest'])
+        self.assertEqual(list(reversed(self.messages[:999])), self._saved())
+        self.assertEqual(0, self.cursors.get('C1'))
+
+        self.assertEqual(self.messages[0]['ts'], self._download())
+
+        # Verify only the two older pages were fetched on resuming and the download finished
+        self.assertEqual(3, len(history_calls))
+        self.assertEqual(self.messages[998]['ts'], history_calls[1]['latest'])
+        self.assertEqual(list(reversed(self.messages)), self._saved())
+        self.assertIsNone(self.checkpoints.get('C1'))
+        self.assertEqual(self.messages[0]['ts'], self.cursors.get('C1'))
+
+    def test_no_checkpoint_left_after_success(self):
+        self.assertEqual(self.messages[0]['ts'], self._download())
+        self.assertIsNone(self.checkpoints.get('C1'))
+        self.assertEqual(list(reversed(self.messages)), self._saved())
+
+class DownloadThreadsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder_path = 'fake_thread_folder'
+        self.channel = {'id': 'C1', 'name': 'general', 'is_channel': True}
+        self.parent = {'ts': '1555786317.000100', 'thread_ts': '1555786317.000100', 'reply_count': 2,
+                       'latest_reply': '1555786417.000100', 'text': 'parent'}
+        self.reply1 = {'ts': '1555786367.000100', 'thread_ts': self.parent['ts'], 'text': 'first'}
+        self.reply2 = {'ts': '1555786417.000100', 'thread_ts': self.parent['ts'], 'text': 'second'}
+        self.plain = {'ts': '1555786318.000100', 'text': 'plain'}
+        self.fake = FakeSlack(conversations=[self.channel],
+                              messages={'C1': [self.parent, self.reply1, self.reply2, self.plain]})
+        self.fake.start()
+        self.slack = Slacker('token', session=self.fake.session())
+        self.threads = state.ThreadState(os.path.join(self.folder_path, 'threads.json'))
+        self.limiter = RateLimiter(tiers={3: (6000, 100)})
+        self.patches = [patch('slack_archive.archive.iter_messages', partial(archive.iter_messages,
+                                                                             rate_limiter=self.limiter)),
+                        patch('slack_archive.archive.iter_message_pages', partial(archive.iter_message_pages,
+                                                                                  rate_limiter=self.limiter)),
+                        patch('slack_archive.archive.iter_replies', partial(archive.iter_replies,
+                                                                            rate_limiter=self.limiter)),
+                        # the threads are from 2019, so keep them all tracked however long ago that is
+                        patch.dict(archive.settings, {'thread_repoll_days': None})]
+        for i in self.patches:
+            i.start()
+
+    def tearDown(self):
+        for i in self.patches:
+            i.stop()
+        self.fake.stop()
+        remove(self.folder_path)
+
+    def _download(self):
+        archive.download_channel(self.slack.conversations, self.channel, self.folder_path, 0, append=True,
+                                 threads=self.threads)
+        return archive.load_json(os.path.join(self.folder_path, 'C1', '2019-04-20.json'))
+
+    def test_replies_saved(self):
+        self.assertEqual([self.parent, self.plain, self.reply1, self.reply2], self._download())
+        self.assertEqual(1, self.fake.calls['conversations.replies'])
+        self.assertEqual({'reply_count': 2, 'latest_reply': self.reply2['ts']},
+                         self.threads.get('C1', self.parent['ts']))
+
+    def test_unchanged_thread_not_refetched(self):
+        self._download()
+        self._download()
+        self.assertEqual(1, self.fake.calls['conversations.replies'])
+
+    def test_only_new_replies_fetched(self):
+        self._download()
+        reply3 = {'ts': '1555786467.000100', 'thread_ts': self.parent['ts'], 'text': 'third'}
+        self.parent.update(reply_count=3, latest_reply=reply3['ts'])
+        self.fake.add_messages('C1', [reply3])
+
+        with patch('slack_archive.archive.iter_replies',
+                   wraps=partial(archive.iter_replies, rate_limiter=self.limiter)) as mocked_replies:
+            messages = self._download()
+
+        # Verify the thread was fetched from its last known reply and merged with what was saved before
+        self.assertEqual(self.reply2['ts'], mocked_replies.call_args[0][3])
+        self.assertEqual([self.parent, self.plain, self.reply1, self.reply2, reply3], messages)
+        self.assertEqual(3, self.threads.get('C1', self.parent['ts'])['reply_count'])
+
+    def test_broadcast_reply(self):
+        self.threads.update('C1', self.parent['ts'], 2, self.reply2['ts'])
+        broadcast = {'ts': '1555786467.000100', 'thread_ts': self.parent['ts'], 'subtype': 'thread_broadcast'}
+        self.fake.add_messages('C1', [broadcast])
+        self.parent.update(reply_count=3, latest_reply=broadcast['ts'])
+
+        archive.download_channel(self.slack.conversations, self.channel, self.folder_path, self.parent['ts'],
+                                 threads=self.threads)
+
+        # Verify a reply broadcast to the channel flags its thread even when the parent is older than the cursor
+        self.assertEqual(1, self.fake.calls['conversations.replies'])
+        self.assertEqual(broadcast['ts'], self.threads.get('C1', self.parent['ts'])['latest_reply'])
+
+    def _incremental_runs(self, checkpoints, thread_repoll_days):
+        cursors = state.CursorIndex(os.path.join(self.folder_path, 'cursors.json'))
+        with patch.dict(archive.settings, {'thread_repoll_days': thread_repoll_days}):
+            archive.download_channel(self.slack.conversations, self.channel, self.folder_path, 0, cursors,
+                                     append=True, threads=self.threads, checkpoints=checkpoints)
+            # a reply to the thread leaves its parent where it was in the history, older than the cursor
+            reply3 = {'ts': '1555786467.000100', 'thread_ts': self.parent['ts'], 'text': 'third'}
+            self.parent.update(reply_count=3, latest_reply=reply3['ts'])
+            self.fake.add_messages('C1', [reply3])
+            archive.download_channel(self.slack.conversations, self.channel, self.folder_path, 0, cursors,
+                                     append=True, threads=self.threads, checkpoints=checkpoints)
+        return reply3, archive.load_json(os.path.join(self.folder_path, 'C1', '2019-04-20.json'))
+
+    def test_old_thread_repolled(self):
+        reply3, messages = self._incremental_runs(None, None)
+
+        # Verify the second run polled the thread it had seen and saved the new reply
+        self.assertEqual(2, self.fake.calls['conversations.replies'])
+        self.assertEqual([self.parent, self.plain, self.reply1, self.reply2, reply3], messages)
+        self.assertEqual({'reply_count': 3, 'latest_reply': reply3['ts']}, self.threads.get('C1', self.parent['ts']))
+
+    def test_old_thread_repolled_from_pages(self):
+        checkpoints = state.Checkpoints(os.path.join(self.folder_path, 'checkpoints.json'))
+        reply3, messages = self._incremental_runs(checkpoints, None)
+
+        self.assertEqual(2, self.fake.calls['conversations.replies'])
+        self.assertEqual([self.parent, self.plain, self.reply1, self.reply2, reply3], messages)
+
+    def test_old_thread_unchanged(self):
+        self._incremental_runs(None, None)
+        day_file = os.path.join(self.folder_path, 'C1', '2019-04-20.json')
+        saved = archive.load_json(day_file)
+        cursors = state.CursorIndex(os.path.join(self.folder_path, 'cursors.json'))
+
+        with patch.dict(archive.settings, {'thread_repoll_days': None}):
+            archive.download_channel(self.slack.conversations, self.channel, self.folder_path, 0, cursors,
+                                     append=True, threads=self.threads)
+
+        # Verify a run with nothing new reads the parent's history back but fetches no thread
+        self.assertEqual(2, self.fake.calls['conversations.replies'])
+        self.assertEqual(saved, archive.load_json(day_file))
+
+    def test_skipped_channel_repolled(self):
+        cursors = state.CursorIndex(os.path.join(self.folder_path, 'cursors.json'))
+        archive.download_channel(self.slack.conversations, self.channel, self.folder_path, 0, cursors, append=True,
+                                 threads=self.threads)
+        reply3 = {'ts': '1555786467.000100', 'thread_ts': self.parent['ts'], 'text': 'third'}
+        self.parent.update(reply_count=3, latest_reply=reply3['ts'])
+        self.fake.add_messages('C1', [reply3])
+
+        with patch.dict(archive.settings, {'thread_repoll_days': None}):
+            self.assertEqual(1, archive.repoll_threads(self.slack.conversations, self.channel, self.folder_path,
+                                                       self.threads, cursors))
+            self.assertEqual(0, archive.repoll_threads(self.slack.conversations, self.channel, self.folder_path,
+                                                       self.threads, cursors))
+
+        # Verify the changed thread was found in the history before the cursor and fetched once
+        self.assertEqual(2, self.fake.calls['conversations.replies'])
+        self.assertEqual(reply3, archive.load_json(os.path.join(self.folder_path, 'C1', '2019-04-20.json'))[-1])
+
+    def test_quiet_thread_not_repolled(self):
+        saved_parent = dict(self.parent)
+        _, messages = self._incremental_runs(None, 30)
+
+        # Verify threads not replied to within the window aren't polled, these were last replied to in 2019
+        self.assertEqual(1, self.fake.calls['conversations.replies'])
+        self.assertEqual([saved_parent, self.plain, self.reply1, self.reply2], messages)
+
 
 class TimestampToDatetimeTestSuite(unittest.TestCase):
 
@@ -47,51 +352,61 @@ class ChannelRenameTestSuite(unittest.TestCase):
     def setUp(self):
         self.top_folder = 'fake_folder'
         remove(self.top_folder)
-        mkdir(self.top_folder)
-        self.first_file_name = '2019-04-20.json'
-        self.first_file = os.path.join(self.top_folder, self.first_file_name)
-        open(self.first_file, 'a').close()
-        self.second_file_name = '2019-04-19.json'
-        self.second_file = os.path.join(self.top_folder, self.second_file_name)
-        open(self.second_file, 'a').close()
-        self.third_file_name = '2019-04-18.json'
-        self.third_file = os.path.join(self.top_folder, self.third_file_name)
-        open(self.third_file, 'a').close()
-        self.fourth_file_name = '2019-04-17.json'
-        self.fourth_file = os.path.join(self.top_folder, self.fourth_file_name)
-        open(self.fourth_file, 'a').close()
-
-        self.new_folder = 'new_folder'
+        mkdir(os.path.join(self.top_folder, 'C1'))
+        self.day_file = os.path.join(self.top_folder, 'C1', '2019-04-20.json')
+        open(self.day_file, 'a').close()
+        self.aliases = state.ChannelAliases(os.path.join(self.top_folder, state.ALIASES_FILE))
 
     def tearDown(self):
         remove(self.top_folder)
-        remove(self.new_folder)
 
-    def test_full_move(self):
-        # verify old folder exists and new one doesnt
-        self.assertTrue(os.path.exists(self.top_folder))
-        self.assertFalse(os.path.exists(self.new_folder))
+    def test_rename(self):
+        archive.channel_rename(self.aliases, 'C1', 'general', 'announcements')
 
-        archive.channel_rename(self.top_folder, self.new_folder)
+        # verify both names point at the channel and none of its files moved
+        self.assertEqual(['announcements', 'general'], self.aliases.names('C1'))
+        self.assertTrue(os.path.exists(self.day_file))
+        self.assertEqual(['C1', state.ALIASES_FILE], sorted(os.listdir(self.top_folder)))
+        self.assertEqual('C1', index.channel_ids(self.top_folder)['general'])
 
-        # verify all files exist in the new folder and the old one doesn't exist
-        self.assertTrue(os.path.exists(self.new_folder))
-        self.assertTrue(os.path.exists(os.path.join(self.new_folder, self.first_file_name)))
-        self.assertTrue(os.path.exists(os.path.join(self.new_folder, self.second_file_name)))
-        self.assertTrue(os.path.exists(os.path.join(self.new_folder, self.third_file_name)))
-        self.assertTrue(os.path.exists(os.path.join(self.new_folder, self.fourth_file_name)))
-        self.assertFalse(os.path.exists(self.top_folder))
 
-    def test_folder_doesnt_exist(self):
-        # verify old folder exists and new one doesnt
-        self.assertTrue(os.path.exists(self.top_folder))
-        self.assertFalse(os.path.exists(self.new_folder))
+class MigrateLayoutTestSuite(unittest.TestCase):
 
-        archive.channel_rename(self.new_folder, self.top_folder)
+    def setUp(self):
+        self.top_folder = 'fake_folder'
+        remove(self.top_folder)
+        mkdir(os.path.join(self.top_folder, 'general'))
+        archive._to_json([{'id': 'C1', 'name': 'general'}, {'id': 'C2', 'name': 'random'}],
+                         os.path.join(self.top_folder, 'channels.json'))
+        self.message1 = {'ts': '1555786317.000100'}
+        self.message2 = {'ts': '1555786318.000100'}
+        storage.save_day_file([self.message1], os.path.join(self.top_folder, 'general'), '2019-04-20', 'json')
+        self.aliases = state.ChannelAliases(os.path.join(self.top_folder, state.ALIASES_FILE))
 
-        # verify all files exist in the new folder and the old one doesn't exist
-        self.assertFalse(os.path.exists(self.new_folder))
-        self.assertTrue(os.path.exists(self.top_folder))
+    def tearDown(self):
+        remove(self.top_folder)
+
+    def test_folder_moved_to_id(self):
+        self.assertEqual(1, archive.migrate_layout(self.top_folder, self.aliases))
+
+        self.assertFalse(os.path.exists(os.path.join(self.top_folder, 'general')))
+        self.assertEqual([self.message1], archive.load_json(os.path.join(self.top_folder, 'C1', '2019-04-20.json')))
+        self.assertEqual({'general': 'C1', 'random': 'C2'}, self.aliases.data)
+
+    def test_merged_into_existing_id_folder(self):
+        mkdir(os.path.join(self.top_folder, 'C1'))
+        storage.save_day_file([self.message2], os.path.join(self.top_folder, 'C1'), '2019-04-20', 'json')
+
+        self.assertEqual(1, archive.migrate_layout(self.top_folder))
+
+        self.assertFalse(os.path.exists(os.path.join(self.top_folder, 'general')))
+        self.assertEqual([self.message1, self.message2],
+                         archive.load_json(os.path.join(self.top_folder, 'C1', '2019-04-20.json')))
+
+    def test_already_migrated(self):
+        archive.migrate_layout(self.top_folder)
+        self.assertEqual(0, archive.migrate_layout(self.top_folder))
+        self.assertEqual(0, archive.migrate_layout('missing_folder'))
 
 
 class ParseAndSaveMessagesTestSuite(unittest.TestCase):
@@ -113,19 +428,20 @@ class ParseAndSaveMessagesTestSuite(unittest.TestCase):
         self.message4 = {'ts': '1558786317.6852887', 'subtype': '{}_name'.format(self.channel_type),
                          'old_name': self.folder_path, 'name': self.new_folder}
         self.expected_file3 = '2019-05-25.json'
-        self.file1_path_new = os.path.join(self.new_folder, self.expected_file1)
-        self.file2_path_new = os.path.join(self.new_folder, self.expected_file2)
-        self.file3_path_new = os.path.join(self.new_folder, self.expected_file3)
+        self.file3_path = os.path.join(self.folder_path, self.expected_file3)
         self.messages2 = [self.message1, self.message2, self.message3, self.message4]
+        self.aliases_path = 'fake_aliases.json'
         mkdir(self.folder_path)
 
     def tearDown(self):
         remove(self.folder_path)
         remove(self.new_folder)
+        remove(self.aliases_path)
 
     @patch('slack_archive.archive.channel_rename')
     def test_no_name_change(self, mocked_rename):
-        archive.parse_and_save_messages(self.folder_path, self.messages1, self.channel_type)
+        newest_ts = archive.parse_and_save_messages(self.folder_path, self.messages1, self.channel_type)
+        self.assertEqual(self.message3['ts'], newest_ts)
 
         # Verify correct calls made and the files are made as expected
         mocked_rename.assert_not_called()
@@ -138,22 +454,110 @@ class ParseAndSaveMessagesTestSuite(unittest.TestCase):
             actual_file2 = json.load(read_file)
         self.assertEqual([self.message3], actual_file2)
 
+    def test_days_written_while_streaming(self):
+        def messages():
+            yield self.message1
+            yield self.message2
+            self.assertFalse(os.path.exists(self.file1_path))
+            yield self.message3
+            yield {'ts': '1558786317.6852887'}
+            # the first day is finished so it should already be on disk
+            self.assertTrue(os.path.exists(self.file1_path))
+            self.assertTrue(os.path.exists(self.file2_path))
+
+        archive.parse_and_save_messages(self.folder_path, messages(), self.channel_type)
+        self.assertEqual(3, len(storage.list_day_files(self.folder_path)))
+
+    def test_no_messages(self):
+        archive.parse_and_save_messages(self.folder_path, iter([]), self.channel_type)
+        self.assertEqual([], os.listdir(self.folder_path))
+
+    def test_storage_format(self):
+        archive.parse_and_save_messages(self.folder_path, self.messages1, self.channel_type,
+                                        storage_format='jsonl.gz')
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl.gz', '2019-05-13.jsonl.gz'],
+                         sorted(os.listdir(self.folder_path)))
+        self.assertEqual([self.message1, self.message2],
+                         archive.load_json(os.path.join(self.folder_path, '2019-04-20.jsonl.gz')))
+
+    def test_append_across_formats(self):
+        storage.save_day_file([self.message1], self.folder_path, '2019-04-20', 'json')
+        archive.parse_and_save_messages(self.folder_path, [self.message2], self.channel_type, append=True,
+                                        storage_format='jsonl')
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl'], sorted(os.listdir(self.folder_path)))
+        self.assertEqual([self.message1, self.message2],
+                         archive.load_json(os.path.join(self.folder_path, '2019-04-20.jsonl')))
+
+    def test_append(self):
+        edited = dict(self.message2, text='edited')
+        older = {'ts': '1555786316.6852887'}
+        archive._to_json([self.message1, self.message2], self.file1_path)
+
+        # newest first, the way slack returns them
+        archive.parse_and_save_messages(self.folder_path, [self.message3, edited, older], self.channel_type,
+                                        append=True)
+
+        # Verify the day was merged oldest first with the refetched message replaced rather than duplicated
+        with open(self.file1_path, 'r') as read_file:
+            self.assertEqual([older, self.message1, edited], json.load(read_file))
+        with open(self.file2_path, 'r') as read_file:
+            self.assertEqual([self.message3], json.load(read_file))
+        self.assertEqual(sorted([checksums.MANIFEST_FILE, self.expected_file1, self.expected_file2]),
+                         sorted(os.listdir(self.folder_path)))
+
+    def test_append_unchanged(self):
+        message_index = MagicMock()
+        storage.save_day_file([self.message1, self.message2], self.folder_path, '2019-04-20')
+        modified = os.stat(self.file1_path).st_mtime_ns
+
+        archive.parse_and_save_messages(self.folder_path, [dict(self.message2)], self.channel_type, append=True,
+                                        index=message_index, channel_id='C1')
+
+        # Verify refetching messages already saved leaves the day file and the index alone
+        self.assertEqual(modified, os.stat(self.file1_path).st_mtime_ns)
+        message_index.replace_day.assert_not_called()
+
+    def test_append_to_corrupt_day(self):
+        storage.save_day_file([self.message1], self.folder_path, '2019-04-20')
+        with open(self.file1_path, 'w') as write_file:
+            write_file.write('[{"ts": "1555786317.6852887"}, {"ts": "155')
+
+        with self.assertRaises(checksums.ChecksumError):
+            archive.parse_and_save_messages(self.folder_path, [self.message2], self.channel_type, append=True)
+
+        # Verify the corrupt day was left as it was rather than saved over
+        with open(self.file1_path) as read_file:
+            self.assertEqual('[{"ts": "1555786317.6852887"}, {"ts": "155', read_file.read())
+
+    def test_index(self):
+        message_index = MagicMock()
+        edited = dict(self.message2, text='edited')
+        archive._to_json([self.message1, self.message2], self.file1_path)
+
+        archive.parse_and_save_messages(self.folder_path, [edited], self.channel_type, append=True,
+                                        index=message_index, channel_id='C1')
+
+        # Verify the index is handed the whole merged day, not just the new messages
+        message_index.replace_day.assert_called_once_with('C1', '2019-04-20', self.file1_path,
+                                                          [self.message1, edited])
+
     def test_name_change(self):
-        archive.parse_and_save_messages(self.folder_path, self.messages2, self.channel_type)
+        aliases = state.ChannelAliases(self.aliases_path)
+        archive.parse_and_save_messages(self.folder_path, self.messages2, self.channel_type, channel_id='C1',
+                                        aliases=aliases)
 
-        # Verify correct calls made and the files are made as expected
-        self.assertTrue(os.path.exists(self.file1_path_new))
-        self.assertTrue(os.path.exists(self.file2_path_new))
-        self.assertTrue(os.path.exists(self.file3_path_new))
-        with open(self.file1_path_new, 'r') as read_file:
+        # Verify the files stay in the channel's folder and the new name is recorded against the channel
+        self.assertFalse(os.path.exists(self.new_folder))
+        with open(self.file1_path, 'r') as read_file:
             actual_file1 = json.load(read_file)
         self.assertEqual([self.message1, self.message2], actual_file1)
-        with open(self.file2_path_new, 'r') as read_file:
+        with open(self.file2_path, 'r') as read_file:
             actual_file2 = json.load(read_file)
         self.assertEqual([self.message3], actual_file2)
-        with open(self.file3_path_new, 'r') as read_file:
+        with open(self.file3_path, 'r') as read_file:
             actual_file3 = json.load(read_file)
         self.assertEqual([self.message4], actual_file3)
+        self.assertEqual({self.folder_path: 'C1', self.new_folder: 'C1'}, aliases.data)
 
 
 class DownloadChannelsTestSuite(unittest.TestCase):
@@ -161,24 +565,23 @@ class DownloadChannelsTestSuite(unittest.TestCase):
     def setUp(self):
         self.slack_object = MagicMock()
         self.channel1 = 'channel1'
-        self.channel1_id = 123
+        self.channel1_id = 'C123'
         self.channel2 = 'channel2'
-        self.channel2_id = 456
+        self.channel2_id = 'C456'
         self.channel_list = [{'name': self.channel1, 'id': self.channel1_id},
                              {'name': self.channel2, 'id': self.channel2_id}]
         self.folder_path = 'fake_folder_path'
-        self.channel1_path = os.path.join(self.folder_path, self.channel1)
-        self.channel2_path = os.path.join(self.folder_path, self.channel2)
+        self.channel1_path = os.path.join(self.folder_path, self.channel1_id)
+        self.channel2_path = os.path.join(self.folder_path, self.channel2_id)
         self.fake_messages = 'fake_messages'
         self.last_time = 0
 
     def tearDown(self):
         remove(self.folder_path)
 
-    @patch('slack_archive.archive.retrieve_messages')
+    @patch('slack_archive.archive.iter_messages')
     @patch('slack_archive.archive.parse_and_save_messages')
-    @patch('slack_archive.archive.sleep')
-    def test_download_channels(self, mocked_sleep, mocked_parse, mocked_retrieve):
+    def test_download_channels(self, mocked_parse, mocked_retrieve):
         # Verify folder doesn't exist and set up the return value of the retrieve messages
         self.assertFalse(os.path.exists(self.folder_path))
         mocked_retrieve.return_value = self.fake_messages
@@ -188,11 +591,103 @@ class DownloadChannelsTestSuite(unittest.TestCase):
         # Verify methods were correctly called and folders created correctly
         mocked_retrieve.assert_has_calls([call(self.slack_object, self.channel1_id, self.last_time),
                                           call(self.slack_object, self.channel2_id, self.last_time)])
-        mocked_parse.assert_has_calls([call(self.channel1_path, self.fake_messages, 'channel'),
-                                       call(self.channel2_path, self.fake_messages, 'channel')])
+        mocked_parse.assert_has_calls([call(self.channel1_path, self.fake_messages, 'channel', False, index=None,
+                                            channel_id=self.channel1_id, aliases=None),
+                                       call(self.channel2_path, self.fake_messages, 'channel', False, index=None,
+                                            channel_id=self.channel2_id, aliases=None)])
+        self.assertTrue(os.path.exists(self.channel1_path))
+        self.assertTrue(os.path.exists(self.channel2_path))
+
+    @patch('slack_archive.archive.iter_messages')
+    @patch('slack_archive.archive.parse_and_save_messages')
+    def test_download_channels_from_cursors(self, mocked_parse, mocked_iter):
+        mocked_iter.return_value = self.fake_messages
+        mocked_parse.return_value = '1555786318.685288'
+        cursors = MagicMock()
+        cursors.get.side_effect = lambda channel_id, default: {self.channel1_id: '1555786317.685288'}.get(
+            channel_id, default)
+
+        archive.download_channels(self.slack_object, self.channel_list, self.folder_path, self.last_time,
+                                  cursors=cursors)
+
+        # Verify a channel with a cursor only fetches after it and every cursor moves forward
+        mocked_iter.assert_has_calls([call(self.slack_object, self.channel1_id, '1555786317.685288'),
+                                      call(self.slack_object, self.channel2_id, self.last_time)])
+        cursors.update.assert_has_calls([call(self.channel1_id, '1555786318.685288'),
+                                         call(self.channel2_id, '1555786318.685288')])
+
+    @patch('slack_archive.archive.iter_messages')
+    @patch('slack_archive.archive.parse_and_save_messages')
+    def test_download_channels_concurrently(self, mocked_parse, mocked_retrieve):
+        mocked_retrieve.return_value = self.fake_messages
+
+        archive.download_channels(self.slack_object, self.channel_list, self.folder_path, self.last_time,
+                                  concurrency=2)
+
+        # Verify every channel was downloaded exactly as the sequential path would
+        mocked_retrieve.assert_has_calls([call(self.slack_object, self.channel1_id, self.last_time),
+                                          call(self.slack_object, self.channel2_id, self.last_time)],
+                                         any_order=True)
+        mocked_parse.assert_has_calls([call(self.channel1_path, self.fake_messages, 'channel', False, index=None,
+                                            channel_id=self.channel1_id, aliases=None),
+                                       call(self.channel2_path, self.fake_messages, 'channel', False, index=None,
+                                            channel_id=self.channel2_id, aliases=None)], any_order=True)
         self.assertTrue(os.path.exists(self.channel1_path))
         self.assertTrue(os.path.exists(self.channel2_path))
 
+    @patch('slack_archive.archive.iter_messages')
+    @patch('slack_archive.archive.parse_and_save_messages')
+    def test_concurrent_error_raised_after_other_channels(self, mocked_parse, mocked_retrieve):
+        mocked_retrieve.side_effect = [ValueError('broken'), self.fake_messages]
+
+        with self.assertRaises(ValueError):
+            archive.download_channels(self.slack_object, self.channel_list, self.folder_path, self.last_time,
+                                      concurrency=2)
+        self.assertEqual(2, mocked_retrieve.call_count)
+
+
+class PlanDownloadsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cursors = MagicMock()
+        self.cursors.get.side_effect = lambda channel_id, default: {'C1': '1555786317.685288',
+                                                                    'C2': '1555786317.685288'}.get(channel_id, default)
+
+    def test_archived_since_last_fetch(self):
+        archived = {'id': 'C1', 'is_archived': True, 'updated': 1555786000000}
+        archived_after = {'id': 'C2', 'is_archived': True, 'updated': 1555786999000}
+        never_fetched = {'id': 'C3', 'is_archived': True, 'updated': 1555786000000}
+        scheduled, avoided = archive.plan_downloads([archived, archived_after, never_fetched], self.cursors)
+        self.assertEqual([archived_after, never_fetched], scheduled)
+        self.assertEqual(1, avoided)
+
+    def test_latest_message(self):
+        dormant = {'id': 'C1', 'latest': {'ts': '1555786317.685288'}}
+        active = {'id': 'C2', 'latest': {'ts': '1555786318.685288'}}
+        scheduled, avoided = archive.plan_downloads([dormant, active], self.cursors)
+        self.assertEqual([active], scheduled)
+        self.assertEqual(1, avoided)
+
+    def test_no_metadata(self):
+        channels = [{'id': 'C1'}, {'id': 'C4', 'latest': {'ts': '1555786317.685288'}}]
+        scheduled, avoided = archive.plan_downloads(channels, self.cursors)
+        self.assertEqual(channels, scheduled)
+        self.assertEqual(0, avoided)
+
+    def test_last_time_fallback(self):
+        # Verify the day of the last run before cursors is never taken as evidence the channel can be skipped
+        dormant = {'id': 'C4', 'latest': {'ts': '1555786317.685288'}}
+        scheduled, avoided = archive.plan_downloads([dormant], self.cursors, last_time=1555786400)
+        self.assertEqual([dormant], scheduled)
+        self.assertEqual(0, avoided)
+
+    def test_unusable_metadata(self):
+        channels = [{'id': 'C1', 'latest': {'ts': None}}, {'id': 'C2', 'latest': '1555786317.685288'},
+                    {'id': 'C1', 'is_archived': True, 'updated': 'yesterday'}, {'id': 'C2', 'updated': 1555786000000}]
+        scheduled, avoided = archive.plan_downloads(channels, self.cursors)
+        self.assertEqual(channels, scheduled)
+        self.assertEqual(0, avoided)
+
 
 class ToJsonTestSuite(unittest.TestCase):
 
@@ -224,28 +719,60 @@ class ToJsonTestSuite(unittest.TestCase):
         self.assertDictEqual(self.fake_dict1, contents[0])
         self.assertDictEqual(self.fake_dict2, contents[1])
 
+    def test_failed_write_keeps_old_file(self):
+        archive._to_json(self.fake_list, self.fake_file)
+        files_before = sorted(os.listdir('.'))
+
+        with self.assertRaises(TypeError):
+            archive._to_json([{'not json': object()}], self.fake_file)
+
+        # Verify the original is untouched and no temporary file was left behind
+        with open(self.fake_file, 'r') as read_file:
+            self.assertEqual(self.fake_list, json.load(read_file))
+        self.assertEqual(files_before, sorted(os.listdir('.')))
+
+
+class MergeTopLevelFileTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_archive_folder'
+        mkdir(self.folder)
+        self.file_path = os.path.join(self.folder, 'users.json')
+
+    def tearDown(self):
+        remove(self.folder)
+
+    def test_new_file(self):
+        self.assertTrue(archive.merge_top_level_file(self.folder, 'users.json', [{'id': 'U1'}]))
+        self.assertEqual([{'id': 'U1'}], archive.load_json(self.file_path))
+
+    def test_unchanged(self):
+        archive._to_json([{'id': 'U1'}], self.file_path)
+        self.assertFalse(archive.merge_top_level_file(self.folder, 'users.json', [{'id': 'U1'}]))
+
 
 class BootstrapKeyValuesTestSuite(unittest.TestCase):
 
     def setUp(self):
         self.users = ['fake_users']
-        self.public_channels = ['fake_public_channel']
-        self.private_channels = ['fake_private_channel']
-        pass
+        self.public_channels = [{'id': 'C1', 'name': 'fake_public_channel'}]
+        self.private_channels = [{'id': 'G1', 'name': 'fake_private_channel', 'is_private': True},
+                                 {'id': 'G2', 'name': 'fake_group_dm', 'is_mpim': True}]
+        self.dms = [{'id': 'D1', 'is_im': True}]
 
     def tearDown(self):
         pass
 
-    @patch('slack_archive.archive.sleep', return_value=None)
-    def test_basic(self, mocked_time):
+    def test_basic(self):
         fake_connection = MagicMock()
-        fake_connection.users.list.return_value.body.__getitem__.return_value = self.users
-        fake_connection.channels.list.return_value.body.__getitem__.return_value = self.public_channels
-        fake_connection.groups.list.return_value.body.__getitem__.return_value = self.private_channels
-        actual_users, actual_public, actual_private = archive.bootstrap_key_values(fake_connection)
+        fake_connection.users.get.return_value.body = {'members': self.users}
+        fake_connection.conversations.list.return_value.body = {
+            'channels': self.public_channels + self.private_channels + self.dms}
+        actual_users, actual_public, actual_private, actual_dms = archive.bootstrap_key_values(fake_connection)
         self.assertEqual(self.users, actual_users)
         self.assertEqual(self.public_channels, actual_public)
         self.assertEqual(self.private_channels, actual_private)
+        self.assertEqual(self.dms, actual_dms)
 
 
 class RemoveTestSuite(unittest.TestCase):
@@ -371,6 +898,13 @@ class ExtractDateTestSuite(unittest.TestCase):
     def tearDown(self):
         remove(self.top_folder)
 
+    def test_sharded(self):
+        channel_path = os.path.join(self.second_level_folder, 'C1')
+        storage.save_day_file([], channel_path, '2019-04-21', 'json', 'sharded')
+        storage.save_day_file([], channel_path, '2018-04-22', 'json', 'sharded')
+        expected_result = (datetime.datetime(2019, 4, 21) - datetime.datetime(1970, 1, 1)).total_seconds()
+        self.assertEqual(expected_result, archive.extract_date(self.top_folder))
+
     def test_full_folder_structure(self):
         expected_result = (datetime.datetime.strptime(self.most_recent_json.split('.')[0], "%Y-%m-%d") -
                            datetime.datetime(1970, 1, 1)).total_seconds()
@@ -434,69 +968,451 @@ class PairChannelsTestSuite(unittest.TestCase):
         self.assertEqual(expected_result, actual_result)
 
 
-# TODO
 class MergeJsonListByTsTestSuite(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.message1 = {'ts': '1555786317.000100'}
+        self.message2 = {'ts': '1555786318.000100'}
+        self.message3 = {'ts': '1555786319.000100'}
 
-    def tearDown(self):
-        pass
+    def test_basic(self):
+        actual = archive.merge_json_list_by_ts([self.message1, self.message3], [self.message2])
+        self.assertEqual([self.message1, self.message2, self.message3], actual)
+
+    def test_same_ts_kept_once(self):
+        edited = dict(self.message2, text='edited')
+        actual = archive.merge_json_list_by_ts([self.message1, self.message2], [edited, self.message3])
+        self.assertEqual([self.message1, edited, self.message3], actual)
+
+    def test_missing_ts_not_truncated(self):
+        no_ts = {'text': 'no ts'}
+        actual = archive.merge_json_list_by_ts([no_ts, self.message1], [self.message2])
+        self.assertEqual([no_ts, self.message1, self.message2], actual)
+
+    def test_empty(self):
+        self.assertEqual([self.message1], archive.merge_json_list_by_ts([], [self.message1]))
+        self.assertEqual([self.message1], archive.merge_json_list_by_ts([self.message1], []))
+
+
+class MergeMessageStreamsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.archived = [{'ts': '1.000001', 'v': 'archive'}, {'ts': '3.000001', 'v': 'archive'}]
+        self.run1 = [{'ts': '2.000001', 'v': 'run1'}, {'ts': '3.000001', 'v': 'run1'}]
+        self.run2 = [{'ts': '3.000001', 'v': 'run2'}, {'ts': '4.000001', 'v': 'run2'}]
+
+    def merge(self, **kwargs):
+        # generators so nothing can rely on the streams being lists
+        return list(archive.merge_message_streams(iter(self.archived), iter(self.run1), iter(self.run2), **kwargs))
+
+    def test_last_wins(self):
+        self.assertEqual([('1.000001', 'archive'), ('2.000001', 'run1'), ('3.000001', 'run2'), ('4.000001', 'run2')],
+                         [(i['ts'], i['v']) for i in self.merge()])
+
+    def test_first_wins(self):
+        self.assertEqual(['archive', 'run1', 'archive', 'run2'], [i['v'] for i in self.merge(prefer='first')])
+
+    def test_custom_rule(self):
+        def prefer_edited(kept, new):
+            return new if new.get('edited') else kept
+        self.run1[1]['edited'] = True
+        self.assertEqual(['archive', 'run1', 'run1', 'run2'], [i['v'] for i in self.merge(prefer=prefer_edited)])
+
+    def test_thread_dedupe(self):
+        reply = {'ts': '3.000001', 'thread_ts': '1.000001', 'v': 'reply'}
+        actual = list(archive.merge_message_streams(self.archived, [reply], dedupe='thread'))
+        self.assertEqual(['archive', 'archive', 'reply'], [i['v'] for i in actual])
+
+    def test_unknown_rule(self):
+        with self.assertRaises(ValueError):
+            list(archive.merge_message_streams(self.archived, dedupe='user'))
+
+
+class MergeJsonListByIdTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.user1 = {'id': 'U1', 'name': 'one'}
+        self.user2 = {'id': 'U2', 'name': 'two'}
+        self.user2_renamed = {'id': 'U2', 'name': 'deux'}
+        self.user3 = {'id': 'U3', 'name': 'three'}
 
     def test_basic(self):
-        self.assertTrue(False)
+        current, archived = archive.merge_json_list_by_id([self.user1, self.user2], [self.user2_renamed, self.user3])
+        self.assertEqual([self.user2_renamed, self.user3], current)
+        # the old version of the changed user and the removed user are archived
+        self.assertEqual([self.user2, self.user1], archived)
 
+    def test_unchanged(self):
+        current, archived = archive.merge_json_list_by_id([self.user1, self.user2], [self.user1, self.user2])
+        self.assertEqual([self.user1, self.user2], current)
+        self.assertEqual([], archived)
 
-# TODO
-class MergeJsonListByIdTestSuite(unittest.TestCase):  # TODO
+    def test_empty(self):
+        self.assertEqual(([self.user1], []), archive.merge_json_list_by_id([], [self.user1]))
+        self.assertEqual(([self.user1], []), archive.merge_json_list_by_id([self.user1], []))
+
+    def test_large_lists(self):
+        old_data = [{'id': 'U{}'.format(i), 'name': str(i)} for i in range(40000)]
+        new_data = [{'id': 'U{}'.format(i), 'name': str(i) if i % 2 else 'renamed'} for i in range(40000)]
+        current, archived = archive.merge_json_list_by_id(old_data, new_data)
+        self.assertEqual(new_data, current)
+        self.assertEqual(20000, len(archived))
+
+
+class AppendArchiveTestSuite(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.folder = 'fake_archive_history'
+        mkdir(self.folder)
+        self.file_path = os.path.join(self.folder, 'users.archive')
 
     def tearDown(self):
-        pass
+        remove(self.folder)
+
+    def test_keeps_every_version(self):
+        archive.append_archive([{'id': 'U1', 'name': 'a'}], self.file_path, archived_at=1)
+        archive.append_archive([], self.file_path, archived_at=2)
+        archive.append_archive([{'id': 'U1', 'name': 'b'}], self.file_path, archived_at=3)
+        self.assertEqual([{'archived_at': 1, 'record': {'id': 'U1', 'name': 'a'}},
+                          {'archived_at': 3, 'record': {'id': 'U1', 'name': 'b'}}],
+                         archive.load_archive_history(self.file_path))
+
+    def test_converts_legacy_archive(self):
+        archive._to_json([{'id': 'U1', 'name': 'a'}], self.file_path)
+        os.utime(self.file_path, (100, 100))
+        archive.append_archive([{'id': 'U1', 'name': 'b'}], self.file_path, archived_at=200)
+        self.assertEqual([{'archived_at': 100, 'record': {'id': 'U1', 'name': 'a'}},
+                          {'archived_at': 200, 'record': {'id': 'U1', 'name': 'b'}}],
+                         archive.load_archive_history(self.file_path))
+
+    def test_merge_top_level_file_appends(self):
+        archive.merge_top_level_file(self.folder, 'users.json', [{'id': 'U1', 'name': 'a'}])
+        archive.merge_top_level_file(self.folder, 'users.json', [{'id': 'U1', 'name': 'b'}])
+        archive.merge_top_level_file(self.folder, 'users.json', [{'id': 'U1', 'name': 'c'}])
+        history = archive.load_archive_history(self.file_path)
+        self.assertEqual(['a', 'b'], [i['record']['name'] for i in history])
+
+
+class LoadJsonTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_load_folder'
+        mkdir(self.folder)
+        self.messages = [{'ts': '1555786317.6852887'}, {'ts': '1555786318.6852887'}]
+
+    def tearDown(self):
+        remove(self.folder)
 
     def test_basic(self):
-        self.assertTrue(False)
+        file_path = os.path.join(self.folder, 'users.json')
+        archive._to_json(self.messages, file_path)
+        self.assertEqual(self.messages, archive.load_json(file_path))
+
+    def test_every_storage_format(self):
+        for storage_format in ('json', 'compact', 'jsonl', 'jsonl.gz'):
+            path, _ = storage.save_day_file(self.messages, self.folder, '2019-04-20', storage_format)
+            self.assertEqual(self.messages, archive.load_json(path))
+
+    def test_missing_file(self):
+        self.assertEqual([], archive.load_json(os.path.join(self.folder, 'missing.json')))
+
+    def test_corrupt_file(self):
+        file_path = os.path.join(self.folder, 'users.json')
+        with open(file_path, 'w') as write_file:
+            write_file.write('[{"id": "U1"}, {"id"')
+        with self.assertRaises(ValueError):
+            archive.load_json(file_path)
 
 
-# TODO
-class LoadJsonTestSuite(unittest.TestCase):  # TODO
+class MergeChannelFolderTestSuite(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.destination = 'fake_destination_channel'
+        self.source = 'fake_source_channel'
+        mkdir(self.destination)
+        mkdir(self.source)
+        self.message1 = {'ts': '1555786317.6852887'}
+        self.message2 = {'ts': '1555786318.6852887'}
+        self.message3 = {'ts': '1557786317.6852887'}
 
     def tearDown(self):
-        pass
+        remove(self.destination)
+        remove(self.source)
 
-    def test_basic(self):
-        self.assertTrue(False)
+    def test_mixed_formats(self):
+        storage.save_day_file([self.message1], self.destination, '2019-04-20', 'json')
+        storage.save_day_file([self.message2], self.source, '2019-04-20', 'jsonl')
+        storage.save_day_file([self.message3], self.source, '2019-05-13', 'jsonl')
+
+        merged = archive.merge_channel_folder(self.destination, self.source, 'jsonl.gz')
+        self.assertFalse(os.path.exists(self.source))
+        self.assertEqual([os.path.join(self.destination, '2019-04-20.jsonl.gz'),
+                          os.path.join(self.destination, '2019-05-13.jsonl')], merged)
+
+        # Verify the shared day was merged into the configured format and the new day moved across as is
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl.gz', '2019-05-13.jsonl'],
+                         sorted(os.listdir(self.destination)))
+        self.assertEqual([self.message1, self.message2],
+                         archive.load_json(os.path.join(self.destination, '2019-04-20.jsonl.gz')))
 
 
-# TODO
 class MergeArchivesTestSuite(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.destination = 'fake_merge_archive'
+        self.staging1 = 'fake_merge_archive-19-04-19'
+        self.staging2 = 'fake_merge_archive-20-04-19'
+        for i in (self.destination, self.staging1, self.staging2):
+            mkdir(os.path.join(i, 'general'))
+        self.message1 = {'ts': '1555786317.000100'}
+        self.message2 = {'ts': '1555786318.000100'}
+        self.message3 = {'ts': '1555786319.000100'}
 
     def tearDown(self):
-        pass
+        for i in (self.destination, self.staging1, self.staging2):
+            remove(i)
 
     def test_basic(self):
-        self.assertTrue(False)
+        archive._to_json([{'id': 'U1', 'name': 'a'}], os.path.join(self.destination, 'users.json'))
+        archive._to_json([self.message1], os.path.join(self.destination, 'general', '2019-04-20.json'))
+        archive._to_json([{'id': 'U1', 'name': 'b'}], os.path.join(self.staging1, 'users.json'))
+        archive._to_json([self.message1, self.message2],
+                         os.path.join(self.staging1, 'general', '2019-04-20.json'))
+        archive._to_json([{'id': 'U1', 'name': 'c'}], os.path.join(self.staging2, 'users.json'))
+        archive._to_json([self.message2, self.message3],
+                         os.path.join(self.staging2, 'general', '2019-04-20.json'))
+        mkdir(os.path.join(self.staging2, 'random'))
+        archive._to_json([self.message3], os.path.join(self.staging2, 'random', '2019-04-20.json'))
+
+        self.assertTrue(archive.merge_archives(self.destination, [self.staging1, self.staging2], 'json'))
+
+        # Verify every copy of the day was merged once and the staging folders are gone
+        self.assertEqual([self.message1, self.message2, self.message3],
+                         archive.load_json(os.path.join(self.destination, 'general', '2019-04-20.json')))
+        self.assertEqual([self.message3],
+                         archive.load_json(os.path.join(self.destination, 'random', '2019-04-20.json')))
+        self.assertEqual([{'id': 'U1', 'name': 'c'}],
+                         archive.load_json(os.path.join(self.destination, 'users.json')))
+        self.assertFalse(os.path.exists(self.staging1))
+        self.assertFalse(os.path.exists(self.staging2))
+
+    def test_unsorted_legacy_day(self):
+        # days saved before they were kept sorted are newest first
+        with open(os.path.join(self.destination, 'general', '2019-04-20.json'), 'w') as write_file:
+            json.dump([self.message3, self.message1], write_file)
+        archive._to_json([self.message2], os.path.join(self.staging1, 'general', '2019-04-20.json'))
+
+        archive.merge_archives(self.destination, self.staging1, 'json')
+
+        self.assertEqual([self.message1, self.message2, self.message3],
+                         archive.load_json(os.path.join(self.destination, 'general', '2019-04-20.json')))
+
+    def test_sharded(self):
+        storage.save_day_file([self.message1], os.path.join(self.destination, 'general'), '2019-04-20', 'json',
+                              'sharded')
+        storage.save_day_file([self.message1], os.path.join(self.destination, 'general'), '2018-01-01', 'json',
+                              'sharded')
+        archive._to_json([self.message2], os.path.join(self.staging1, 'general', '2019-04-20.json'))
+        archive._to_json([self.message3], os.path.join(self.staging1, 'general', '2019-04-21.json'))
+
+        with patch.dict(archive.settings, {'storage_layout': 'sharded'}):
+            archive.merge_archives(self.destination, self.staging1, 'json')
+
+        # Verify flat downloads were merged into and moved to the shards
+        channel_path = os.path.join(self.destination, 'general')
+        self.assertEqual({'2018-01-01': os.path.join('2018', '01', '01.json'),
+                          '2019-04-20': os.path.join('2019', '04', '20.json'),
+                          '2019-04-21': os.path.join('2019', '04', '21.json')}, storage.list_day_files(channel_path))
+        self.assertEqual([self.message1, self.message2],
+                         archive.load_json(os.path.join(channel_path, '2019', '04', '20.json')))
+        self.assertEqual([checksums.MANIFEST_FILE, '2018', '2019'], sorted(os.listdir(channel_path)))
+
+    def _write_channels(self):
+        for channel in ('general', 'random', 'dev'):
+            mkdir(os.path.join(self.staging1, channel))
+            mkdir(os.path.join(self.staging2, channel))
+            archive._to_json([self.message1, self.message2],
+                             os.path.join(self.staging1, channel, '2019-04-20.json'))
+            archive._to_json([self.message2, self.message3],
+                             os.path.join(self.staging2, channel, '2019-04-20.json'))
+
+    def test_parallel(self):
+        self._write_channels()
+        self.assertTrue(archive.merge_archives(self.destination, [self.staging1, self.staging2], 'json', workers=3))
+
+        # Verify the processes leave the same result on disk as a sequential merge would
+        for channel in ('general', 'random', 'dev'):
+            self.assertEqual([self.message1, self.message2, self.message3],
+                             archive.load_json(os.path.join(self.destination, channel, '2019-04-20.json')))
+        self.assertFalse(os.path.exists(self.staging1))
+        self.assertFalse(os.path.exists(self.staging2))
+
+    def test_channel_error(self):
+        self._write_channels()
+        os.remove(os.path.join(self.staging2, 'random', '2019-04-20.json'))
+        with open(os.path.join(self.staging2, 'random', '2019-04-20.jsonl'), 'w') as write_file:
+            write_file.write('{"ts": \n')
+
+        with self.assertRaises(archive.MergeError) as context:
+            archive.merge_archives(self.destination, [self.staging1, self.staging2], 'json', workers=2)
+
+        # Verify the other channels still merged and only the failed channel's downloads are kept
+        self.assertEqual(['random'], list(context.exception.errors))
+        for channel in ('general', 'dev'):
+            self.assertEqual([self.message1, self.message2, self.message3],
+                             archive.load_json(os.path.join(self.destination, channel, '2019-04-20.json')))
+        self.assertEqual(['random'], os.listdir(self.staging2))
+
+    def test_corrupt_destination(self):
+        self._write_channels()
+        storage.save_day_file([self.message1], os.path.join(self.destination, 'random'), '2019-04-20')
+        day_file = os.path.join(self.destination, 'random', '2019-04-20.json')
+        # truncated, but still valid json, so only its checksum gives it away
+        archive._to_json([], day_file)
+        archive._to_json([{'id': 'U1'}], os.path.join(self.staging1, 'users.json'))
+        with open(os.path.join(self.destination, 'users.json'), 'w') as write_file:
+            write_file.write('[{"id": "U1", "na')
+
+        with self.assertRaises(archive.MergeError) as context:
+            archive.merge_archives(self.destination, [self.staging1, self.staging2], 'json')
+
+        # Verify neither corrupt file was overwritten and their downloads are kept for the next run
+        self.assertEqual(['random', 'users.json'], sorted(context.exception.errors))
+        self.assertIsInstance(context.exception.errors['random'], checksums.ChecksumError)
+        self.assertEqual([], archive.load_json(day_file))
+        self.assertEqual(['random', 'users.json'], sorted(os.listdir(self.staging1)))
+        self.assertEqual([self.message1, self.message2, self.message3],
+                         archive.load_json(os.path.join(self.destination, 'general', '2019-04-20.json')))
+
+    def test_index(self):
+        archive._to_json([{'id': 'C1', 'name': 'general'}], os.path.join(self.destination, 'channels.json'))
+        archive._to_json([self.message1], os.path.join(self.destination, 'general', '2019-04-20.json'))
+        archive._to_json([self.message2], os.path.join(self.staging1, 'general', '2019-04-20.json'))
+        message_index = index.MessageIndex(index.index_path(self.destination))
+
+        archive.merge_archives(self.destination, self.staging1, 'json', index=message_index)
+
+        # Verify the merged day was indexed under the channel's id
+        self.assertEqual(['1555786317.000100', '1555786318.000100'],
+                         [row['ts'] for row in message_index.query(channel_id='C1')])
+        message_index.close()
+
+    def test_new_archive(self):
+        remove(self.destination)
+        archive._to_json([self.message1], os.path.join(self.staging1, 'general', '2019-04-20.json'))
+        self.assertTrue(archive.merge_archives(self.destination, self.staging1))
+        self.assertTrue(os.path.exists(os.path.join(self.destination, 'general', '2019-04-20.json')))
 
 
-# TODO
 class MainTestSuite(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.folder = 'fake-main-workspace'
+        self.cleanup()
+        self.parent = {'type': 'message', 'user': 'U1', 'text': 'parent', 'ts': '1555786317.000100',
+                       'thread_ts': '1555786317.000100', 'reply_count': 1, 'latest_reply': '1555786367.000100'}
+        self.reply = {'type': 'message', 'user': 'U2', 'text': 'reply', 'ts': '1555786367.000100',
+                      'thread_ts': self.parent['ts']}
+        self.next_day = {'type': 'message', 'user': 'U1', 'text': 'next day', 'ts': '1555872717.000100'}
+        self.channel = {'id': 'C1', 'name': 'general', 'is_channel': True, 'latest': {'ts': self.next_day['ts']}}
+        self.fake = FakeSlack(team={'id': 'T1', 'domain': self.folder}, users=[{'id': 'U1'}, {'id': 'U2'}],
+                              conversations=[self.channel],
+                              messages={'C1': [self.parent, self.reply, self.next_day]})
+        self.fake.start()
+        unthrottled = {tier: (6000, 100) for tier in archive.limiter.tiers}
+        self.patches = [patch('slack_archive.archive.SlackSession', partial(SlackSession, base_url=self.fake.url)),
+                        patch.dict(archive.limiter.tiers, unthrottled),
+                        patch.dict(archive.limiter.buckets, clear=True),
+                        patch.dict(archive.settings, {'direct_ingest': True, 'message_index': False,
+                                                      'download_attachments': False, 'thread_repoll_days': None,
+                                                      'run_report': None, 'prometheus_textfile': None})]
+        for i in self.patches:
+            i.start()
 
     def tearDown(self):
-        pass
+        for i in reversed(self.patches):
+            i.stop()
+        self.fake.stop()
+        self.cleanup()
+
+    def cleanup(self):
+        remove(self.folder)
+        for name in os.listdir('.'):
+            if name.startswith(self.folder + '.') or name.startswith(self.folder + '-delta'):
+                os.remove(name)
+
+    def day_files(self):
+        channel_path = os.path.join(self.folder, 'C1')
+        return {date: os.stat(os.path.join(channel_path, file_name)).st_mtime_ns
+                for date, file_name in storage.list_day_files(channel_path).items()}
 
     def test_basic(self):
-        self.assertTrue(False)
+        archive.main('token')
+
+        # Verify the first run saved the history with the thread's replies, moved the cursor and packaged it all
+        self.assertEqual({'C1': self.next_day['ts']}, state.CursorIndex(os.path.join(self.folder, 'cursors.json')).data)
+        self.assertEqual([self.parent, self.reply],
+                         archive.load_json(os.path.join(self.folder, 'C1', '2019-04-20.json')))
+        self.assertEqual([self.next_day], archive.load_json(os.path.join(self.folder, 'C1', '2019-04-21.json')))
+        self.assertTrue(os.path.exists(self.folder + '.zip'))
+        saved = self.day_files()
+
+        archive.main('token')
+
+        # Verify a run with nothing new rewrote no day file and wrote no delta
+        self.assertEqual(saved, self.day_files())
+        self.assertEqual([], packaging.load_manifest(self.folder)['deltas'])
+        self.assertFalse(os.path.exists(self.folder + '-delta-0001.zip'))
+        self.assertEqual({'C1': self.next_day['ts']}, state.CursorIndex(os.path.join(self.folder, 'cursors.json')).data)
+
+        later = {'type': 'message', 'user': 'U2', 'text': 'later', 'ts': '1555872817.000100'}
+        self.fake.add_messages('C1', [later])
+        self.channel['latest'] = {'ts': later['ts']}
+        archive.main('token')
+
+        # Verify a new message is merged straight into its day and only that day goes in the delta
+        self.assertEqual({'C1': later['ts']}, state.CursorIndex(os.path.join(self.folder, 'cursors.json')).data)
+        self.assertEqual([self.next_day, later], archive.load_json(os.path.join(self.folder, 'C1', '2019-04-21.json')))
+        with zipfile.ZipFile(self.folder + '-delta-0001.zip') as zip_file:
+            self.assertIn('C1/2019-04-21.json', zip_file.namelist())
+            self.assertNotIn('C1/2019-04-20.json', zip_file.namelist())
+
+    def calls_avoided(self):
+        with open(self.folder + '.run-report.json') as read_file:
+            return json.load(read_file)['counters']['calls_avoided']['']
+
+    def test_skipped_channel(self):
+        archive.main('token')
+        archive.main('token')
+
+        # Verify the history read back for the skipped channel's thread is taken off the calls skipping it saved
+        self.assertEqual(0, self.calls_avoided())
+        self.assertFalse(os.path.exists(self.folder + '-delta-0001.zip'))
+
+        reply = {'type': 'message', 'user': 'U1', 'text': 'late reply', 'ts': '1555786400.000100',
+                 'thread_ts': self.parent['ts']}
+        self.fake.add_messages('C1', [reply])
+        self.parent.update(reply_count=2, latest_reply=reply['ts'])
+        archive.main('token')
+
+        # Verify the reply to the skipped channel's thread was saved and packaged
+        self.assertEqual(reply, archive.load_json(os.path.join(self.folder, 'C1', '2019-04-20.json'))[-1])
+        with zipfile.ZipFile(self.folder + '-delta-0001.zip') as zip_file:
+            self.assertIn('C1/2019-04-20.json', zip_file.namelist())
+
+    def test_reply_without_messages(self):
+        # without its latest message the channel is downloaded every run
+        del self.channel['latest']
+        archive.main('token')
+        reply = {'type': 'message', 'user': 'U1', 'text': 'late reply', 'ts': '1555786400.000100',
+                 'thread_ts': self.parent['ts']}
+        self.fake.add_messages('C1', [reply])
+        self.parent.update(reply_count=2, latest_reply=reply['ts'])
+        archive.main('token')
+
+        # Verify a reply found with no new message in the channel is still packaged
+        with zipfile.ZipFile(self.folder + '-delta-0001.zip') as zip_file:
+            self.assertIn('C1/2019-04-20.json', zip_file.namelist())
 
 
 def remove(path):
@@ -0,0 +1,131 @@
+import unittest
+import os
+import hashlib
+import json
+import shutil
+import time
+from slack_archive import attachments, storage
+from slack_archive.client import SlackSession
+from slack_archive.fake_slack import FakeSlack
+
+
+class DownloadAttachmentsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_attachments_archive'
+        self.store_folder = os.path.join(self.folder, attachments.ATTACHMENTS_FOLDER)
+        self.fake = FakeSlack()
+        self.fake.start()
+        self.data = b'report contents ' * 1000
+        self.url = self.fake.add_file('F1/report.pdf', self.data)
+        self.file1 = {'id': 'F1', 'name': 'report.pdf', 'mimetype': 'application/pdf', 'url_private': self.url}
+        # the same bytes uploaded again under another file id
+        self.file2 = dict(self.file1, id='F2', url_private=self.fake.add_file('F2/copy.pdf', self.data))
+        self.deleted = {'id': 'F3', 'mode': 'tombstone'}
+        for channel in ('general', 'random'):
+            os.makedirs(os.path.join(self.folder, channel))
+            storage.save_day_file([{'ts': '1555786317.000100', 'files': [self.file1, self.deleted]},
+                                   {'ts': '1555786318.000100', 'files': [self.file2]}],
+                                  os.path.join(self.folder, channel), '2019-04-20')
+        self.session = SlackSession(pool_size=2, sleep=lambda seconds: None)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_stored_once(self):
+        self.assertEqual(2, attachments.download_attachments(self.folder, self.session, workers=2))
+
+        # Verify the file shared twice in two channels was downloaded once per id and stored once
+        self.assertEqual(2, self.fake.calls['files'])
+        self.assertEqual([self.sha256], os.listdir(os.path.join(self.store_folder, 'objects', self.sha256[:2])))
+        with open(os.path.join(self.store_folder, attachments.MANIFEST_FILE)) as read_file:
+            manifest = json.load(read_file)
+        self.assertEqual({'sha256': self.sha256, 'size': len(self.data), 'name': 'report.pdf',
+                          'mimetype': 'application/pdf', 'channels': ['general', 'random']}, manifest['F1'])
+        self.assertEqual(['F1', 'F2'], sorted(manifest))
+
+    def test_already_downloaded(self):
+        attachments.download_attachments(self.folder, self.session)
+        self.assertEqual(0, attachments.download_attachments(self.folder, self.session))
+        self.assertEqual(2, self.fake.calls['files'])
+
+    def test_resume_partial(self):
+        os.makedirs(self.store_folder)
+        with open(os.path.join(self.store_folder, '.F1.part'), 'wb') as write_file:
+            write_file.write(self.data[:5000])
+
+        store = attachments.AttachmentStore(self.store_folder)
+        self.assertEqual(self.sha256, store.fetch(self.session, self.file1, ['general']))
+
+        # Verify only the rest of the file was asked for and the partial file is gone
+        self.assertEqual(['bytes=5000-'], self.fake.ranges)
+        with open(store.blob_path(self.sha256), 'rb') as read_file:
+            self.assertEqual(self.data, read_file.read())
+        self.assertFalse(os.path.exists(os.path.join(self.store_folder, '.F1.part')))
+
+    def test_server_error_retried(self):
+        self.fake.queue_error('files', 503)
+        self.assertEqual(2, attachments.download_attachments(self.folder, self.session, workers=1))
+        self.assertEqual(3, self.fake.calls['files'])
+
+    def test_failed_download(self):
+        self.fake.queue_error('files', 500)
+        session = SlackSession(retries=0)
+        self.assertEqual(1, attachments.download_attachments(self.folder, session, workers=1))
+        self.assertEqual(1, attachments.download_attachments(self.folder, session, workers=1))
+
+    def test_failed_download_retried(self):
+        self.fake.queue_error('files', 500)
+        session = SlackSession(retries=0)
+        self.assertEqual(1, attachments.download_attachments(self.folder, session, workers=1))
+
+        # Verify a later run only looking at newer day files still downloads the file that failed
+        self.assertEqual(1, attachments.download_attachments(self.folder, session, workers=1,
+                                                             modified_since=time.time() + 60))
+        store = attachments.AttachmentStore(self.store_folder)
+        self.assertTrue(store.has('F1') and store.has('F2'))
+        self.assertEqual({}, store.pending)
+        self.assertEqual(0, attachments.download_attachments(self.folder, session, modified_since=time.time() + 60))
+
+    def _write_partial(self, data):
+        os.makedirs(self.store_folder)
+        with open(os.path.join(self.store_folder, '.F1.part'), 'wb') as write_file:
+            write_file.write(data)
+        return attachments.AttachmentStore(self.store_folder)
+
+    def test_complete_partial(self):
+        store = self._write_partial(self.data)
+        self.assertEqual(self.sha256, store.fetch(self.session, dict(self.file1, size=len(self.data))))
+
+        # Verify the range past the end of the file was taken as the file being complete as it matches its size
+        self.assertEqual(['bytes={}-'.format(len(self.data))], self.fake.ranges)
+        self.assertTrue(store.has('F1'))
+
+    def test_unchecked_partial_restarted(self):
+        store = self._write_partial(self.data + b'left over')
+        self.assertEqual(self.sha256, store.fetch(self.session, self.file1))
+
+        # Verify the range past the end of the file wasn't trusted without a size and the file was downloaded again
+        self.assertEqual(['bytes={}-'.format(len(self.data) + 9), None], self.fake.ranges)
+        with open(store.blob_path(self.sha256), 'rb') as read_file:
+            self.assertEqual(self.data, read_file.read())
+
+    def test_oversized_partial_dropped(self):
+        store = self._write_partial(self.data + b'left over')
+        self.assertEqual(self.sha256, store.fetch(self.session, dict(self.file1, size=len(self.data))))
+        self.assertEqual([None], self.fake.ranges)
+
+    def test_short_download(self):
+        store = attachments.AttachmentStore(self.store_folder)
+        with self.assertRaises(OSError):
+            store.fetch(self.session, dict(self.file1, size=len(self.data) + 1))
+
+        # Verify the file isn't stored and what came down is kept to carry on from
+        self.assertFalse(store.has('F1'))
+        self.assertEqual(len(self.data), os.path.getsize(os.path.join(self.store_folder, '.F1.part')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from slack_archive import benchmark
+
+
+class RunBenchmarkTestSuite(unittest.TestCase):
+
+    def test_small_workspace(self):
+        report = benchmark.run_benchmark(channels=2, messages_per_day=5, thread_depth=2, years=0.05)
+
+        # Verify every phase was timed over the whole generated history
+        self.assertEqual(list(benchmark.PHASES), list(report['phases']))
+        self.assertEqual(report['messages'], report['phases']['fetch']['items'])
+        self.assertTrue(all(result['seconds'] >= 0 for result in report['phases'].values()))
+        self.assertEqual(2, report['config']['channels'])
+
+
+class CompareReportsTestSuite(unittest.TestCase):
+
+    def test_regression(self):
+        baseline = {'phases': {'fetch': {'seconds': 1.0}, 'package': {'seconds': 2.0}}}
+        current = {'phases': {'fetch': {'seconds': 1.1, 'items': 10}, 'package': {'seconds': 3.0, 'items': None},
+                              'extract_date': {'seconds': 0.1, 'items': None}}}
+
+        comparison = benchmark.compare_reports(baseline, current, threshold=0.2)
+
+        # Verify only phases beyond the threshold regress and phases missing from the baseline are skipped
+        self.assertFalse(comparison['fetch']['regressed'])
+        self.assertTrue(comparison['package']['regressed'])
+        self.assertEqual(1.5, comparison['package']['ratio'])
+        self.assertNotIn('extract_date', comparison)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os
+import shutil
+from unittest.mock import patch
+from slack_archive import checksums, storage
+
+
+class ChecksumsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_checksums_channel'
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        self.path, _ = storage.save_day_file([{'ts': '1555786317.000100'}], self.folder, '2019-04-20')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def recorded(self, file_name):
+        entry = checksums.load_manifest(self.folder)[file_name]
+        return entry['sha256'], entry['size']
+
+    def test_recorded_on_write(self):
+        sharded, _ = storage.save_day_file([{'ts': '1557786317.000100'}], self.folder, '2019-05-13', 'jsonl.gz',
+                                           'sharded')
+
+        manifest = checksums.load_manifest(self.folder)
+        self.assertEqual(['2019-04-20.json', '2019/05/13.jsonl.gz'], sorted(manifest))
+        self.assertEqual(checksums.file_checksum(sharded), (manifest['2019/05/13.jsonl.gz']['sha256'],
+                                                            manifest['2019/05/13.jsonl.gz']['size']))
+        self.assertTrue(checksums.check(self.folder, self.path))
+
+    def test_forgotten_on_replace(self):
+        storage.save_day_file([{'ts': '1555786317.000100'}], self.folder, '2019-04-20', 'jsonl')
+        self.assertEqual(['2019-04-20.jsonl'], list(checksums.load_manifest(self.folder)))
+
+    def test_mismatch(self):
+        with open(self.path, 'a') as write_file:
+            write_file.write(' ')
+        with self.assertRaises(checksums.ChecksumError):
+            checksums.check(self.folder, self.path)
+
+        # Verify a change that keeps the size is caught by the hash
+        with open(self.path, 'r+') as write_file:
+            write_file.write('{' + write_file.read()[1:-1])
+        with self.assertRaises(checksums.ChecksumError):
+            checksums.check(self.folder, self.path)
+
+    def test_unrecorded(self):
+        os.remove(checksums.manifest_path(self.folder))
+        self.assertFalse(checksums.check(self.folder, self.path))
+
+    def test_torn_line(self):
+        # Verify a line cut off by a crash mid append doesn't stop the rest of the manifest loading
+        with open(checksums.manifest_path(self.folder), 'a') as write_file:
+            write_file.write('{"path": "2019-04-21.json", "sha2')
+        self.assertEqual(['2019-04-20.json'], list(checksums.load_manifest(self.folder)))
+
+    def test_compact(self):
+        # Verify the superseded lines for the one file were dropped, leaving the compacted line, the pending line
+        # of the last write and the line recording it
+        with patch.object(checksums, 'COMPACT_SLACK', 0):
+            for _ in range(3):
+                storage.save_day_file([{'ts': '1555786317.000100'}], self.folder, '2019-04-20')
+        with open(checksums.manifest_path(self.folder)) as read_file:
+            self.assertEqual(3, len(read_file.readlines()))
+        self.assertTrue(checksums.check(self.folder, self.path))
+
+    def test_crash_before_recorded(self):
+        with patch.object(checksums, 'record', side_effect=OSError('crashed')):
+            with self.assertRaises(OSError):
+                storage.save_day_file([{'ts': '1555786317.000100'}, {'ts': '1555786318.000100'}], self.folder,
+                                      '2019-04-20')
+
+        # Verify the file renamed into place before the crash still checks out, and gets recorded when it does
+        self.assertTrue(checksums.check(self.folder, self.path))
+        self.assertEqual(checksums.file_checksum(self.path), self.recorded('2019-04-20.json'))
+        self.assertEqual({'checked': 1, 'mismatched': [], 'missing': [], 'unrecorded': []},
+                         storage.verify_archive(self.folder))
+
+    def test_crash_before_replace(self):
+        with patch('slack_archive.storage.os.replace', side_effect=OSError('crashed')):
+            with self.assertRaises(OSError):
+                storage.save_day_file([{'ts': '1555786317.000100'}], self.folder, '2019-04-21')
+
+        # Verify neither the old file nor the one never written are reported
+        self.assertTrue(checksums.check(self.folder, self.path))
+        self.assertEqual({'checked': 1, 'mismatched': [], 'missing': [], 'unrecorded': []},
+                         storage.verify_archive(self.folder))
+
+    def test_written_checksum(self):
+        with patch.object(checksums, 'file_checksum', wraps=checksums.file_checksum) as mocked_checksum:
+            path, _ = storage.save_day_file([{'ts': '1557786317.000100'}], self.folder, '2019-05-13', 'jsonl.gz')
+
+        # Verify the checksum taken while writing is the file's and the file wasn't read back for it
+        mocked_checksum.assert_not_called()
+        self.assertEqual(checksums.file_checksum(path), self.recorded('2019-05-13.jsonl.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from slacker import Slacker
+from slack_archive import archive
+from slack_archive.client import SlackSession, api_method_name
+from slack_archive.fake_slack import FakeSlack
+from slack_archive.rate_limit import RateLimiter
+from unittest.mock import MagicMock, patch
+import requests
+
+
+class SlackSessionTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSlack(conversations=[{'id': 'C1', 'name': 'general'}],
+                              messages={'C1': [{'ts': '1555786317.000100'}]})
+        self.fake.start()
+        self.sleeps = []
+        self.session = self.fake.session(retries=2, sleep=self.sleeps.append)
+        self.slack = Slacker('token', session=self.session)
+        self.limiter = RateLimiter(tiers={3: (6000, 100)})
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_api_method_name(self):
+        self.assertEqual('conversations.history', api_method_name('https://slack.com/api/conversations.history'))
+        self.assertEqual('files-pri', api_method_name('https://files.slack.com/files-pri/T1-F1/report.pdf'))
+
+    def test_server_errors_retried(self):
+        self.fake.queue_error('conversations.history', 503)
+        self.fake.queue_error('conversations.history', 500)
+
+        messages = archive.retrieve_messages(self.slack.conversations, 'C1', 0, rate_limiter=self.limiter)
+
+        # Verify the read recovered after backing off with jitter below the exponential cap
+        self.assertEqual([{'ts': '1555786317.000100'}], messages)
+        self.assertEqual(3, self.fake.calls['conversations.history'])
+        self.assertEqual(2, len(self.sleeps))
+        self.assertTrue(0 <= self.sleeps[0] <= 0.5 and 0 <= self.sleeps[1] <= 1)
+        stats = self.session.report()['conversations.history']
+        self.assertEqual((3, 2, 0), (stats['calls'], stats['retries'], stats['errors']))
+
+    def test_retries_bounded(self):
+        for _ in range(3):
+            self.fake.queue_error('team.info', 502)
+        with self.assertRaises(requests.HTTPError):
+            self.slack.team.info()
+        self.assertEqual(3, self.fake.calls['team.info'])
+        self.assertEqual(1, self.session.report()['team.info']['errors'])
+
+    def test_writes_not_retried(self):
+        self.fake.queue_error('chat.postMessage', 503)
+        with self.assertRaises(requests.HTTPError):
+            self.slack.chat.post_message('C1', 'hello')
+        self.assertEqual(1, self.fake.calls['chat.postMessage'])
+
+    def test_rate_limit_left_to_limiter(self):
+        self.fake.queue_error('conversations.history', 429, {'Retry-After': '0'})
+        archive.retrieve_messages(self.slack.conversations, 'C1', 0, rate_limiter=self.limiter)
+        self.assertEqual(0, self.session.report()['conversations.history']['retries'])
+
+    def test_timeouts(self):
+        session = SlackSession(timeout=5, method_timeouts={'conversations.history': 60})
+        with patch('requests.Session.request', return_value=MagicMock(status_code=200)) as mocked_request:
+            session.request('GET', 'https://slack.com/api/conversations.history')
+            session.request('GET', 'https://slack.com/api/users.list', timeout=None)
+        self.assertEqual(60, mocked_request.call_args_list[0][1]['timeout'])
+        self.assertEqual(5, mocked_request.call_args_list[1][1]['timeout'])
+
+    def test_connection_error_retried(self):
+        session = SlackSession(retries=1, sleep=self.sleeps.append)
+        response = MagicMock(status_code=200)
+        with patch('requests.Session.request', side_effect=[requests.ConnectionError(), response]):
+            self.assertEqual(response, session.request('GET', 'https://slack.com/api/users.list'))
+        self.assertEqual(1, len(self.sleeps))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+from cryptography.fernet import Fernet
+from slack_archive import config
+
+
+class LoadCrypterTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='slack-archive-key-')
+        self.path = os.path.join(self.folder, 'project.key')
+        with open(self.path, 'wb') as write_file:
+            write_file.write(Fernet.generate_key())
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_round_trip(self):
+        crypter = config.load_crypter(self.path)
+        self.assertEqual('xoxp-token', crypter.decrypt(crypter.encrypt('xoxp-token')))
+
+    def test_environment(self):
+        with patch.dict(os.environ, {'SLACK_ARCHIVE_KEY_FILE': self.path}):
+            self.assertEqual(self.path, config.key_path())
+            crypter = config.load_crypter()
+        self.assertEqual('xoxp-token', config.load_crypter(self.path).decrypt(crypter.encrypt('xoxp-token')))
+
+    def test_missing_key(self):
+        missing = os.path.join(self.folder, 'missing.key')
+        with self.assertRaises(SystemExit) as context:
+            config.load_crypter(missing)
+        self.assertIn(missing, str(context.exception.code))
+
+    def test_the_crypter(self):
+        with patch.dict(os.environ, {'SLACK_ARCHIVE_KEY_FILE': self.path}):
+            crypter = config.the_crypter
+        self.assertEqual('xoxp-token', config.load_crypter(self.path).decrypt(crypter.encrypt('xoxp-token')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import io
+import json
+import os
+import shutil
+import unittest
+import zipfile
+from unittest.mock import patch
+from slack_archive import export, state, storage
+
+
+class ZipWriterTestSuite(unittest.TestCase):
+
+    def write(self, members):
+        buffer = io.BytesIO()
+        zip_writer = export.ZipWriter(buffer, (2019, 4, 20, 12, 30, 10))
+        for name, data in members:
+            zip_writer.add(*export._compress(name, data, export.DEFAULT_LEVEL))
+        zip_writer.close()
+        buffer.seek(0)
+        return zipfile.ZipFile(buffer)
+
+    def test_readable(self):
+        members = [('users.json', b'[]'), ('général/2019-04-20.json', b'[{"ts": "1"}]' * 100), ('empty.json', b'')]
+        with self.write(members) as export_zip:
+            self.assertIsNone(export_zip.testzip())
+            self.assertEqual([name for name, _ in members], export_zip.namelist())
+            self.assertEqual(members[1][1], export_zip.read(members[1][0]))
+            self.assertEqual((2019, 4, 20, 12, 30, 10), export_zip.getinfo('users.json').date_time)
+
+    def test_zip64(self):
+        # Verify the zip64 records are written and read back once sizes, offsets and counts outgrow the limits
+        members = [('{}.json'.format(number), b'[]' * number) for number in range(5)]
+        with patch.object(export, 'ZIP64_LIMIT', 1), patch.object(export, 'ZIP64_COUNT_LIMIT', 3):
+            with self.write(members) as export_zip:
+                self.assertIsNone(export_zip.testzip())
+                self.assertEqual([data for _, data in members], [export_zip.read(name) for name, _ in members])
+
+
+class ExportArchiveTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_export_archive'
+        self.output = os.path.join('fake_export', 'export.zip')
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        self.users = [{'id': 'U1', 'name': 'bob'}]
+        storage.write_records(self.users, os.path.join(self.folder, 'users.json'))
+        self.general = {'id': 'C1', 'name': 'general'}
+        self.secret = {'id': 'G1', 'name': 'secret', 'is_private': True}
+        self.group_dm = {'id': 'G2', 'name': 'mpdm-bob--alice-1', 'is_mpim': True}
+        self.dm = {'id': 'D1', 'is_im': True, 'user': 'U1'}
+        storage.write_records([self.general], os.path.join(self.folder, 'channels.json'))
+        storage.write_records([self.secret, self.group_dm], os.path.join(self.folder, 'groups.json'))
+        storage.write_records([self.dm], os.path.join(self.folder, 'dms.json'))
+        state.ChannelAliases(os.path.join(self.folder, state.ALIASES_FILE)).add('old-general', 'C1')
+        self.message1 = {'ts': '1555718400.000100', 'text': 'first of 2019-04-20'}
+        self.message2 = {'ts': '1555786317.000100', 'text': 'later on 2019-04-20'}
+        self.message3 = {'ts': '1557786317.000100', 'text': '2019-05-13'}
+        storage.save_day_file([self.message1, self.message2], os.path.join(self.folder, 'C1'), '2019-04-20', 'json',
+                              'sharded')
+        storage.save_day_file([self.message3], os.path.join(self.folder, 'C1'), '2019-05-13', 'jsonl.gz')
+        storage.save_day_file([self.message1], os.path.join(self.folder, 'G1'), '2019-04-20')
+        storage.save_day_file([self.message2], os.path.join(self.folder, 'D1'), '2019-04-20', 'jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        shutil.rmtree('fake_export', ignore_errors=True)
+
+    def read(self, export_zip, name):
+        return json.loads(export_zip.read(name).decode('utf-8'))
+
+    def test_everything(self):
+        self.assertEqual(4, export.export_archive(self.folder, self.output, workers=2))
+
+        with zipfile.ZipFile(self.output) as export_zip:
+            self.assertIsNone(export_zip.testzip())
+            self.assertEqual(['users.json', 'channels.json', 'groups.json', 'mpims.json', 'dms.json',
+                              'general/2019-04-20.json', 'general/2019-05-13.json', 'D1/2019-04-20.json',
+                              'secret/2019-04-20.json'], export_zip.namelist())
+            self.assertEqual(self.users, self.read(export_zip, 'users.json'))
+            self.assertEqual([self.general], self.read(export_zip, 'channels.json'))
+            self.assertEqual([self.secret], self.read(export_zip, 'groups.json'))
+            self.assertEqual([self.group_dm], self.read(export_zip, 'mpims.json'))
+            self.assertEqual([self.dm], self.read(export_zip, 'dms.json'))
+            self.assertEqual([self.message1, self.message2], self.read(export_zip, 'general/2019-04-20.json'))
+            self.assertEqual([self.message3], self.read(export_zip, 'general/2019-05-13.json'))
+        # Verify nothing but the zip was written
+        self.assertEqual(['export.zip'], os.listdir('fake_export'))
+
+    def test_channels_and_range(self):
+        exported = export.export_archive(self.folder, self.output, ['old-general', 'D1'], 1555718400.0002,
+                                         '2019-05-01', workers=1)
+
+        self.assertEqual(2, exported)
+        with zipfile.ZipFile(self.output) as export_zip:
+            self.assertEqual(['users.json', 'channels.json', 'dms.json', 'general/2019-04-20.json',
+                              'D1/2019-04-20.json'], export_zip.namelist())
+            self.assertEqual([self.general], self.read(export_zip, 'channels.json'))
+            # Verify a range ending part way through a day filters its messages
+            self.assertEqual([self.message2], self.read(export_zip, 'general/2019-04-20.json'))
+
+    def test_nothing_in_range(self):
+        # Verify day files with no message in the range are left out rather than written empty
+        self.assertEqual(0, export.export_archive(self.folder, self.output, ['C1'], 1555786400, '2019-04-21'))
+        with zipfile.ZipFile(self.output) as export_zip:
+            self.assertEqual(['users.json', 'channels.json'], export_zip.namelist())
+
+    def test_taken_name(self):
+        storage.write_records([self.general, {'id': 'C2', 'name': 'general'}],
+                              os.path.join(self.folder, 'channels.json'))
+        storage.save_day_file([self.message3], os.path.join(self.folder, 'C2'), '2019-05-13')
+
+        export.export_archive(self.folder, self.output, ['C2'])
+
+        with zipfile.ZipFile(self.output) as export_zip:
+            self.assertIn('C2/2019-05-13.json', export_zip.namelist())
+
+    def test_failed(self):
+        with patch.object(export.ZipWriter, 'close', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                export.export_archive(self.folder, self.output)
+        # Verify the half written zip is removed
+        self.assertEqual([], os.listdir('fake_export'))
+
+
+if __name__ == '__main__':
+    unittest.main()
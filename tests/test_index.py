@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+from slack_archive import index, storage
+
+
+class MessageIndexTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_index_archive'
+        self.channel = os.path.join(self.folder, 'general')
+        os.makedirs(self.channel)
+        storage.write_records([{'id': 'C1', 'name': 'general'}], os.path.join(self.folder, 'channels.json'))
+        self.message1 = {'ts': '1555786317.000100', 'user': 'U1', 'text': 'The invoice is attached'}
+        self.message2 = {'ts': '1555786318.000100', 'user': 'U2', 'thread_ts': '1555786317.000100',
+                         'text': 'Which invoice?'}
+        self.message3 = {'ts': '1557786317.000100', 'user': 'U1', 'text': 'Invoice attached again'}
+        self.day1, _ = storage.save_day_file([self.message1, self.message2], self.channel, '2019-04-20')
+        self.day2, _ = storage.save_day_file([self.message3], self.channel, '2019-05-13', 'jsonl')
+        self.index = index.MessageIndex(index.index_path(self.folder))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_channel_ids(self):
+        self.assertEqual({'general': 'C1', 'C1': 'C1'}, index.channel_ids(self.folder))
+
+    def test_rebuild(self):
+        self.assertEqual(3, self.index.rebuild(self.folder))
+
+        # Verify every filter narrows the lookup and rows point back to the day file
+        self.assertEqual(['1555786317.000100', '1557786317.000100'],
+                         [row['ts'] for row in self.index.query(user='U1')])
+        rows = self.index.query(channel_id='C1', user='U1', start='2019-05-01', end='2019-06-01')
+        self.assertEqual([{'channel_id': 'C1', 'ts': '1557786317.000100', 'user': 'U1', 'thread_ts': None,
+                           'date': '2019-05-13', 'day_file': 'general/2019-05-13.jsonl'}], rows)
+        self.assertEqual(['1555786318.000100'],
+                         [row['ts'] for row in self.index.query(thread_ts='1555786317.000100')])
+        self.assertEqual(1, len(self.index.query(limit=1)))
+
+    def test_replace_day(self):
+        self.index.rebuild(self.folder)
+        self.index.replace_day('C1', '2019-04-20', self.day1, [self.message2])
+
+        # Verify messages no longer in the day are dropped from the index
+        self.assertEqual(['1555786318.000100', '1557786317.000100'], [row['ts'] for row in self.index.query()])
+
+    def test_tokenize(self):
+        self.assertEqual({'which', 'invoice', 'no_2'}, index.tokenize('Which invoice? No_2, INVOICE'))
+        self.assertEqual(set(), index.tokenize(None))
+
+    def test_search(self):
+        self.index.rebuild(self.folder)
+
+        # Verify every term has to match and the filters narrow the posting lists searched
+        self.assertEqual([{'channel_id': 'C1', 'date': '2019-04-20', 'ts': '1555786317.000100'},
+                          {'channel_id': 'C1', 'date': '2019-05-13', 'ts': '1557786317.000100'}],
+                         self.index.search('attached INVOICE'))
+        self.assertEqual(['1557786317.000100'],
+                         [hit['ts'] for hit in self.index.search('invoice', start='2019-05-01')])
+        self.assertEqual(['1555786317.000100'], [hit['ts'] for hit in self.index.search('invoice', limit=1)])
+        self.assertEqual([], self.index.search('invoice', channel_id='C2'))
+        self.assertEqual([], self.index.search('invoice missing'))
+        self.assertEqual([], self.index.search('?'))
+
+    def test_search_after_replace_day(self):
+        self.index.rebuild(self.folder)
+        self.index.replace_day('C1', '2019-04-20', self.day1, [dict(self.message1, text='edited')])
+        self.assertEqual(['1557786317.000100'], [hit['ts'] for hit in self.index.search('invoice')])
+
+    def test_load_messages(self):
+        self.index.rebuild(self.folder)
+        self.assertEqual([self.message1, self.message3], self.index.load_messages(self.index.query(user='U1')))
+
+
+if __name__ == '__main__':
+    unittest.main()
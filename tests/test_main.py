@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import zipfile
+from unittest.mock import patch
+from slack_archive import __main__ as cli
+from slack_archive import checksums, storage
+
+
+class MigrateFormatTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_cli_archive'
+        self.channel = os.path.join(self.folder, 'general')
+        os.makedirs(self.channel)
+        storage.save_day_file([{'ts': '1555786317.685288'}], self.channel, '2019-04-20', 'json')
+        storage.write_records([{'id': 'C1', 'name': 'general'}], os.path.join(self.folder, 'channels.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_migrate_format(self):
+        cli.main(['migrate-format', self.folder, '--format', 'jsonl.gz'])
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl.gz'], sorted(os.listdir(self.channel)))
+
+    def test_migrate_layout(self):
+        cli.main(['reindex', self.folder])
+        cli.main(['migrate-layout', self.folder])
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.json'],
+                         sorted(os.listdir(os.path.join(self.folder, 'C1'))))
+        self.assertFalse(os.path.exists(self.channel))
+
+        # Verify the index was rebuilt to point at the moved day files and old names still find the channel
+        with patch('builtins.print') as mocked_print:
+            cli.main(['query', self.folder, '--channel', 'general'])
+        mocked_print.assert_called_once_with('C1\t2019-04-20\t1555786317.685288\t\tC1/2019-04-20.json')
+
+    def test_migrate_layout_and_format(self):
+        cli.main(['migrate-format', self.folder, '--layout', 'sharded'])
+        self.assertEqual(['20.json'], os.listdir(os.path.join(self.channel, '2019', '04')))
+        with self.assertRaises(SystemExit):
+            cli.main(['migrate-format', self.folder])
+
+    def test_query(self):
+        cli.main(['reindex', self.folder])
+        with patch('builtins.print') as mocked_print:
+            cli.main(['query', self.folder, '--channel', 'general', '--start', '2019-04-20', '--end', '2019-04-21'])
+        mocked_print.assert_called_once_with('C1\t2019-04-20\t1555786317.685288\t\tgeneral/2019-04-20.json')
+
+    def test_search(self):
+        storage.save_day_file([{'ts': '1555786318.685288', 'text': 'quarterly report'}], self.channel, '2019-04-20')
+        cli.main(['reindex', self.folder])
+        with patch('builtins.print') as mocked_print:
+            cli.main(['search', self.folder, 'Report'])
+        mocked_print.assert_called_once_with('C1\t2019-04-20\t1555786318.685288')
+
+    def test_export(self):
+        with patch('builtins.print') as mocked_print:
+            cli.main(['export', self.folder, os.path.join(self.folder, 'export.zip'), '--channel', 'general'])
+        mocked_print.assert_called_once_with('Exported 1 day files to {}'.format(os.path.join(self.folder,
+                                                                                              'export.zip')))
+        with zipfile.ZipFile(os.path.join(self.folder, 'export.zip')) as export_zip:
+            self.assertIn('general/2019-04-20.json', export_zip.namelist())
+
+    def test_verify(self):
+        with patch('builtins.print') as mocked_print:
+            cli.main(['verify', self.folder])
+        mocked_print.assert_called_once_with('Verified 1 day files: 0 mismatched, 0 missing, 0 unrecorded')
+
+        day_file = os.path.join(self.channel, '2019-04-20.json')
+        with open(day_file, 'a') as write_file:
+            write_file.write('\n')
+        with patch('builtins.print') as mocked_print, self.assertRaises(SystemExit):
+            cli.main(['verify', self.folder, '--workers', '2'])
+        mocked_print.assert_any_call('mismatched\t{}'.format(day_file))
+
+    def test_query_without_index(self):
+        with self.assertRaises(SystemExit):
+            cli.main(['query', self.folder])
+
+    def test_default_command(self):
+        self.assertEqual(cli.run_archive, cli.parse_args([]).func)
+
+
+if __name__ == '__main__':
+    unittest.main()
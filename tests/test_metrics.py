@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import unittest
+from slacker import Slacker
+from slack_archive import archive
+from slack_archive.fake_slack import FakeSlack
+from slack_archive.metrics import RunMetrics, metrics, prometheus_text, write_json_report, write_prometheus_textfile
+from slack_archive.rate_limit import RateLimiter
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RunMetricsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = RunMetrics(clock=self.clock)
+
+    def test_phase(self):
+        with self.metrics.phase('download'):
+            self.clock.now += 2.5
+        with self.metrics.phase('download'):
+            self.clock.now += 1.0
+
+        self.assertEqual({'download': {'seconds': 3.5, 'count': 2}}, self.metrics.phases)
+
+    def test_phase_failed(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.phase('merge'):
+                self.clock.now += 1.0
+                raise ValueError('corrupt day file')
+
+        # Verify the time spent before the failure still counts
+        self.assertEqual({'merge': {'seconds': 1.0, 'count': 1}}, self.metrics.phases)
+
+    def test_timed(self):
+        @self.metrics.timed('parse')
+        def parse(value):
+            self.clock.now += 0.25
+            return value * 2
+
+        self.assertEqual(4, parse(2))
+        self.assertEqual(6, parse(3))
+        self.metrics.add_time('parse', 0.5)
+        self.assertEqual({'parse': {'seconds': 1.0, 'count': 3}}, self.metrics.timers)
+
+    def test_count(self):
+        self.metrics.count('pages_fetched', label='conversations.history')
+        self.metrics.count('pages_fetched', 2, label='conversations.history')
+        self.metrics.count('pages_fetched', label='conversations.replies')
+        self.metrics.count('bytes_written', 100)
+
+        self.assertEqual({'conversations.history': 3, 'conversations.replies': 1},
+                         self.metrics.counters['pages_fetched'])
+        self.assertEqual(4, self.metrics.total('pages_fetched'))
+        self.assertEqual(100, self.metrics.total('bytes_written'))
+        self.assertEqual(0, self.metrics.total('day_files_merged'))
+
+    def test_report(self):
+        with self.metrics.phase('zip'):
+            self.clock.now += 1.5
+        self.metrics.count('bytes_written', 10)
+        limiter = RateLimiter(sleep=lambda seconds: None)
+        limiter.throttled = {'conversations.history': 2.0, 'users.list': 0.5}
+        session = type('Session', (), {'report': lambda self: {'users.list': {'calls': 1}}})()
+
+        report = self.metrics.report(session, limiter)
+
+        self.assertEqual(1.5, report['seconds'])
+        self.assertEqual({'zip': {'seconds': 1.5, 'count': 1}}, report['phases'])
+        self.assertEqual({'bytes_written': {'': 10}}, report['counters'])
+        self.assertEqual({'users.list': {'calls': 1}}, report['api'])
+        self.assertEqual({'conversations.history': 2.0, 'users.list': 0.5}, report['throttled'])
+        self.assertEqual(2.5, report['throttled_seconds'])
+
+    def test_reset(self):
+        with self.metrics.phase('zip'):
+            self.clock.now += 1.5
+        self.metrics.count('bytes_written', 10)
+
+        self.metrics.reset()
+
+        report = self.metrics.report()
+        self.assertEqual(0, report['seconds'])
+        self.assertEqual({}, report['phases'])
+        self.assertEqual({}, report['counters'])
+
+
+class ExportTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.report = {
+            'started': '2019-04-20T00:00:00Z',
+            'seconds': 12.5,
+            'phases': {'download': {'seconds': 10.0, 'count': 1}},
+            'timers': {'parse': {'seconds': 0.5, 'count': 4}},
+            'counters': {'pages_fetched': {'conversations.history': 7}, 'bytes_written': {'': 2048}},
+            'api': {'conversations.history': {'calls': 7, 'retries': 1, 'errors': 0, 'seconds': 3.5,
+                                              'max_seconds': 1.0}},
+            'throttled': {'conversations.history': 2.0},
+            'throttled_seconds': 2.0,
+        }
+
+    def tearDown(self):
+        shutil.rmtree('fake_metrics', ignore_errors=True)
+
+    def test_prometheus_text(self):
+        lines = prometheus_text(self.report).splitlines()
+
+        self.assertIn('# TYPE slack_archive_run_seconds gauge', lines)
+        self.assertIn('slack_archive_run_seconds 12.5', lines)
+        self.assertIn('slack_archive_phase_seconds{phase="download"} 10.0', lines)
+        self.assertIn('slack_archive_timer_calls{timer="parse"} 4', lines)
+        self.assertIn('slack_archive_pages_fetched{label="conversations.history"} 7', lines)
+        self.assertIn('slack_archive_bytes_written 2048', lines)
+        self.assertIn('slack_archive_api_retries{method="conversations.history"} 1', lines)
+        self.assertIn('slack_archive_throttled_seconds{method="conversations.history"} 2.0', lines)
+
+    def test_write(self):
+        write_json_report(self.report, os.path.join('fake_metrics', 'run-report.json'))
+        write_prometheus_textfile(self.report, os.path.join('fake_metrics', 'slack_archive.prom'))
+
+        with open(os.path.join('fake_metrics', 'run-report.json')) as read_file:
+            self.assertEqual(self.report, json.load(read_file))
+        with open(os.path.join('fake_metrics', 'slack_archive.prom')) as read_file:
+            self.assertIn('slack_archive_run_seconds 12.5\n', read_file.read())
+        # Verify no temporary files are left behind
+        self.assertEqual(['run-report.json', 'slack_archive.prom'], sorted(os.listdir('fake_metrics')))
+
+
+class InstrumentationTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        shutil.rmtree('fake_metrics', ignore_errors=True)
+
+    def test_pages_fetched(self):
+        messages = [{'ts': '1555786317.{:06d}'.format(number)} for number in range(5)]
+        with FakeSlack(conversations=[{'id': 'C1', 'name': 'general'}], messages={'C1': messages}) as fake:
+            slack = Slacker('token', session=fake.session())
+            archive.retrieve_messages(slack.conversations, 'C1', 0, page_size=2,
+                                      rate_limiter=RateLimiter(tiers={3: (6000, 100)}))
+
+        self.assertEqual({'conversations.history': 3}, metrics.counters['pages_fetched'])
+
+    def test_bytes_written_and_merged(self):
+        folder = os.path.join('fake_metrics', 'general')
+        os.makedirs(folder)
+        archive.save_day([{'ts': '1555786317.000100'}], folder, '2019-04-20')
+        archive.save_day([{'ts': '1555786318.000100'}], folder, '2019-04-20', append=True)
+
+        self.assertEqual(1, metrics.total('day_files_merged'))
+        self.assertGreater(metrics.total('bytes_written'), 0)
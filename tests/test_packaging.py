@@ -0,0 +1,96 @@
+import unittest
+import os
+import json
+import shutil
+import zipfile
+from slack_archive import checksums, packaging, storage
+
+
+class PackageArchiveTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_workspace'
+        self.restored = 'fake_restored'
+        self.cleanup()
+        os.makedirs(os.path.join(self.folder, 'general'))
+        self.write('users.json', [{'id': 'U1'}])
+        self.write('general/2019-04-20.json', [{'ts': '1555786317.685288'}])
+        self.write('general/2019-04-21.json', [{'ts': '1555872717.685288'}])
+
+    def tearDown(self):
+        self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        shutil.rmtree(self.restored, ignore_errors=True)
+        for name in os.listdir('.'):
+            if name.startswith(self.folder + '.') or name.startswith(self.folder + '-delta'):
+                os.remove(name)
+
+    def write(self, path, data):
+        with open(os.path.join(self.folder, path), 'w') as write_file:
+            json.dump(data, write_file)
+        # make sure the change is visible even on filesystems with coarse timestamps
+        stat = os.stat(os.path.join(self.folder, path))
+        os.utime(os.path.join(self.folder, path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def test_first_package_is_full(self):
+        self.assertEqual('fake_workspace.zip', packaging.package_archive(self.folder))
+        with zipfile.ZipFile('fake_workspace.zip') as zip_file:
+            self.assertEqual(['general/2019-04-20.json', 'general/2019-04-21.json', 'users.json'],
+                             sorted(zip_file.namelist()))
+
+    def test_nothing_changed(self):
+        packaging.package_archive(self.folder)
+        self.assertIsNone(packaging.package_archive(self.folder))
+
+    def test_delta_only_holds_changes(self):
+        packaging.package_archive(self.folder)
+        self.write('general/2019-04-21.json', [{'ts': '1555872717.685288'}, {'ts': '1555872718.685288'}])
+        self.write('general/2019-04-22.json', [{'ts': '1555959117.685288'}])
+        os.remove(os.path.join(self.folder, 'general/2019-04-20.json'))
+
+        delta = packaging.package_archive(self.folder)
+
+        self.assertEqual('fake_workspace-delta-0001.zip', delta)
+        with zipfile.ZipFile(delta) as zip_file:
+            self.assertEqual(['delta_manifest.json', 'general/2019-04-21.json', 'general/2019-04-22.json'],
+                             sorted(zip_file.namelist()))
+            delta_manifest = json.loads(zip_file.read('delta_manifest.json'))
+        self.assertEqual(['general/2019-04-20.json'], delta_manifest['deleted'])
+
+        # the full zip plus the delta should rebuild the folder exactly
+        packaging.unpack_archive(self.folder, self.restored)
+        self.assertEqual(sorted(packaging.scan_folder(self.folder)), sorted(packaging.scan_folder(self.restored)))
+        with open(os.path.join(self.restored, 'general/2019-04-21.json')) as read_file:
+            self.assertEqual(2, len(json.load(read_file)))
+
+    def test_rebuilds_after_max_deltas(self):
+        packaging.package_archive(self.folder)
+        self.write('users.json', [{'id': 'U2'}])
+        packaging.package_archive(self.folder, max_deltas=1)
+        self.write('users.json', [{'id': 'U3'}])
+
+        self.assertEqual('fake_workspace.zip', packaging.package_archive(self.folder, max_deltas=1))
+        self.assertFalse(os.path.exists('fake_workspace-delta-0001.zip'))
+        self.assertEqual([], packaging.load_manifest(self.folder)['deltas'])
+
+    def test_restored_archive_verifies(self):
+        storage.save_day_file([{'ts': '1555959117.685288'}], os.path.join(self.folder, 'general'), '2019-04-22')
+        packaging.package_archive(self.folder)
+        storage.save_day_file([{'ts': '1556045517.685288'}], os.path.join(self.folder, 'general'), '2019-04-23')
+        packaging.package_archive(self.folder)
+
+        packaging.unpack_archive(self.folder, self.restored)
+
+        # Verify the checksum manifest came along with the day files, as rewritten by the delta
+        self.assertEqual(checksums.load_manifest(os.path.join(self.folder, 'general')),
+                         checksums.load_manifest(os.path.join(self.restored, 'general')))
+        report = storage.verify_archive(self.restored)
+        self.assertEqual([], report['mismatched'])
+        self.assertEqual([], report['missing'])
+        self.assertEqual(2, report['checked'] - len(report['unrecorded']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import requests
+from slack_archive import rate_limit
+from unittest.mock import MagicMock
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def too_many_requests(retry_after):
+    response = MagicMock()
+    response.status_code = 429
+    response.headers = {'Retry-After': str(retry_after)}
+    return requests.HTTPError(response=response)
+
+
+class TokenBucketTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = rate_limit.TokenBucket(60, 2, self.clock)
+
+    def test_burst_then_paced(self):
+        self.assertEqual(0, self.bucket.reserve())
+        self.assertEqual(0, self.bucket.reserve())
+        self.assertAlmostEqual(1.0, self.bucket.reserve())
+        self.assertAlmostEqual(2.0, self.bucket.reserve())
+
+    def test_refills_over_time(self):
+        self.bucket.reserve()
+        self.bucket.reserve()
+        self.clock.now += 1
+        self.assertAlmostEqual(0, self.bucket.reserve())
+
+    def test_block(self):
+        self.bucket.block(30)
+        self.assertAlmostEqual(30, self.bucket.reserve())
+
+
+class RateLimiterTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = rate_limit.RateLimiter(tiers={3: (60, 1)}, sleep=self.clock.sleep, clock=self.clock)
+
+    def test_paces_calls(self):
+        func = MagicMock(return_value='response')
+        for _ in range(3):
+            self.assertEqual('response', self.limiter.call('conversations.history', func))
+        self.assertAlmostEqual(2.0, self.limiter.throttled_time)
+        self.assertEqual({'conversations.history': {'calls': 3, 'throttled': 2.0}}, self.limiter.report())
+
+    def test_methods_have_separate_budgets(self):
+        func = MagicMock()
+        self.limiter.call('conversations.history', func)
+        self.limiter.call('conversations.replies', func)
+        self.assertEqual(0, self.limiter.throttled_time)
+
+    def test_backs_off_on_429(self):
+        func = MagicMock(side_effect=[too_many_requests(7), 'response'])
+        self.assertEqual('response', self.limiter.call('users.list', func))
+        self.assertEqual(2, func.call_count)
+        self.assertAlmostEqual(7.0, self.limiter.throttled_time)
+
+    def test_gives_up_after_retries(self):
+        self.limiter.retries = 1
+        func = MagicMock(side_effect=[too_many_requests(1), too_many_requests(1)])
+        with self.assertRaises(requests.HTTPError):
+            self.limiter.call('users.list', func)
+
+    def test_other_errors_not_retried(self):
+        response = MagicMock()
+        response.status_code = 500
+        func = MagicMock(side_effect=requests.HTTPError(response=response))
+        with self.assertRaises(requests.HTTPError):
+            self.limiter.call('users.list', func)
+        self.assertEqual(1, func.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import shutil
+from datetime import datetime
+from slack_archive import reader, state, storage
+
+
+class ReaderTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_reader_archive'
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        storage.write_records([{'id': 'C1', 'name': 'general'}, {'id': 'C2', 'name': 'random'}],
+                              os.path.join(self.folder, 'channels.json'))
+        state.ChannelAliases(os.path.join(self.folder, state.ALIASES_FILE)).add('old-general', 'C1')
+        self.message1 = {'ts': '1555718400.000100', 'text': 'first of 2019-04-20'}
+        self.message2 = {'ts': '1555786317.000100', 'text': 'later on 2019-04-20'}
+        self.message3 = {'ts': '1557786317.000100', 'text': '2019-05-13'}
+        self.message4 = {'ts': '1555786318.000100', 'text': 'random'}
+        general = os.path.join(self.folder, 'C1')
+        storage.save_day_file([self.message1, self.message2], general, '2019-04-20', 'json', 'sharded')
+        storage.save_day_file([self.message3], general, '2019-05-13', 'jsonl.gz')
+        storage.save_day_file([self.message4], os.path.join(self.folder, 'C2'), '2019-04-20', 'jsonl')
+        os.makedirs(os.path.join(self.folder, '.attachments'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_every_channel(self):
+        self.assertEqual([('C1', self.message1), ('C1', self.message2), ('C1', self.message3), ('C2', self.message4)],
+                         list(reader.iter_messages(self.folder)))
+
+    def test_channels_by_name(self):
+        self.assertEqual([self.message1, self.message2, self.message3],
+                         list(reader.iter_channel(self.folder, 'old-general')))
+        self.assertEqual([('C2', self.message4)], list(reader.iter_messages(self.folder, ['random', 'missing'])))
+
+    def test_day_range(self):
+        self.assertEqual([self.message3], list(reader.iter_channel(self.folder, 'C1', '2019-04-21', '2019-06-01')))
+        self.assertEqual([], list(reader.iter_channel(self.folder, 'C1', '2019-04-21', '2019-05-13')))
+
+    def test_time_range(self):
+        # Verify bounds part way through a day filter the messages rather than the whole day
+        messages = reader.iter_channel(self.folder, 'C1', 1555718400.0002, datetime(2019, 5, 13, 22, 25, 17))
+        self.assertEqual([self.message2], list(messages))
+        self.assertEqual([self.message1], list(reader.iter_channel(self.folder, 'C1', end=1555718400.0002)))
+
+    def test_iter_days(self):
+        self.assertEqual([('C1', '2019-04-20', os.path.join(self.folder, 'C1', '2019', '04', '20.json'))],
+                         list(reader.iter_days(self.folder, ['C1'], '2019-04-01', '2019-05-01')))
+
+    def test_mmap(self):
+        self.assertEqual(list(reader.iter_messages(self.folder)), list(reader.iter_messages(self.folder,
+                                                                                            use_mmap=True)))
+
+    def test_legacy_folder(self):
+        os.rename(os.path.join(self.folder, 'C2'), os.path.join(self.folder, 'random'))
+        self.assertEqual([('C2', self.message4)], list(reader.iter_messages(self.folder, ['C2'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import os
+import json
+import shutil
+from slack_archive import state
+
+
+class CursorIndexTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_state_folder'
+        self.path = os.path.join(self.folder, 'cursors.json')
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_missing_index(self):
+        cursors = state.CursorIndex(self.path)
+        self.assertEqual(5, cursors.get('C1', 5))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_update_persists(self):
+        cursors = state.CursorIndex(self.path)
+        cursors.update('C1', '1555786317.685288')
+
+        with open(self.path) as read_file:
+            self.assertEqual({'C1': '1555786317.685288'}, json.load(read_file))
+        self.assertEqual('1555786317.685288', state.CursorIndex(self.path).get('C1'))
+        # no temporary files should be left behind
+        self.assertEqual(['cursors.json'], os.listdir(self.folder))
+
+    def test_never_moves_backwards(self):
+        cursors = state.CursorIndex(self.path)
+        cursors.update('C1', '1555786317.685288')
+        cursors.update('C1', '1455786317.685288')
+        self.assertEqual('1555786317.685288', cursors.get('C1'))
+
+
+class ThreadStateTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_state_folder'
+        self.path = os.path.join(self.folder, 'threads.json')
+        self.parent = {'ts': '1555786317.000100', 'thread_ts': '1555786317.000100', 'reply_count': 2,
+                       'latest_reply': '1555786400.000100'}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_changed(self):
+        threads = state.ThreadState(self.path)
+        self.assertTrue(threads.changed('C1', self.parent))
+        self.assertFalse(threads.changed('C1', {'ts': '1555786317.000100'}))
+        self.assertFalse(threads.changed('C1', dict(self.parent, reply_count=0)))
+
+        threads.update('C1', self.parent['ts'], 2, '1555786400.000100')
+
+        # Verify only a new reply, seen on the parent or broadcast to the channel, flags the thread again
+        self.assertFalse(state.ThreadState(self.path).changed('C1', self.parent))
+        self.assertTrue(threads.changed('C1', dict(self.parent, reply_count=3, latest_reply='1555786500.000100')))
+        broadcast = {'ts': '1555786500.000100', 'thread_ts': self.parent['ts'], 'subtype': 'thread_broadcast'}
+        self.assertTrue(threads.changed('C1', broadcast))
+        self.assertFalse(threads.changed('C1', dict(broadcast, ts='1555786400.000100')))
+        self.assertTrue(threads.changed('C2', self.parent))
+
+    def test_update_threads(self):
+        threads = state.ThreadState(self.path)
+        threads.update('C1', '1555786000.000100', 1, '1555786100.000100')
+
+        threads.update_threads('C1', {self.parent['ts']: (2, '1555786400.000100'),
+                                      '1555786350.000100': (1, '1555786360.000100')}, since=1555786300)
+
+        # Verify the threads were saved together and the one last replied to before since was forgotten
+        self.assertEqual({self.parent['ts']: {'reply_count': 2, 'latest_reply': '1555786400.000100'},
+                          '1555786350.000100': {'reply_count': 1, 'latest_reply': '1555786360.000100'}},
+                         state.ThreadState(self.path).data['C1'])
+
+        threads.update_threads('C1', {}, since=1555786500)
+        self.assertEqual({}, state.ThreadState(self.path).data)
+
+
+class CheckpointsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_state_folder'
+        self.path = os.path.join(self.folder, 'checkpoints.json')
+        self.checkpoint = {'oldest': 0, 'latest': '1555786317.000100', 'newest': '1555796317.000100', 'threads': []}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_save_and_clear(self):
+        checkpoints = state.Checkpoints(self.path)
+        self.assertIsNone(checkpoints.get('C1'))
+        checkpoints.save('C1', self.checkpoint)
+        self.assertEqual(self.checkpoint, state.Checkpoints(self.path).get('C1'))
+
+        checkpoints.clear('C1')
+        self.assertIsNone(state.Checkpoints(self.path).get('C1'))
+
+
+class ChannelAliasesTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_state_folder'
+        self.path = os.path.join(self.folder, state.ALIASES_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_update(self):
+        aliases = state.ChannelAliases(self.path)
+        aliases.update([{'id': 'C1', 'name': 'general'}, {'id': 'D1', 'user': 'U1'}])
+        aliases.update([{'id': 'C1', 'name': 'announcements'}])
+
+        # Verify the old name still points at the channel and ims are left out
+        self.assertEqual('C1', state.ChannelAliases(self.path).get('general'))
+        self.assertEqual(['announcements', 'general'], aliases.names('C1'))
+        self.assertIsNone(aliases.get('D1'))
+
+    def test_name_taken_by_another_channel(self):
+        aliases = state.ChannelAliases(self.path)
+        aliases.add('general', 'C1')
+        aliases.add('general', 'C2')
+        self.assertEqual('C2', aliases.get('general'))
+        self.assertEqual([], aliases.names('C1'))
+
+    def test_unchanged_not_saved(self):
+        aliases = state.ChannelAliases(self.path)
+        aliases.update([{'id': 'D1'}])
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
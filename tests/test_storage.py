@@ -0,0 +1,233 @@
+import unittest
+import io
+import os
+import json
+import shutil
+from unittest.mock import patch
+from slack_archive import checksums, storage
+
+
+class SplitExtTestSuite(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(('2019-04-20', '.json'), storage.split_ext('2019-04-20.json'))
+        self.assertEqual(('2019-04-20', '.jsonl'), storage.split_ext('2019-04-20.jsonl'))
+        self.assertEqual(('2019-04-20', '.jsonl.gz'), storage.split_ext('2019-04-20.jsonl.gz'))
+        self.assertEqual(('2019-04-20', '.jsonl.zst'), storage.split_ext('2019-04-20.jsonl.zst'))
+
+    def test_not_a_day(self):
+        self.assertIsNone(storage.split_ext('users.json'))
+        self.assertIsNone(storage.split_ext('.2019-04-20.json.tmp'))
+
+
+class WriteRecordsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_storage_folder'
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        self.records = [{'ts': '1555786317.685288', 'text': 'café'}, {'ts': '1555786318.685288', 'text': 'b'}]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def round_trip(self, storage_format):
+        path = os.path.join(self.folder, storage.day_file_name('2019-04-20', storage_format))
+        size = storage.write_records(iter(self.records), path, storage_format)
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertEqual(self.records, storage.read_records(path))
+        self.assertEqual([os.path.basename(path)], os.listdir(self.folder))
+        return path
+
+    def test_json(self):
+        with open(self.round_trip('json')) as read_file:
+            self.assertEqual(self.records, json.load(read_file))
+
+    def test_compact(self):
+        with open(self.round_trip('compact')) as read_file:
+            self.assertNotIn('\n', read_file.read())
+
+    def test_jsonl(self):
+        with open(self.round_trip('jsonl')) as read_file:
+            self.assertEqual(2, len(read_file.readlines()))
+
+    def test_jsonl_gz(self):
+        self.round_trip('jsonl.gz')
+
+    @unittest.skipIf(storage.zstandard is None, 'zstandard is not installed')
+    def test_jsonl_zst(self):
+        self.round_trip('jsonl.zst')
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            storage.write_records(self.records, os.path.join(self.folder, 'x'), 'xml')
+
+    def test_save_day_file_replaces_other_formats(self):
+        storage.save_day_file(self.records, self.folder, '2019-04-20', 'json')
+        path, _ = storage.save_day_file(self.records, self.folder, '2019-04-20', 'jsonl.gz')
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl.gz'], sorted(os.listdir(self.folder)))
+        self.assertEqual(path, storage.find_day_file(self.folder, '2019-04-20'))
+        self.assertEqual({'2019-04-20': '2019-04-20.jsonl.gz'}, storage.list_day_files(self.folder))
+
+    def test_migrate(self):
+        channel = os.path.join(self.folder, 'general')
+        os.makedirs(channel)
+        storage.save_day_file(self.records, channel, '2019-04-20', 'json')
+        storage.save_day_file(self.records[:1], channel, '2019-04-21', 'jsonl')
+        with open(os.path.join(self.folder, 'users.json'), 'w') as write_file:
+            json.dump([{'id': 'U1'}], write_file)
+
+        self.assertEqual(2, storage.migrate(self.folder, 'jsonl.gz'))
+
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl.gz', '2019-04-21.jsonl.gz'],
+                         sorted(os.listdir(channel)))
+        self.assertEqual(self.records, storage.read_records(os.path.join(channel, '2019-04-20.jsonl.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.folder, 'users.json')))
+
+
+class IterRecordsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_storage_folder'
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        self.records = [{'ts': '1555786317.685288', 'text': 'café ' * 50, 'reactions': [{'count': 2.5}]}
+                        for _ in range(20)]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_json_streamed(self):
+        text = json.dumps(self.records, indent=4, ensure_ascii=False).encode('utf-8')
+        # reads far smaller than a message cut values and multi byte characters in two
+        self.assertEqual(self.records, list(storage._iter_json_array(io.BytesIO(text), read_size=3)))
+        self.assertEqual([], list(storage._iter_json_array(io.BytesIO(b' [ ] '))))
+
+    def test_truncated_json(self):
+        text = json.dumps(self.records).encode('utf-8')
+        with self.assertRaises(ValueError):
+            list(storage._iter_json_array(io.BytesIO(text[:-10])))
+        with self.assertRaises(ValueError):
+            list(storage._iter_json_array(io.BytesIO(text + b'{}')))
+
+    def test_mmap(self):
+        for storage_format in sorted(storage.EXTENSIONS):
+            path, _ = storage.save_day_file(self.records, self.folder, '2019-04-20', storage_format)
+            self.assertEqual(self.records, list(storage.iter_records(path, use_mmap=True)))
+        open(os.path.join(self.folder, 'empty.jsonl'), 'w').close()
+        self.assertEqual([], list(storage.iter_records(os.path.join(self.folder, 'empty.jsonl'), use_mmap=True)))
+
+
+class ShardedLayoutTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_storage_folder'
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.channel = os.path.join(self.folder, 'C1')
+        os.makedirs(self.channel)
+        self.records = [{'ts': '1555786317.685288'}]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_split_day_path(self):
+        self.assertEqual(('2019-04-20', '.jsonl.gz'), storage.split_day_path(os.path.join('C1', '2019', '04',
+                                                                                          '20.jsonl.gz')))
+        self.assertEqual(('2019-04-20', '.json'), storage.split_day_path(os.path.join('C1', '2019-04-20.json')))
+        self.assertIsNone(storage.split_day_path(os.path.join('C1', 'objects', '04', '20.json')))
+
+    def test_save_day_file(self):
+        path, _ = storage.save_day_file(self.records, self.channel, '2019-04-20', 'jsonl', 'sharded')
+
+        self.assertEqual(os.path.join(self.channel, '2019', '04', '20.jsonl'), path)
+        self.assertEqual(path, storage.find_day_file(self.channel, '2019-04-20'))
+        self.assertEqual({'2019-04-20': os.path.join('2019', '04', '20.jsonl')}, storage.list_day_files(self.channel))
+
+    def test_save_day_file_replaces_other_layout(self):
+        storage.save_day_file(self.records, self.channel, '2019-04-20', 'json', 'sharded')
+        storage.save_day_file(self.records, self.channel, '2019-04-20', 'json', 'flat')
+
+        # Verify the emptied shard folders are removed along with the old copy
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.json'], sorted(os.listdir(self.channel)))
+
+    def test_list_day_files_in_range(self):
+        for date in ('2018-12-31', '2019-04-19', '2019-04-20', '2019-05-01', '2020-01-01'):
+            storage.save_day_file(self.records, self.channel, date, 'json', 'sharded')
+        storage.save_day_file(self.records, self.channel, '2019-04-21', 'json', 'flat')
+
+        listed = []
+        original = os.listdir
+
+        def listdir(path):
+            listed.append(os.path.relpath(path, self.channel))
+            return original(path)
+
+        with patch('os.listdir', listdir):
+            days = storage.list_day_files(self.channel, '2019-04-20', '2019-05-01')
+
+        self.assertEqual(['2019-04-20', '2019-04-21'], sorted(days))
+        # Verify only the shards that can hold days in the range were listed
+        self.assertEqual(['.', '2019', os.path.join('2019', '04'), os.path.join('2019', '05')], sorted(listed))
+
+    def test_latest_day(self):
+        self.assertIsNone(storage.latest_day(self.channel))
+        storage.save_day_file(self.records, self.channel, '2019-04-20', 'json', 'sharded')
+        storage.save_day_file(self.records, self.channel, '2018-04-20', 'json', 'sharded')
+        os.makedirs(os.path.join(self.channel, '2020', '01'))
+        self.assertEqual('2019-04-20', storage.latest_day(self.channel))
+        storage.save_day_file(self.records, self.channel, '2019-04-21', 'json', 'flat')
+        self.assertEqual('2019-04-21', storage.latest_day(self.channel))
+
+    def test_migrate_layout(self):
+        storage.save_day_file(self.records, self.channel, '2019-04-20', 'jsonl.gz')
+        storage.save_day_file(self.records, self.channel, '2019-05-13', 'json')
+
+        self.assertEqual(2, storage.migrate(self.folder, layout='sharded'))
+        self.assertEqual({'2019-04-20': os.path.join('2019', '04', '20.jsonl.gz'),
+                          '2019-05-13': os.path.join('2019', '05', '13.json')}, storage.list_day_files(self.channel))
+        self.assertEqual(0, storage.migrate(self.folder, layout='sharded'))
+
+        self.assertEqual(2, storage.migrate(self.folder, 'jsonl', 'flat'))
+        self.assertEqual([checksums.MANIFEST_FILE, '2019-04-20.jsonl', '2019-05-13.jsonl'],
+                         sorted(os.listdir(self.channel)))
+        self.assertEqual(self.records, storage.read_records(os.path.join(self.channel, '2019-04-20.jsonl')))
+
+
+class VerifyArchiveTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'fake_verify_archive'
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.general = os.path.join(self.folder, 'C1')
+        self.random = os.path.join(self.folder, 'C2')
+        self.good, _ = storage.save_day_file([{'ts': '1555786317.000100'}], self.general, '2019-04-20')
+        self.corrupt, _ = storage.save_day_file([{'ts': '1557786317.000100'}], self.general, '2019-05-13',
+                                                'jsonl', 'sharded')
+        self.missing, _ = storage.save_day_file([{'ts': '1555786318.000100'}], self.random, '2019-04-20')
+        with open(self.corrupt, 'w') as write_file:
+            write_file.write('{"ts": "15577')
+        os.remove(self.missing)
+        # a day file saved before checksums were kept
+        self.unrecorded = os.path.join(self.random, '2019-04-21.json')
+        with open(self.unrecorded, 'w') as write_file:
+            json.dump([{'ts': '1555872718.000100'}], write_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_verify(self):
+        report = storage.verify_archive(self.folder, workers=2)
+
+        self.assertEqual({'checked': 3, 'mismatched': [self.corrupt], 'missing': [self.missing],
+                          'unrecorded': [self.unrecorded]}, report)
+
+    def test_record(self):
+        storage.verify_archive(self.folder, record=True)
+
+        # Verify the unrecorded file was recorded and the missing one forgotten, but the mismatch is still reported
+        self.assertEqual({'checked': 3, 'mismatched': [self.corrupt], 'missing': [], 'unrecorded': []},
+                         storage.verify_archive(self.folder))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from slack_archive import synthetic
+
+
+class GenerateWorkspaceTestSuite(unittest.TestCase):
+
+    def test_shape(self):
+        workspace = synthetic.generate_workspace(channels=3, messages_per_day=10, thread_depth=2, years=0.1,
+                                                 users=5, thread_every=5)
+        self.assertEqual(3, len(workspace['conversations']))
+        self.assertEqual(5, len(workspace['users']))
+        messages = workspace['messages']['C0000000']
+        # 36 days of 10 top level messages, two of which start a thread of two replies
+        self.assertEqual(36 * (10 + 2 * 2), len(messages))
+        self.assertEqual(sorted(messages, key=lambda message: float(message['ts']), reverse=True), messages)
+        self.assertEqual(messages[0]['ts'], workspace['conversations'][0]['latest']['ts'])
+
+    def test_threads(self):
+        messages = synthetic.generate_workspace(channels=1, messages_per_day=4, thread_depth=3, years=0.01,
+                                                thread_every=4)['messages']['C0000000']
+        parents = [message for message in messages if message.get('reply_count')]
+        replies = [message for message in messages if message.get('thread_ts', message['ts']) != message['ts']]
+        self.assertEqual(3 * len(parents), len(replies))
+        for parent in parents:
+            thread = [message['ts'] for message in replies if message['thread_ts'] == parent['ts']]
+            self.assertEqual(max(thread, key=float), parent['latest_reply'])
+
+    def test_repeatable(self):
+        self.assertEqual(synthetic.generate_workspace(channels=2, years=0.05, seed=3),
+                         synthetic.generate_workspace(channels=2, years=0.05, seed=3))
+        self.assertNotEqual(synthetic.generate_workspace(channels=2, years=0.05, seed=3),
+                            synthetic.generate_workspace(channels=2, years=0.05, seed=4))
+
+
+if __name__ == '__main__':
+    unittest.main()